@@ -1,67 +1,573 @@
 import argparse
+import collections
 import configparser
+import contextlib
 import logging
 import os
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from concurrent.futures.process import BrokenProcessPool
 import fitz  # PyMuPDF
-from src.utils.logging_config import setup_logging
+from src.utils.logging_config import log_context, logging_options, setup_logging
+from src.utils.metrics import get_metrics
+from src.utils.profiling import (
+    begin_page, configure_profiling, flush_profiles, profile_stage, write_profile_report
+)
+from src.utils.resources import (
+    CpuAllocator, CpuUtilization, ResourcePolicy, apply_thread_budget, available_cpus,
+    page_megapixels, thread_budget
+)
 
-def process_image(image_path, output_dir, config):
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tiff', '.bmp')
+COMPLETION_MARKER = '_complete.json'
+
+
+@contextlib.contextmanager
+def pipeline_stage(stage):
+    """
+    Profiles the enclosed code as stage and tags its log records with it.
+    """
+    with profile_stage(stage), log_context(stage=stage):
+        yield
+
+def process_image(image_path, output_dir, config, page_index=None, source=None):
     """
     Processes a single image file (preprocessing, OCR, HTML generation, RAG normalization).
+    With a page_index, the OCR of a known near-duplicate page is reused. source is the
+    (pdf_path, page_number) a PDF page was rasterized from.
     """
-    try:
-        base_name = os.path.splitext(os.path.basename(image_path))[0]
-        # Define output paths for this image
-        preprocessed_dir = os.path.join(output_dir, 'preprocessed')
-        ocr_dir = os.path.join(output_dir, 'ocr')
-        rag_dir = os.path.join(output_dir, 'rag')
-        html_dir = os.path.join(output_dir, 'html')
-
-        os.makedirs(preprocessed_dir, exist_ok=True)
-        os.makedirs(ocr_dir, exist_ok=True)
-        os.makedirs(rag_dir, exist_ok=True)
-        os.makedirs(html_dir, exist_ok=True)
-
-        preprocessed_image_path = os.path.join(preprocessed_dir, os.path.basename(image_path))
-
-        # --- Preprocessing ---
-        from src.preprocess import preprocess_image
-        preprocessed_path = preprocess_image(image_path, preprocessed_image_path)
-
-        # --- OCR ---
-        from src.ocr import run_ocr
-        psm = config.get('OCR', 'PSM', fallback='3')
-        alto_path = run_ocr(preprocessed_path, ocr_dir, psm)
-
-        # --- Normalize for RAG ---
-        from src.normalize_rag import generate_rag_json
-        rag_output_path = os.path.join(rag_dir, f"{base_name}.json")
-        rag_config = {
-            "publication_date": config.get('Metadata', 'PublicationDate', fallback=None),
-            "newspaper_title": config.get('Metadata', 'NewspaperTitle', fallback=None)
-        }
+    page_name = os.path.splitext(os.path.basename(image_path))[0]
+    with log_context(page=page_name):
+        try:
+            preprocessed_path = prepare_page(image_path, output_dir, config)
+            page = decode_page(preprocessed_path, config)
+
+            # --- OCR ---
+            with pipeline_stage('ocr'):
+                alto_path = run_or_reuse_ocr(preprocessed_path, os.path.join(output_dir, 'ocr'), config,
+                                             page_index, source, page)
+
+            return finish_page(image_path, output_dir, config, preprocessed_path, alto_path, page)
+
+        except Exception as e:
+            logging.error(f"Error processing image {image_path}: {e}")
+            return False
+
+
+def prepare_page(image_path, output_dir, config):
+    """
+    Creates the output directories of a page and preprocesses its image.
+    With [Preprocessing] Binarize, the page is stored as a 1-bit Group 4 TIFF.
+
+    Returns:
+        The path of the preprocessed image.
+    """
+    preprocessed_dir = os.path.join(output_dir, 'preprocessed')
+    for stage_dir in ('preprocessed', 'ocr', 'rag', 'html'):
+        os.makedirs(os.path.join(output_dir, stage_dir), exist_ok=True)
+
+    preprocessed_image_path = os.path.join(preprocessed_dir, os.path.basename(image_path))
+
+    begin_page()
+
+    # --- Preprocessing ---
+    from src.preprocess import preprocess_image
+    with pipeline_stage('preprocess'):
+        if config.getboolean('Preprocessing', 'Binarize', fallback=False):
+            base_name = os.path.splitext(preprocessed_image_path)[0]
+            return preprocess_image(image_path, f"{base_name}.tif", binarize=True)
+        return preprocess_image(image_path, preprocessed_image_path)
+
+
+def decode_page(preprocessed_path, config):
+    """
+    Decodes a page binarized by prepare_page once, as packed rows shared by
+    the stages that read the page after preprocessing (dedup, re-OCR and the
+    HTML illustration crops). Returns None if pages are not binarized; those
+    stages then read the preprocessed image themselves.
+    """
+    if not config.getboolean('Preprocessing', 'Binarize', fallback=False):
+        return None
+    from src.preprocess import PackedPage
+    with pipeline_stage('preprocess'):
+        return PackedPage.read(preprocessed_path)
+
+
+def finish_page(image_path, output_dir, config, preprocessed_path, alto_path, page=None):
+    """
+    Runs the stages that follow OCR (OCR cache, RAG normalization, HTML
+    generation) for a page. page is the page decoded by decode_page, if any.
+    """
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    rag_dir = os.path.join(output_dir, 'rag')
+    html_dir = os.path.join(output_dir, 'html')
+
+    # --- Binary OCR cache ---
+    with pipeline_stage('ocr'):
+        ocr_format = config.get('OCR', 'Format', fallback='alto')
+        if ocr_format in ('binary', 'both'):
+            from src.ocr_cache import write_ocr_cache
+            cache_path = write_ocr_cache(alto_path)
+            if ocr_format == 'binary':
+                os.remove(alto_path)
+            # Downstream stages load the cache instead of reparsing the XML.
+            alto_path = cache_path
+
+    # --- Normalize for RAG ---
+    from src.normalize_rag import generate_rag_json
+    rag_output_path = os.path.join(rag_dir, f"{base_name}.json")
+    rag_config = {
+        "publication_date": config.get('Metadata', 'PublicationDate', fallback=None),
+        "newspaper_title": config.get('Metadata', 'NewspaperTitle', fallback=None),
+        "articles": config.getboolean('Normalization', 'Articles', fallback=False),
+    }
+    with pipeline_stage('rag'):
         generate_rag_json(alto_path, rag_output_path, rag_config)
 
-        # --- Generate HTML ---
-        from src.generate_html import create_html_from_alto
-        html_output_path = os.path.join(html_dir, f"{base_name}.html")
-        image_dir_path = os.path.join(html_dir, 'images')
-        create_html_from_alto(alto_path, html_output_path, image_dir_path, preprocessed_path)
+    # --- Generate HTML ---
+    from src.generate_html import create_html_from_alto
+    html_output_path = os.path.join(html_dir, f"{base_name}.html")
+    image_dir_path = os.path.join(html_dir, 'images')
+    html_kwargs = {}
+    if is_packed_output(config):
+        # Archives are served from their own root, so link the scan relatively.
+        html_kwargs["scan_href"] = os.path.relpath(preprocessed_path, html_dir)
+    if config.getboolean('HTML', 'DeepZoom', fallback=False):
+        html_kwargs["deep_zoom"] = {
+            "tile_size": config.getint('HTML', 'TileSize', fallback=256),
+            "tile_format": config.get('HTML', 'TileFormat', fallback='jpg'),
+            # Encode tiles within the threads this page was given.
+            "workers": thread_budget(),
+        }
+    with pipeline_stage('html'):
+        create_html_from_alto(alto_path, html_output_path, image_dir_path, preprocessed_path,
+                              page=page, **html_kwargs)
+
+    # --- Copy CSS file ---
+    import shutil
+    css_source_path = 'src/style.css'
+    css_dest_path = os.path.join(html_dir, 'style.css')
+    if os.path.exists(css_source_path):
+        shutil.copy(css_source_path, css_dest_path)
+
+    logging.info(f"Successfully processed image: {image_path}")
+    return True
+
+
+def run_or_reuse_ocr(image_path, ocr_dir, config, page_index=None, source=None, page=None):
+    """
+    Runs OCR on a page with the [OCR] settings, or reuses the ALTO of a
+    near-duplicate page found in page_index, aligned to this page's size.
+    Newly OCR'd pages are added to the index. Text blocks with a mean word
+    confidence below [OCR] ReOcrConfidence are re-OCR'd on their own. page is
+    the page decoded by decode_page, if any.
+    """
+    return run_or_reuse_ocr_batch([image_path], [ocr_dir], config, page_index, [source], [page])[0]
+
+
+def run_or_reuse_ocr_batch(image_paths, ocr_dirs, config, page_index=None, sources=None, pages=None):
+    """
+    Like run_or_reuse_ocr, for several pages. The pages that need OCR go
+    through a single backend call where the backend supports batching.
+
+    Returns:
+        The ALTO paths, with None for pages whose OCR failed. A single page
+        raises instead.
+    """
+    from src.ocr import run_ocr, run_ocr_batch
+    from src.ocr_backends import get_backend
+
+    psm = config.get('OCR', 'PSM', fallback='3')
+    min_confidence = config.getfloat('OCR', 'ReOcrConfidence', fallback=0.0)
+    backend = config.get('OCR', 'Backend', fallback=None)
+    fallback = config.get('OCR', 'FallbackBackend', fallback=None)
+    sources = sources or [None] * len(image_paths)
+    pages = pages or [None] * len(image_paths)
+
+    alto_paths = [None] * len(image_paths)
+    fingerprints = {}
+    pending = []
+    for position, (image_path, ocr_dir) in enumerate(zip(image_paths, ocr_dirs)):
+        if page_index is not None:
+            alto_paths[position], fingerprints[position] = _reuse_ocr(image_path, ocr_dir, page_index,
+                                                                      pages[position])
+            if alto_paths[position] is not None:
+                continue
+        pending.append(position)
+
+    if len(image_paths) == 1 and pending:
+        results = [run_ocr(image_paths[0], ocr_dirs[0], psm, backend=backend,
+                           source=sources[0], fallback=fallback)]
+    elif pending:
+        results = run_ocr_batch([image_paths[position] for position in pending],
+                                [ocr_dirs[position] for position in pending], psm,
+                                backend=backend,
+                                sources=[sources[position] for position in pending],
+                                fallback=fallback)
+    else:
+        results = []
+
+    engine = get_backend(backend)
+    for position, alto_path in zip(pending, results):
+        if alto_path is None:
+            continue
+        if min_confidence > 0 and engine.provides_confidences and engine.supports_regions:
+            from src.reocr import refine_weak_blocks
+            refine_weak_blocks(image_paths[position], alto_path, min_confidence,
+                               backend=backend, page=pages[position])
+        if fingerprints.get(position) is not None:
+            page_index.add(*fingerprints[position], alto_path)
+        alto_paths[position] = alto_path
+    return alto_paths
+
+
+def _reuse_ocr(image_path, ocr_dir, page_index, page=None):
+    """
+    Reuses the OCR of a near-duplicate page found in page_index. page is
+    the page decoded by decode_page, if any.
+
+    Returns:
+        The reused ALTO path (or None) and the page's (hash, width, height)
+        fingerprint for adding it to the index (or None).
+    """
+    import cv2
+    from src.dedup import page_hash
+
+    metrics = get_metrics()
+    metrics.increment('ocr.pages')
+    image = page.unpack() if page is not None else cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if image is None:
+        return None, None
+    height, width = image.shape
+    fingerprint = page_hash(image)
+    match = page_index.find(fingerprint, width, height)
+    if match is None:
+        return None, (fingerprint, width, height)
+
+    record_id, distance = match
+    base_name = os.path.splitext(os.path.basename(image_path))[0]
+    alto_path = page_index.reuse(
+        record_id, width, height, os.path.join(ocr_dir, f"{base_name}.xml"),
+        os.path.basename(image_path),
+    )
+    metrics.increment('ocr.reused')
+    logging.info(f"Reused the OCR of indexed page {record_id} (distance {distance}) for {image_path}")
+    return alto_path, None
+
+
+def is_packed_output(config):
+    """
+    Returns True if documents are written as single archives instead of directory trees.
+    """
+    return config.get('Output', 'Mode', fallback='directories') == 'packed'
+
+
+def process_page(image_path, output_dir, config, archive=None, page_index=None, source=None):
+    """
+    Processes one page, either into output_dir or, in packed mode, into the
+    document archive.
+    """
+    if archive is None:
+        return process_image(image_path, output_dir, config, page_index, source)
+
+    page_name = os.path.splitext(os.path.basename(image_path))[0]
+    page_dir = archive.page_staging_dir(page_name)
+    succeeded = process_image(image_path, page_dir, config, page_index, source)
+    if succeeded:
+        archive.add_page(page_name, page_dir)
+    return succeeded
+
+
+def is_supported_file(file_name):
+    """
+    Returns True if the file is an image or PDF the pipeline can process.
+    """
+    return file_name.lower().endswith(IMAGE_EXTENSIONS + ('.pdf',))
+
+
+def process_file(file_path, output_dir, config):
+    """
+    Processes one input file (an image or a PDF) into its own directory
+    under output_dir.
+
+    Returns:
+        True if every page was processed successfully, False otherwise.
+    """
+    file_name = os.path.basename(file_path)
+    base_name = os.path.splitext(file_name)[0]
+
+    if not is_supported_file(file_name):
+        return False
+
+    from src.dedup import open_page_index
+    page_index = open_page_index(config, output_dir)
+
+    if is_packed_output(config):
+        from src.archive import PageArchive, ARCHIVE_SUFFIX
+        os.makedirs(output_dir, exist_ok=True)
+        archive_name = base_name + ARCHIVE_SUFFIX
+        with PageArchive(os.path.join(output_dir, archive_name), 'w') as archive:
+            succeeded, pages = _process_document(file_path, archive.staging_dir, config, archive, page_index)
+        if config.getboolean('Site', 'Index', fallback=False):
+            # Pages inside an archive cannot be linked from static files,
+            # so the document lists the archive instead of its pages.
+            update_site_index(output_dir, file_name, [(archive_name, archive_name)], config)
+        return succeeded
+
+    document_output_dir = os.path.join(output_dir, base_name)
+    os.makedirs(document_output_dir, exist_ok=True)
+    succeeded, pages = _process_document(file_path, document_output_dir, config, page_index=page_index)
+    finish_document(output_dir, file_name, pages, succeeded, config)
+    return succeeded
+
+
+def process_image_files(file_paths, output_dir, config):
+    """
+    Processes several image files, each into its own directory under
+    output_dir, with a single OCR invocation.
+
+    Returns:
+        Whether each file was processed successfully.
+    """
+    from src.dedup import open_page_index
+
+    pages = []
+    for file_path in file_paths:
+        document_output_dir = os.path.join(output_dir, os.path.splitext(os.path.basename(file_path))[0])
+        os.makedirs(document_output_dir, exist_ok=True)
+        pages.append((file_path, document_output_dir, None))
+    logging.info(f"Processing image files: {', '.join(map(os.path.basename, file_paths))}")
+    results = process_page_batch(pages, config, open_page_index(config, output_dir))
+    for file_path, succeeded in zip(file_paths, results):
+        file_name = os.path.basename(file_path)
+        page_names = [os.path.splitext(file_name)[0]] if succeeded else []
+        finish_document(output_dir, file_name, page_names, succeeded, config)
+    return results
+
+
+def process_pdf_shard(file_path, output_dir, first_page, stop_page, config):
+    """
+    Processes the pages first_page to stop_page - 1 (0-based) of a PDF into
+    the document's directory under output_dir. The document is finished
+    with finish_document once all of its shards are done.
+
+    Returns:
+        Whether every page of the shard succeeded, and the names of the
+        pages that did.
+    """
+    from src.dedup import open_page_index
+
+    base_name = os.path.splitext(os.path.basename(file_path))[0]
+    document_output_dir = os.path.join(output_dir, base_name)
+    os.makedirs(document_output_dir, exist_ok=True)
+    return _process_document(file_path, document_output_dir, config,
+                             page_index=open_page_index(config, output_dir),
+                             page_range=(first_page, stop_page))
+
+
+def process_service_batch(requests, output_dir, config):
+    """
+    Processes a micro-batch of OCR service requests with a single OCR
+    invocation. Each request is an (upload_path, page_number) tuple and is
+    processed into the directory of its upload; page_number selects the
+    page (0-based) of a PDF upload.
+
+    Returns:
+        Whether each request succeeded.
+    """
+    from src.dedup import open_page_index
+
+    pages = []
+    for upload_path, page_number in requests:
+        request_dir = os.path.dirname(upload_path)
+        if not upload_path.lower().endswith('.pdf'):
+            pages.append((upload_path, request_dir, None))
+            continue
+        image_path = os.path.join(request_dir, 'page.png')
+        try:
+            with pipeline_stage('pdf_rasterize'), fitz.open(upload_path) as pdf_document:
+                pixmap = pdf_document.load_page(page_number).get_pixmap()
+                pixmap.save(image_path)
+        except Exception as e:
+            logging.error(f"Error rasterizing page {page_number + 1} of {upload_path}: {e}")
+            # A missing image fails the page without failing the batch.
+        pages.append((image_path, request_dir, (upload_path, page_number)))
+    return process_page_batch(pages, config, open_page_index(config, output_dir))
+
+
+def finish_document(output_dir, file_name, pages, succeeded, config, shards=1):
+    """
+    Writes the completion marker of a document processed into a directory
+    and adds it to the collection index.
+    """
+    import json
+
+    base_name = os.path.splitext(file_name)[0]
+    # Page names are zero-padded to three digits, so longer names come later.
+    pages = sorted(pages, key=lambda page_name: (len(page_name), page_name))
+    marker_path = os.path.join(output_dir, base_name, COMPLETION_MARKER)
+    # No shard may have got as far as creating the directory.
+    os.makedirs(os.path.dirname(marker_path), exist_ok=True)
+    with open(marker_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({"succeeded": succeeded, "shards": shards, "pages": pages}, f, indent=4)
+    os.replace(marker_path + '.tmp', marker_path)
+
+    if config.getboolean('Site', 'Index', fallback=False):
+        page_links = [(page_name, os.path.join(base_name, 'html', f"{page_name}.html"))
+                      for page_name in pages]
+        update_site_index(output_dir, file_name, page_links, config)
+
+
+def update_site_index(output_dir, file_name, page_links, config):
+    """
+    Adds a processed document to the collection index, using the [Metadata]
+    values and falling back to a date found in the file name.
+    """
+    from src.site_index import SiteIndex, issue_date_from_name
+
+    site_index = SiteIndex(output_dir, config.getint('Site', 'PageSize', fallback=100))
+    site_index.add_document(
+        config.get('Metadata', 'NewspaperTitle', fallback=None),
+        config.get('Metadata', 'PublicationDate', fallback=None) or issue_date_from_name(file_name),
+        os.path.splitext(file_name)[0],
+        page_links,
+    )
+
+
+def _process_document(file_path, document_output_dir, config, archive=None, page_index=None,
+                      page_range=None):
+    """
+    Returns whether every page succeeded and the names of the pages that did.
+    For a PDF, page_range limits processing to a (start, stop) range of pages.
+    """
+    file_name = os.path.basename(file_path)
+    with log_context(document=file_name):
+        return _process_pages(file_path, document_output_dir, config, archive, page_index, page_range)
+
+
+def _process_pages(file_path, document_output_dir, config, archive, page_index, page_range):
+    file_name = os.path.basename(file_path)
+
+    if file_name.lower().endswith(IMAGE_EXTENSIONS):
+        logging.info(f"Processing image file: {file_name}")
+        page_name = os.path.splitext(file_name)[0]
+        succeeded = process_page(file_path, document_output_dir, config, archive, page_index)
+        return succeeded, [page_name] if succeeded else []
+
+    logging.info(f"Processing PDF file: {file_name}")
+
+    # Open the PDF
+    batch_size = config.getint('OCR', 'BatchSize', fallback=1)
+    batch = []
+    pages = []
+    pdf_document = fitz.open(file_path)
+    first_page, stop_page = page_range or (0, len(pdf_document))
+    page_count = stop_page - first_page
+    for page_num in range(first_page, stop_page):
+        with pipeline_stage('pdf_rasterize'):
+            page = pdf_document.load_page(page_num)
+            pixmap = page.get_pixmap()
+            image_bytes = pixmap.tobytes("png")
+            # Release the page's pixel buffer before the next page is rendered.
+            del pixmap, page
 
-        # --- Copy CSS file ---
-        import shutil
-        css_source_path = 'src/style.css'
-        css_dest_path = os.path.join(html_dir, 'style.css')
-        if os.path.exists(css_source_path):
-            shutil.copy(css_source_path, css_dest_path)
+            # Save the page as an image
+            page_image_path = os.path.join(document_output_dir, f"page_{page_num + 1:03}.png")
+            with open(page_image_path, "wb") as img_file:
+                img_file.write(image_bytes)
 
-        logging.info(f"Successfully processed image: {image_path}")
+        if batch_size > 1:
+            # Pages are OCR'd together once the batch is full.
+            batch.append((page_image_path, (file_path, page_num)))
+            if len(batch) == batch_size or page_num == stop_page - 1:
+                logging.info(f"Processing pages {page_num + 2 - len(batch)}-{page_num + 1} of {file_name}")
+                pages += _process_page_batch(batch, document_output_dir, config, archive, page_index)
+                batch = []
+            continue
 
+        logging.info(f"Processing page {page_num + 1} of {file_name}")
+        if process_page(page_image_path, document_output_dir, config, archive, page_index,
+                        (file_path, page_num)):
+            pages.append(f"page_{page_num + 1:03}")
+
+    pdf_document.close()
+    return len(pages) == page_count, pages
+
+
+def _process_page_batch(batch, document_output_dir, config, archive=None, page_index=None):
+    """
+    Processes several pages of a document, given as (image_path, source)
+    tuples, with a single OCR invocation.
+
+    Returns:
+        The names of the pages that succeeded.
+    """
+    pages = []
+    for image_path, source in batch:
+        page_name = os.path.splitext(os.path.basename(image_path))[0]
+        page_dir = document_output_dir if archive is None else archive.page_staging_dir(page_name)
+        pages.append((image_path, page_dir, source))
+
+    succeeded = []
+    for (image_path, page_dir, _), result in zip(pages, process_page_batch(pages, config, page_index)):
+        if not result:
+            continue
+        page_name = os.path.splitext(os.path.basename(image_path))[0]
+        if archive is not None:
+            archive.add_page(page_name, page_dir)
+        succeeded.append(page_name)
+    return succeeded
+
+
+def process_page_batch(pages, config, page_index=None):
+    """
+    Processes several pages, given as (image_path, output_dir, source)
+    tuples, with a single OCR invocation.
+
+    Returns:
+        Whether each page succeeded.
+    """
+    results = [False] * len(pages)
+    prepared = []
+    for position, (image_path, page_dir, source) in enumerate(pages):
+        page_name = os.path.splitext(os.path.basename(image_path))[0]
+        try:
+            with log_context(page=page_name):
+                preprocessed_path = prepare_page(image_path, page_dir, config)
+                page = decode_page(preprocessed_path, config)
+            prepared.append((position, image_path, page_name, page_dir, preprocessed_path, source, page))
+        except Exception as e:
+            logging.error(f"Error processing image {image_path}: {e}")
+
+    try:
+        with pipeline_stage('ocr'):
+            alto_paths = run_or_reuse_ocr_batch(
+                [page[4] for page in prepared],
+                [os.path.join(page[3], 'ocr') for page in prepared],
+                config, page_index,
+                [page[5] for page in prepared],
+                [page[6] for page in prepared],
+            )
     except Exception as e:
-        logging.error(f"Error processing image {image_path}: {e}")
+        # A batch of one page raises instead of returning None.
+        logging.error(f"Error running OCR on {prepared[0][1]}: {e}")
+        alto_paths = [None] * len(prepared)
+
+    for (position, image_path, page_name, page_dir, preprocessed_path, _, page), alto_path in zip(prepared,
+                                                                                                  alto_paths):
+        if alto_path is None:
+            logging.error(f"Error processing image {image_path}: OCR failed")
+            continue
+        try:
+            with log_context(page=page_name):
+                finish_page(image_path, page_dir, config, preprocessed_path, alto_path, page)
+        except Exception as e:
+            logging.error(f"Error processing image {image_path}: {e}")
+            continue
+        results[position] = True
+    return results
 
 
-def main(input_dir, output_dir, config_path):
+def main(input_dir, output_dir, config_path, profile=False, profile_sample=1):
     """
     Main pipeline to orchestrate the document processing.
     """
@@ -69,64 +575,277 @@ def main(input_dir, output_dir, config_path):
     logs_dir = os.path.join(output_dir, 'logs')
     os.makedirs(logs_dir, exist_ok=True)
 
-    # Setup logging
-    setup_logging(logs_dir)
-    logging.info("Starting the document processing pipeline.")
-
     # Load configuration
     config = configparser.ConfigParser()
     config.read(config_path)
 
+    # Setup logging
+    setup_logging(logs_dir, **logging_options(config))
+    logging.info("Starting the document processing pipeline.")
+
+    if profile:
+        configure_profiling(os.path.join(logs_dir, 'profiles'), profile_sample)
+
     logging.info(f"Configuration loaded from {config_path}")
 
+    policy = ResourcePolicy.from_config(config, _batch_workers(config))
+    utilization = CpuUtilization(len(policy.cpus))
+
     # Process each file in the input directory
     try:
-        for file_name in os.listdir(input_dir):
-            file_path = os.path.join(input_dir, file_name)
-            base_name = os.path.splitext(file_name)[0]
-
-            try:
-                if file_name.lower().endswith(('.png', '.jpg', '.jpeg', '.tiff', '.bmp')):
-                    logging.info(f"Processing image file: {file_name}")
-                    image_output_dir = os.path.join(output_dir, base_name)
-                    os.makedirs(image_output_dir, exist_ok=True)
-                    process_image(file_path, image_output_dir, config)
-
-                elif file_name.lower().endswith('.pdf'):
-                    logging.info(f"Processing PDF file: {file_name}")
-                    pdf_output_dir = os.path.join(output_dir, base_name)
-                    os.makedirs(pdf_output_dir, exist_ok=True)
-
-                    # Open the PDF
-                    pdf_document = fitz.open(file_path)
-                    for page_num in range(len(pdf_document)):
-                        page = pdf_document.load_page(page_num)
-                        image_bytes = page.get_pixmap().tobytes("png")
-
-                        # Save the page as an image
-                        page_image_path = os.path.join(pdf_output_dir, f"page_{page_num + 1:03}.png")
-                        with open(page_image_path, "wb") as img_file:
-                            img_file.write(image_bytes)
-
-                        logging.info(f"Processing page {page_num + 1} of {file_name}")
-                        process_image(page_image_path, pdf_output_dir, config)
-
-                    pdf_document.close()
-
-            except Exception as e:
-                logging.error(f"Error processing file {file_name}: {e}")
+        file_names = os.listdir(input_dir)
+        if policy.max_workers > 1 and file_names:
+            _process_in_pool(input_dir, output_dir, config_path, file_names, policy, utilization)
+        else:
+            apply_thread_budget(policy.plan(1).threads)
+            for names in _file_batches(file_names, config):
+                file_paths = [os.path.join(input_dir, file_name) for file_name in names]
+                try:
+                    if len(names) > 1:
+                        process_image_files(file_paths, output_dir, config)
+                    else:
+                        process_file(file_paths[0], output_dir, config)
+                except Exception as e:
+                    logging.error(f"Error processing file {', '.join(names)}: {e}")
     except FileNotFoundError as e:
         logging.error(f"Input directory not found: {e}")
 
+    from src.dedup import reuse_ratio
+    ratio = reuse_ratio(get_metrics().snapshot()['counters'])
+    if ratio is not None:
+        logging.info(f"OCR reuse ratio: {ratio:.1%}")
+
+    from src.ocr_backends import log_throughput
+    log_throughput(get_metrics().snapshot())
+
+    cpu_share, cpu_seconds, wall_seconds = utilization.report()
+    get_metrics().set('pipeline.cpu_utilization', cpu_share)
+    logging.info(
+        f"CPU utilization: {cpu_share:.0%} of {len(policy.cpus)} CPU(s) "
+        f"({cpu_seconds:.1f}s CPU over {wall_seconds:.1f}s)"
+    )
+
+    if profile:
+        _finish_profiling(logs_dir)
 
     logging.info("Pipeline finished.")
 
+
+def _batch_workers(config):
+    """
+    Returns the number of files processed concurrently in batch mode:
+    [Resources] Workers, where "auto" means one per available CPU.
+    """
+    workers = config.get('Resources', 'Workers', fallback='1').strip().lower()
+    if workers == 'auto':
+        return len(available_cpus())
+    return max(1, int(workers))
+
+
+def _file_batches(file_names, config):
+    """
+    Groups the files of a run into jobs. Consecutive image files are OCR'd
+    together in batches of [OCR] BatchSize, except in packed mode, where each
+    file is written to its own archive; every other file is a job of its own.
+    """
+    batch_size = config.getint('OCR', 'BatchSize', fallback=1)
+    batches = []
+    for file_name in file_names:
+        batchable = (batch_size > 1 and not is_packed_output(config)
+                     and file_name.lower().endswith(IMAGE_EXTENSIONS))
+        if (batchable and batches and len(batches[-1]) < batch_size
+                and batches[-1][-1].lower().endswith(IMAGE_EXTENSIONS)):
+            batches[-1].append(file_name)
+        else:
+            batches.append([file_name])
+    return batches
+
+
+def _process_in_pool(input_dir, output_dir, config_path, file_names, policy, utilization):
+    """
+    Processes files in a pool of warm workers. Each file is planned when a
+    worker and a CPU are free, from the files actually running, and gets
+    the CPUs it was planned for out of those still free.
+    """
+    from src.workers import create_worker_pool, run_task
+
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    tasks = collections.deque()
+    for names in _file_batches(file_names, config):
+        file_name = ', '.join(names)
+        file_path = os.path.join(input_dir, names[0])
+        shards = _pdf_shards(file_path, config)
+        if len(names) > 1:
+            file_paths = [os.path.join(input_dir, name) for name in names]
+            tasks.append((process_image_files, file_name, file_path, (file_paths,), None))
+        elif shards:
+            tasks += [(process_pdf_shard, file_name, file_path, (file_path,), shard)
+                      for shard in shards]
+        else:
+            tasks.append((process_file, file_name, file_path, (file_path,), None))
+
+    workers = min(policy.max_workers, len(tasks))
+    allocator = CpuAllocator(policy.cpus)
+    # Shards of a document are assembled once all of them are done.
+    documents = {}
+    with create_worker_pool(config_path, workers, policy) as pool:
+        running = {}
+        while tasks or running:
+            while tasks and len(running) < workers and allocator.free():
+                handler, file_name, file_path, args, shard = tasks.popleft()
+                plan = policy.plan(len(running) + len(tasks) + 1, page_megapixels(file_path))
+                cpus = allocator.acquire(plan.threads)
+                try:
+                    future = pool.submit(run_task, handler, *args, output_dir, *(shard or ()),
+                                         cpus=cpus)
+                except BrokenProcessPool as e:
+                    future = Future()
+                    future.set_exception(e)
+                running[future] = (file_name, shard, cpus)
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_name, shard, cpus = running.pop(future)
+                allocator.release(cpus)
+                try:
+                    outcome = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died (e.g. killed by the OOM killer); the
+                    # remaining files of the run fail the same way.
+                    outcome = {"result": None, "error": f"Worker pool failed: {e}",
+                               "cpu_seconds": 0.0, "metrics": {}}
+                utilization.add(outcome['cpu_seconds'])
+                get_metrics().merge(outcome['metrics'])
+                if outcome['error'] is not None:
+                    logging.error(f"Error processing file {file_name}: {outcome['error']}")
+                if shard is None:
+                    continue
+                succeeded, pages = outcome['result'] or (False, [])
+                document = documents.setdefault(
+                    file_name, {"succeeded": True, "pages": [], "shards": 0})
+                document["succeeded"] = document["succeeded"] and succeeded
+                document["pages"] += pages
+                document["shards"] += 1
+
+    for file_name, document in documents.items():
+        finish_document(output_dir, file_name, document["pages"], document["succeeded"], config,
+                        document["shards"])
+        logging.info(f"Assembled {file_name} from {document['shards']} shards")
+
+
+def _pdf_shards(file_path, config):
+    """
+    Returns the (start, stop) page ranges a PDF is split into, or an empty
+    list if it is processed as a single job: it is not a PDF, it is not
+    larger than [Resources] ShardPages, or documents are packed into
+    archives, which a single process has to write.
+    """
+    shard_pages = config.getint('Resources', 'ShardPages', fallback=200)
+    if (shard_pages <= 0 or not file_path.lower().endswith('.pdf')
+            or is_packed_output(config)):
+        return []
+    try:
+        with fitz.open(file_path) as pdf_document:
+            page_count = len(pdf_document)
+    except Exception as e:
+        logging.warning(f"Could not read the page count of {file_path}: {e}")
+        return []
+    if page_count <= shard_pages:
+        return []
+    return [(start, min(start + shard_pages, page_count))
+            for start in range(0, page_count, shard_pages)]
+
+
+def _finish_profiling(logs_dir):
+    from src.utils.profiling import disable_profiling
+
+    flush_profiles()
+    disable_profiling()
+    write_profile_report(os.path.join(logs_dir, 'profiles'))
+
+
+def watch(input_dir, output_dir, config_path, stop_event=None, profile=False, profile_sample=1):
+    """
+    Runs the pipeline as a long-lived service that processes new files as
+    they arrive in the input directory.
+    """
+    from src.watch import watch_directory
+
+    logs_dir = os.path.join(output_dir, 'logs')
+    os.makedirs(logs_dir, exist_ok=True)
+
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    setup_logging(logs_dir, **logging_options(config))
+    settings = {
+        "workers": config.getint('Watch', 'Workers', fallback=os.cpu_count() or 1),
+        "poll_interval": config.getfloat('Watch', 'PollInterval', fallback=2.0),
+        "settle_seconds": config.getfloat('Watch', 'SettleSeconds', fallback=2.0),
+        "use_inotify": config.getboolean('Watch', 'UseInotify', fallback=True),
+    }
+    logging.info("Starting the watch-folder service.")
+    if profile:
+        configure_profiling(os.path.join(logs_dir, 'profiles'), profile_sample)
+    try:
+        watch_directory(input_dir, output_dir, config_path, process_file,
+                        is_supported_file, settings, stop_event)
+    except KeyboardInterrupt:
+        logging.info("Watch-folder service interrupted.")
+    finally:
+        if profile:
+            _finish_profiling(logs_dir)
+
+
+def serve(output_dir, config_path, stop_event=None):
+    """
+    Runs the pipeline as a local HTTP service that OCRs single pages on
+    demand.
+    """
+    from src.service import run_service
+
+    logs_dir = os.path.join(output_dir, 'logs')
+    os.makedirs(logs_dir, exist_ok=True)
+
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    setup_logging(logs_dir, **logging_options(config))
+    settings = {
+        "host": config.get('Service', 'Host', fallback='127.0.0.1'),
+        "port": config.getint('Service', 'Port', fallback=8080),
+        "workers": config.getint('Service', 'Workers', fallback=2),
+        "max_batch": config.getint('Service', 'MaxBatch', fallback=8),
+        "batch_wait": config.getfloat('Service', 'BatchWaitMs', fallback=20) / 1000,
+        "max_queue": config.getint('Service', 'MaxQueue', fallback=64),
+        "request_timeout": config.getfloat('Service', 'RequestTimeout', fallback=60),
+        "max_upload_bytes": int(config.getfloat('Service', 'MaxUploadMB', fallback=50) * 1024 * 1024),
+        "keep_outputs": config.getboolean('Service', 'KeepOutputs', fallback=False),
+    }
+    logging.info("Starting the OCR service.")
+    try:
+        run_service(output_dir, config_path, process_service_batch, settings, stop_event)
+    except KeyboardInterrupt:
+        logging.info("OCR service interrupted.")
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Document Processing Pipeline")
-    parser.add_argument("--input_dir", required=True, help="Path to the directory containing raw scanned images.")
+    parser.add_argument("--input_dir", help="Path to the directory containing raw scanned images.")
     parser.add_argument("--output_dir", required=True, help="Path to the root directory where all processed files will be saved.")
     parser.add_argument("--config", required=True, help="Path to a configuration file (e.g., config.ini).")
+    parser.add_argument("--watch", action="store_true", help="Keep running and process new files as they arrive in the input directory.")
+    parser.add_argument("--serve", action="store_true", help="Run a local HTTP service that OCRs single pages on demand.")
+    parser.add_argument("--profile", action="store_true", help="Profile each pipeline stage and write a report to logs/profiles.")
+    parser.add_argument("--profile-sample", type=int, default=1, help="With --profile, profile every Nth page only.")
 
     args = parser.parse_args()
+    if not args.serve and args.input_dir is None:
+        parser.error("--input_dir is required unless --serve is given")
 
-    main(args.input_dir, args.output_dir, args.config)
+    if args.serve:
+        serve(args.output_dir, args.config)
+    elif args.watch:
+        watch(args.input_dir, args.output_dir, args.config,
+              profile=args.profile, profile_sample=args.profile_sample)
+    else:
+        main(args.input_dir, args.output_dir, args.config,
+             profile=args.profile, profile_sample=args.profile_sample)
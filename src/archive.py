@@ -0,0 +1,238 @@
+"""
+This module contains the packed output mode, which stores all artifacts of a
+document in a single indexed zip archive instead of a directory tree.
+
+Members are stored as <page>/<kind>/<file>, where kind is one of
+preprocessed, ocr, rag or html, and a single shared style.css sits at the
+archive root. The zip central directory doubles as the offset index, so any
+artifact can be read without scanning the archive.
+"""
+import argparse
+import logging
+import mimetypes
+import os
+import posixpath
+import shutil
+import tempfile
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+
+ARCHIVE_SUFFIX = ".zip"
+STYLESHEET = "style.css"
+ARTIFACT_KINDS = ("preprocessed", "ocr", "rag", "html")
+
+# Already-compressed formats are stored as-is; text is deflated.
+_STORED_EXTENSIONS = (".png", ".jpg", ".jpeg", ".tif", ".tiff", ".webp")
+
+
+class PageArchive:
+    """
+    A per-document archive of page artifacts.
+
+    In write mode the archive is built under a temporary name and only
+    renamed into place when it is closed, so readers never see a partially
+    written archive.
+    """
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.mode = mode
+        self._has_stylesheet = False
+        if mode == "w":
+            self._partial_path = path + ".partial"
+            self._zip = zipfile.ZipFile(self._partial_path, "w")
+            self.staging_dir = tempfile.mkdtemp(
+                prefix=os.path.basename(path) + ".",
+                dir=os.path.dirname(path) or ".",
+            )
+        else:
+            self._zip = zipfile.ZipFile(path, "r")
+            self.staging_dir = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close(discard=exc_type is not None)
+
+    def close(self, discard=False):
+        """
+        Closes the archive and, in write mode, publishes it.
+
+        Args:
+            discard: If True, a written archive is deleted instead of
+                     published.
+        """
+        self._zip.close()
+        if self.mode == "w":
+            shutil.rmtree(self.staging_dir, ignore_errors=True)
+            if discard:
+                os.remove(self._partial_path)
+            else:
+                os.replace(self._partial_path, self.path)
+
+    def page_staging_dir(self, page_name):
+        """
+        Returns an empty scratch directory the page is processed into
+        before its artifacts are added to the archive.
+        """
+        page_dir = os.path.join(self.staging_dir, page_name)
+        shutil.rmtree(page_dir, ignore_errors=True)
+        os.makedirs(page_dir)
+        return page_dir
+
+    def add_page(self, page_name, page_dir):
+        """
+        Adds every artifact found under page_dir to the archive and removes
+        the directory.
+
+        Args:
+            page_name: Name of the page, used as the member prefix.
+            page_dir: Directory holding the page's preprocessed, ocr, rag
+                      and html subdirectories.
+        """
+        for kind in ARTIFACT_KINDS:
+            kind_dir = os.path.join(page_dir, kind)
+            for root, _, files in os.walk(kind_dir):
+                for file_name in sorted(files):
+                    file_path = os.path.join(root, file_name)
+                    rel_path = os.path.relpath(file_path, kind_dir)
+                    if kind == "html" and rel_path == STYLESHEET:
+                        self._add_stylesheet(file_path)
+                        continue
+                    self._write(
+                        file_path,
+                        posixpath.join(
+                            page_name, kind, *rel_path.split(os.sep)
+                        ),
+                    )
+        shutil.rmtree(page_dir, ignore_errors=True)
+        logging.info("Packed page %s into %s", page_name, self.path)
+
+    def read_index(self):
+        """
+        Returns {page: {kind: [member names]}} for every page in the archive.
+        """
+        index = {}
+        for name in self._zip.namelist():
+            parts = name.split("/", 2)
+            if len(parts) == 3:
+                index.setdefault(parts[0], {}).setdefault(
+                    parts[1], []
+                ).append(name)
+        return index
+
+    def read(self, page_name, kind, file_name=None):
+        """
+        Reads one artifact of a page.
+
+        Args:
+            page_name: Name of the page.
+            kind: Artifact kind (preprocessed, ocr, rag or html).
+            file_name: Member name relative to the kind directory. Defaults
+                       to the page's main artifact of that kind.
+
+        Returns:
+            The artifact's bytes.
+
+        Raises:
+            KeyError: If the artifact is not in the archive.
+        """
+        if file_name is None:
+            prefix = posixpath.join(page_name, kind, page_name + ".")
+            for name in self._zip.namelist():
+                if name.startswith(prefix):
+                    return self._zip.read(name)
+            raise KeyError(f"No {kind} artifact for page {page_name}")
+        return self._zip.read(posixpath.join(page_name, kind, file_name))
+
+    def read_member(self, name):
+        """
+        Reads a member by its full name, resolving any per-page stylesheet
+        reference to the shared one.
+        """
+        if posixpath.basename(name) == STYLESHEET:
+            name = STYLESHEET
+        return self._zip.read(name)
+
+    def _add_stylesheet(self, file_path):
+        if not self._has_stylesheet:
+            self._write(file_path, STYLESHEET)
+            self._has_stylesheet = True
+
+    def _write(self, file_path, member_name):
+        compression = zipfile.ZIP_DEFLATED
+        if member_name.lower().endswith(_STORED_EXTENSIONS):
+            compression = zipfile.ZIP_STORED
+        self._zip.write(file_path, member_name, compress_type=compression)
+
+
+class ArchiveRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the pages of an archive over HTTP, e.g.
+    /page_001/html/page_001.html.
+    """
+
+    archive = None
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Serves a member of the archive, or an index of its pages at /.
+        """
+        path = unquote(urlparse(self.path).path).lstrip("/")
+        if path == "":
+            body = self._render_index().encode("utf-8")
+            content_type = "text/html; charset=utf-8"
+        else:
+            try:
+                body = self.archive.read_member(path)
+            except KeyError:
+                self.send_error(404)
+                return
+            content_type = (
+                mimetypes.guess_type(path)[0] or "application/octet-stream"
+            )
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _render_index(self):
+        links = []
+        for page_name, kinds in sorted(self.archive.read_index().items()):
+            for name in kinds.get("html", []):
+                if name.endswith(".html"):
+                    links.append(f'<li><a href="/{name}">{page_name}</a></li>')
+        return "<html><body><ul>" + "".join(links) + "</ul></body></html>"
+
+
+def serve_archive(archive_path, host="127.0.0.1", port=8000):
+    """
+    Serves the HTML pages of an archive until interrupted.
+    """
+    with PageArchive(archive_path) as archive:
+        handler = type(
+            "BoundArchiveRequestHandler",
+            (ArchiveRequestHandler,),
+            {"archive": archive},
+        )
+        server = ThreadingHTTPServer((host, port), handler)
+        logging.info("Serving %s on http://%s:%d/", archive_path, host, port)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve a packed archive")
+    parser.add_argument("archive", help="Path to a document archive.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve_archive(args.archive, args.host, args.port)
@@ -0,0 +1,180 @@
+"""
+This module groups the text blocks of a page into articles.
+
+OCR writes one TextBlock per paragraph or column fragment, while a
+newspaper article is a headline followed by body text that flows down one
+or more columns. Blocks are linked by:
+
+    column adjacency  A body block continues the article of the nearest
+                      block right above it in the same column, unless that
+                      block is a headline of another article.
+    typography        A block whose lines are markedly taller than the
+                      page's body text is a headline and starts an article;
+                      the first block under it in every column it spans
+                      belongs to that article.
+
+The blocks are kept in a uniform grid over the page, so finding the blocks
+under a block looks at a few grid cells instead of every other block and a
+page takes time roughly linear in its number of blocks.
+"""
+import statistics
+from collections import defaultdict, namedtuple
+
+Block = namedtuple(
+    "Block", ["id", "x", "y", "width", "height", "line_height", "lines"]
+)
+Article = namedtuple("Article", ["blocks", "headline"])
+
+
+class GridIndex:
+    """
+    A uniform grid of square cells over the page, mapping each cell to the
+    items whose boxes overlap it.
+    """
+
+    def __init__(self, cell_size):
+        self.cell_size = max(int(cell_size), 1)
+        self._cells = defaultdict(list)
+
+    def insert(self, item, box):
+        """
+        Adds an item with an (x, y, width, height) box.
+        """
+        for cell in self._cells_of(box):
+            self._cells[cell].append(item)
+
+    def query(self, box):
+        """
+        Returns the items whose boxes may overlap box.
+        """
+        found = set()
+        for cell in self._cells_of(box):
+            found.update(self._cells.get(cell, ()))
+        return found
+
+    def _cells_of(self, box):
+        x, y, width, height = box
+        size = self.cell_size
+        for cell_x in range(int(x // size), int((x + width) // size) + 1):
+            for cell_y in range(
+                int(y // size), int((y + height) // size) + 1
+            ):
+                yield cell_x, cell_y
+
+
+def segment_articles(blocks, headline_ratio=1.5, max_headline_lines=3,
+                     max_gap_lines=3.0, min_overlap=0.5):
+    """
+    Groups the text blocks of a page into articles.
+
+    Args:
+        blocks: The page's Blocks, in document order. Blocks without a
+                box (width or height of 0 or less) stay on their own.
+        headline_ratio: A block whose line height is at least this many
+                        times the body line height is a headline.
+        max_headline_lines: Blocks with more lines are never headlines.
+        max_gap_lines: Largest vertical gap, in body lines, between linked
+                       blocks.
+        min_overlap: Smallest horizontal overlap of linked blocks, as a
+                     fraction of the wider block's width (of the lower
+                     block's width under a headline).
+
+    Returns:
+        The Articles in reading order: the indices of their blocks, the
+        headline first, and the index of the headline or None.
+    """
+    placed = [
+        index for index, block in enumerate(blocks)
+        if block.width > 0 and block.height > 0
+    ]
+    parents = list(range(len(blocks)))
+    headlines = set()
+
+    if placed:
+        line_heights = [
+            blocks[index].line_height for index in placed
+            if blocks[index].line_height > 0
+        ] or [blocks[index].height for index in placed]
+        body_line_height = statistics.median(line_heights)
+        headlines = {
+            index for index in placed
+            if 0 < blocks[index].lines <= max_headline_lines
+            and blocks[index].line_height >= headline_ratio * body_line_height
+        }
+        _link_blocks(
+            blocks, placed, headlines, parents,
+            max_gap_lines * body_line_height, min_overlap
+        )
+
+    groups = defaultdict(list)
+    for index in range(len(blocks)):
+        groups[_root(parents, index)].append(index)
+    articles = []
+    for members in sorted(groups.values(), key=min):
+        headline = next((i for i in members if i in headlines), None)
+        if headline is not None:
+            members.remove(headline)
+            members.insert(0, headline)
+        articles.append(Article(members, headline))
+    return articles
+
+
+def _link_blocks(blocks, placed, headlines, parents, max_gap, min_overlap):
+    grid = GridIndex(statistics.median(blocks[i].width for i in placed))
+    for index in placed:
+        grid.insert(index, _box(blocks[index]))
+
+    continued = set()
+    for index in sorted(placed, key=lambda i: blocks[i].y):
+        block = blocks[index]
+        bottom = block.y + block.height
+        below = []
+        for other in grid.query((block.x, bottom, block.width, max_gap)):
+            candidate = blocks[other]
+            gap = candidate.y - bottom
+            # Blocks may overlap slightly when OCR pads their boxes.
+            if other == index or candidate.y <= block.y or gap > max_gap:
+                continue
+            overlap = _overlap(block, candidate)
+            if index in headlines:
+                if overlap >= min_overlap * candidate.width:
+                    below.append((candidate.y, other))
+            elif overlap >= min_overlap * max(block.width, candidate.width):
+                below.append((candidate.y, other))
+        if not below:
+            continue
+
+        if index in headlines:
+            # The top block of every column under the headline.
+            targets = [
+                other for _, other in sorted(below)
+                if other not in headlines and not any(
+                    _overlap(blocks[other], blocks[upper]) > 0
+                    for _, upper in below
+                    if blocks[upper].y < blocks[other].y
+                )
+            ]
+        else:
+            _, nearest = min(below)
+            targets = [] if nearest in headlines else [nearest]
+        for other in targets:
+            if other not in continued:
+                continued.add(other)
+                parents[_root(parents, other)] = _root(parents, index)
+
+
+def _overlap(first, second):
+    return min(first.x + first.width, second.x + second.width) - max(
+        first.x, second.x
+    )
+
+
+def _box(block):
+    return block.x, block.y, block.width, block.height
+
+
+def _root(parents, index):
+    while parents[index] != index:
+        parents[index] = parents[parents[index]]
+        index = parents[index]
+    return index
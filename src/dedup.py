@@ -0,0 +1,258 @@
+"""
+This module detects near-duplicate pages (rescans, microfilm and paper
+copies of the same page, syndicated reprints) so their OCR can be reused
+instead of running Tesseract again.
+
+Each OCR'd page is fingerprinted with a 256-bit perceptual hash of its
+binarized, downscaled image. The hashes live in a fixed-width binary table
+that is scanned with vectorized Hamming distances, and the ALTO XML of every
+indexed page is kept gzip-compressed next to it, so the index does not
+depend on the output mode or on the OCR format of the pages it was built
+from.
+"""
+import fcntl
+import gzip
+import logging
+import os
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from lxml import etree
+
+HASH_WORDS = 4
+TABLE_FILE = "hashes.bin"
+ALTO_DIR = "alto"
+
+_RECORD = np.dtype([
+    ("hash", "<u8", (HASH_WORDS,)),
+    ("width", "<u4"),
+    ("height", "<u4"),
+])
+_DCT_SIZE = 64
+_HASH_SIZE = 16
+_SCALED_ATTRIBUTES = {"HPOS": 0, "VPOS": 1, "WIDTH": 0, "HEIGHT": 1}
+
+
+def page_hash(image):
+    """
+    Returns the perceptual hash of a page.
+
+    The page is binarized with Otsu's method and area-downscaled to 64x64,
+    which turns it into an ink density map that is independent of the scan
+    resolution. The hash has one bit per low-frequency DCT coefficient of
+    that map (the 16x16 top-left block), set when the coefficient is above
+    the block's median.
+
+    Args:
+        image: The page as a grayscale or BGR NumPy array.
+
+    Returns:
+        The hash as an array of four uint64 words.
+    """
+    if image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    _, binary = cv2.threshold(
+        image, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU
+    )
+    small = cv2.resize(
+        binary, (_DCT_SIZE, _DCT_SIZE), interpolation=cv2.INTER_AREA
+    )
+    coefficients = cv2.dct(small.astype(np.float32))[:_HASH_SIZE, :_HASH_SIZE]
+    # The DC term only encodes the overall ink coverage.
+    median = np.median(coefficients.flatten()[1:])
+    bits = (coefficients > median).flatten()
+    return np.packbits(bits).view("<u8").copy()
+
+
+def hamming_distances(hashes, query):
+    """
+    Returns the Hamming distance between each row of hashes and query.
+    """
+    return np.bitwise_count(np.bitwise_xor(hashes, query)).sum(
+        axis=-1, dtype=np.int64
+    )
+
+
+def scale_alto(alto, scale_x, scale_y, file_name=None):
+    """
+    Rescales the coordinates of an ALTO document, e.g. to reuse the OCR of
+    a page scanned at a different resolution.
+
+    Args:
+        alto: The ALTO XML as bytes.
+        scale_x: Horizontal scale factor.
+        scale_y: Vertical scale factor.
+        file_name: If given, replaces the source image file name.
+
+    Returns:
+        The rescaled ALTO XML as bytes.
+    """
+    root = etree.fromstring(alto)
+    xmlns = root.nsmap.get(None, "")
+    namespace = f"{{{xmlns}}}" if xmlns else ""
+    if file_name is not None:
+        for element in root.iter(f"{namespace}fileName"):
+            element.text = file_name
+    if (scale_x, scale_y) != (1.0, 1.0):
+        scales = (scale_x, scale_y)
+        layout = root.find(f"{namespace}Layout")
+        for element in layout.iter() if layout is not None else ():
+            for name, axis in _SCALED_ATTRIBUTES.items():
+                value = element.get(name)
+                if value is not None:
+                    element.set(
+                        name, str(round(float(value) * scales[axis]))
+                    )
+    return etree.tostring(
+        root, pretty_print=True, xml_declaration=True, encoding="UTF-8"
+    )
+
+
+class PageHashIndex:
+    """
+    The on-disk index of OCR'd pages rooted at index_dir.
+
+    Records are appended under a file lock, so worker processes can share
+    one index; each process rereads the records appended by others before a
+    lookup.
+    """
+
+    def __init__(self, index_dir, max_distance=10, max_aspect_change=0.02):
+        self.index_dir = index_dir
+        self.max_distance = max_distance
+        self.max_aspect_change = max_aspect_change
+        self._table_path = os.path.join(index_dir, TABLE_FILE)
+        self._records = np.zeros(0, dtype=_RECORD)
+        os.makedirs(os.path.join(index_dir, ALTO_DIR), exist_ok=True)
+
+    def __len__(self):
+        self._refresh()
+        return len(self._records)
+
+    def find(self, page, width, height):
+        """
+        Finds the closest indexed page within the distance tolerance.
+
+        Args:
+            page: The hash of the page, as returned by page_hash().
+            width: Page width in pixels.
+            height: Page height in pixels.
+
+        Returns:
+            A (record_id, distance) tuple, or None if there is no match.
+        """
+        self._refresh()
+        if self._records.size == 0:
+            return None
+        distances = hamming_distances(self._records["hash"], page)
+        # A reused page is aligned by scaling, which only works if the
+        # pages have the same proportions.
+        aspect = width / height
+        record_aspects = self._records["width"] / self._records["height"]
+        distances[
+            np.abs(record_aspects / aspect - 1) > self.max_aspect_change
+        ] = np.iinfo(np.int64).max
+        record_id = int(np.argmin(distances))
+        if distances[record_id] > self.max_distance:
+            return None
+        return record_id, int(distances[record_id])
+
+    def add(self, page, width, height, alto_path):
+        """
+        Adds an OCR'd page to the index.
+
+        Returns:
+            The record id.
+        """
+        with open(alto_path, "rb") as f:
+            alto = f.read()
+        record = np.zeros(1, dtype=_RECORD)
+        record["hash"] = page
+        record["width"] = width
+        record["height"] = height
+        with self._locked():
+            record_id = os.path.getsize(self._table_path) // _RECORD.itemsize
+            # The ALTO is written first, so a record is never visible
+            # without it.
+            with gzip.open(self._alto_path(record_id), "wb") as f:
+                f.write(alto)
+            with open(self._table_path, "ab") as f:
+                f.write(record.tobytes())
+        return record_id
+
+    def reuse(self, record_id, width, height, alto_path, file_name=None):
+        """
+        Writes the ALTO of an indexed page, aligned to a page of the given
+        size, to alto_path.
+        """
+        self._refresh()
+        record = self._records[record_id]
+        with gzip.open(self._alto_path(record_id), "rb") as f:
+            alto = f.read()
+        with open(alto_path, "wb") as f:
+            f.write(scale_alto(
+                alto,
+                width / int(record["width"]),
+                height / int(record["height"]),
+                file_name,
+            ))
+        return alto_path
+
+    def _alto_path(self, record_id):
+        return os.path.join(
+            self.index_dir, ALTO_DIR, f"{record_id:08d}.xml.gz"
+        )
+
+    def _refresh(self):
+        if not os.path.exists(self._table_path):
+            return
+        known = len(self._records)
+        available = os.path.getsize(self._table_path) // _RECORD.itemsize
+        if available > known:
+            new = np.fromfile(
+                self._table_path, dtype=_RECORD, count=available - known,
+                offset=known * _RECORD.itemsize,
+            )
+            self._records = np.concatenate([self._records, new])
+
+    @contextmanager
+    def _locked(self):
+        with open(os.path.join(self.index_dir, ".lock"), "w",
+                  encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                # Creates the table on first use.
+                open(self._table_path, "ab").close()
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def reuse_ratio(counters):
+    """
+    Returns the fraction of pages whose OCR was reused, from a metrics
+    snapshot's counters, or None if no page went through OCR.
+    """
+    pages = counters.get("ocr.pages", 0)
+    if not pages:
+        return None
+    return counters.get("ocr.reused", 0) / pages
+
+
+def open_page_index(config, output_dir):
+    """
+    Returns the PageHashIndex configured in the [Dedup] section, or None
+    when deduplication is off. The index defaults to <output_dir>/dedup.
+    """
+    if not config.getboolean("Dedup", "Enabled", fallback=False):
+        return None
+    index_dir = config.get(
+        "Dedup", "IndexDir", fallback=os.path.join(output_dir, "dedup")
+    )
+    logging.debug("Using the page hash index in %s", index_dir)
+    return PageHashIndex(
+        index_dir,
+        config.getint("Dedup", "MaxDistance", fallback=10),
+        config.getfloat("Dedup", "MaxAspectChange", fallback=0.02),
+    )
@@ -5,6 +5,8 @@ import logging
 import os
 import cv2
 from lxml import etree
+from src.ocr_cache import is_ocr_cache, load_ocr_cache
+from src.pyramid import build_pyramid, write_viewer
 
 
 XMLNS = "http://www.loc.gov/standards/alto/ns-v3#"
@@ -14,19 +16,29 @@ def create_html_from_alto(
     alto_path: str,
     output_html_path: str,
     image_dir_path: str,
-    original_scan_path: str
+    original_scan_path: str,
+    scan_href: str = None,
+    deep_zoom: dict = None,
+    page=None
 ) -> bool:
     """
     Parses an ALTO XML file and generates an HTML file that visually
     reconstructs the original page layout.
 
     Args:
-        alto_path: Path to the alto.xml file.
+        alto_path: Path to the alto.xml file, or to its OCR cache.
         output_html_path: Path where the final .html file should be saved.
         image_dir_path: Path to the directory where extracted images
                         should be saved.
         original_scan_path: Path to the original scanned image for image
                             extraction.
+        scan_href: Link target of the "View Original Scan" button.
+                   Defaults to original_scan_path.
+        deep_zoom: If given, keyword arguments for build_pyramid; a tiled
+                   pyramid and viewer are generated from the decoded scan
+                   and the button links to the viewer instead.
+        page: The scan already decoded, e.g. as a PackedPage, to crop the
+              illustrations from instead of reading original_scan_path.
 
     Returns:
         True if the HTML was generated successfully, False otherwise.
@@ -45,26 +57,43 @@ def create_html_from_alto(
         etree.SubElement(head, "link", rel="stylesheet", href="style.css")
         body = etree.SubElement(html, "body")
 
-        tree = etree.parse(alto_path)
-
-        for string_element in tree.findall(f".//{{{XMLNS}}}String"):
-            _process_string_element(string_element, body)
+        if is_ocr_cache(alto_path):
+            ocr_page = load_ocr_cache(alto_path)
+            for index, box in enumerate(ocr_page.string_boxes.tolist()):
+                _add_span(body, ocr_page.string_content(index), *box)
+            illustration_boxes = ocr_page.illustration_boxes.tolist()
+        else:
+            tree = etree.parse(alto_path)
+            for string_element in tree.findall(f".//{{{XMLNS}}}String"):
+                _process_string_element(string_element, body)
+            illustration_boxes = [
+                _element_box(illust_element)
+                for illust_element in tree.findall(
+                    f".//{{{XMLNS}}}Illustration"
+                )
+            ]
 
-        original_image = cv2.imread(original_scan_path)
+        original_image = page
+        if original_image is None:
+            original_image = cv2.imread(original_scan_path)
         if original_image is None:
             logging.error("Could not read image: %s", original_scan_path)
             return False
 
-        for i, illust_element in enumerate(
-            tree.findall(f".//{{{XMLNS}}}Illustration")
-        ):
-            _process_illustration_element(
-                illust_element, body, original_image, image_dir_path, i
+        for i, box in enumerate(illustration_boxes):
+            _process_illustration(
+                box, body, original_image, image_dir_path, i
+            )
+
+        if deep_zoom is not None:
+            scan_href = _build_deep_zoom(
+                original_image if page is None else page.unpack(),
+                output_html_path, deep_zoom
             )
 
         # Add the fixed-position button
         button = etree.SubElement(
-            body, "a", href=original_scan_path, target="_blank"
+            body, "a", href=scan_href or original_scan_path, target="_blank"
         )
         button.text = "View Original Scan"
         button.set("class", "view-original-button")
@@ -80,43 +109,51 @@ def create_html_from_alto(
         logging.info("HTML file saved to: %s", output_html_path)
         return True
 
-    except (IOError, etree.ParseError) as e:
+    except (IOError, ValueError, etree.ParseError) as e:
         logging.error("Error generating HTML from ALTO file: %s", e)
         return False
 
 
+def _build_deep_zoom(original_image, output_html_path, options):
+    output_dir = os.path.dirname(output_html_path) or "."
+    name = os.path.splitext(os.path.basename(output_html_path))[0] + "_scan"
+    dzi_path = build_pyramid(original_image, output_dir, name, **options)
+    viewer_path = write_viewer(
+        dzi_path, os.path.join(output_dir, f"{name}.html"), name
+    )
+    return os.path.basename(viewer_path)
+
+
+def _element_box(element):
+    return [
+        int(float(element.get(name)))
+        for name in ("HPOS", "VPOS", "WIDTH", "HEIGHT")
+    ]
+
+
 def _process_string_element(string_element, body):
-    attrs = {
-        "content": string_element.get("CONTENT"),
-        "hpos": int(float(string_element.get("HPOS"))),
-        "vpos": int(float(string_element.get("VPOS"))),
-        "width": int(float(string_element.get("WIDTH"))),
-        "height": int(float(string_element.get("HEIGHT"))),
-    }
+    _add_span(body, string_element.get("CONTENT"), *_element_box(string_element))
 
-    span = etree.SubElement(body, "span")
-    span.text = attrs["content"]
-    style = (
+
+def _position_style(hpos, vpos, width, height):
+    return (
         "position: absolute; "
-        f"left: {attrs['hpos']}px; top: {attrs['vpos']}px; "
-        f"width: {attrs['width']}px; height: {attrs['height']}px;"
+        f"left: {hpos}px; top: {vpos}px; "
+        f"width: {width}px; height: {height}px;"
     )
-    span.set("style", style)
 
 
-def _process_illustration_element(illust_element, body, original_image, image_dir_path, i):
-    attrs = {
-        "hpos": int(float(illust_element.get("HPOS"))),
-        "vpos": int(float(illust_element.get("VPOS"))),
-        "width": int(float(illust_element.get("WIDTH"))),
-        "height": int(float(illust_element.get("HEIGHT"))),
-    }
+def _add_span(body, content, hpos, vpos, width, height):
+    span = etree.SubElement(body, "span")
+    span.text = content
+    span.set("style", _position_style(hpos, vpos, width, height))
+
+
+def _process_illustration(box, body, original_image, image_dir_path, i):
+    hpos, vpos, width, height = box
 
     # Crop the image
-    cropped_image = original_image[
-        attrs["vpos"] : attrs["vpos"] + attrs["height"],
-        attrs["hpos"] : attrs["hpos"] + attrs["width"],
-    ]
+    cropped_image = original_image[vpos : vpos + height, hpos : hpos + width]
 
     # Save the cropped image
     image_filename = f"illustration_{i}.png"
@@ -129,9 +166,4 @@ def _process_illustration_element(illust_element, body, original_image, image_di
         "src",
         os.path.join(os.path.basename(image_dir_path), image_filename)
     )
-    img.set(
-        "style",
-        "position: absolute; "
-        f"left: {attrs['hpos']}px; top: {attrs['vpos']}px; "
-        f"width: {attrs['width']}px; height: {attrs['height']}px;"
-    )
+    img.set("style", _position_style(hpos, vpos, width, height))
@@ -4,47 +4,50 @@ This module is for normalizing the RAG (Retrieval-Augmented Generation) JSON out
 import json
 import logging
 import re
+import statistics
 from lxml import etree
 from nltk.corpus import stopwords
 from nltk.tokenize import word_tokenize
+from src.articles import Block, segment_articles
+from src.ocr_cache import is_ocr_cache, load_ocr_cache
 
 
 def generate_rag_json(
     alto_path: str, output_json_path: str, config: dict
 ) -> bool:
     """
-    Processes an ALTO XML file to produce a clean, structured JSON file for
-    RAG ingestion.
+    Processes an ALTO XML file (or its OCR cache) to produce a clean,
+    structured JSON file for RAG ingestion.
+
+    There is one record per text block, or, if config["articles"] is true,
+    one per article, listing the IDs of its blocks.
     """
     logging.info("Normalizing ALTO XML for RAG: %s", alto_path)
 
-    try:
-        with open(alto_path, 'r', encoding='utf-8') as f:
-            xml_content = f.read()
-    except FileNotFoundError:
-        logging.error("ALTO XML file not found at: %s", alto_path)
-        return False
-    except IOError as e:
-        logging.error("Error reading ALTO XML file: %s", e)
-        return False
-
-    # Remove the default namespace declaration for easier parsing
-    xml_content = re.sub(' xmlns="[^"]+"', '', xml_content, count=1)
+    # The layout of the blocks is only needed to segment them into articles.
+    with_layout = bool(config.get("articles"))
+    if is_ocr_cache(alto_path):
+        try:
+            blocks = _blocks_from_cache(load_ocr_cache(alto_path), with_layout)
+        except (IOError, ValueError) as e:
+            logging.error("Error reading OCR cache file: %s", e)
+            return False
+    else:
+        blocks = _blocks_from_alto(alto_path, with_layout)
+        if blocks is None:
+            return False
 
-    try:
-        root = etree.fromstring(xml_content.encode('utf-8'))
-    except etree.XMLSyntaxError as e:
-        logging.error("Error parsing ALTO XML: %s", e)
-        return False
+    if with_layout:
+        records = _article_records(blocks)
+    else:
+        records = [
+            (raw_text, attributes) for raw_text, attributes, _ in blocks
+        ]
 
     articles = []
     stop_words = set(stopwords.words('english'))
 
-    for text_block in root.findall('.//TextBlock'):
-        raw_text = ' '.join(
-            string.get('CONTENT') for string in text_block.findall('.//String')
-        )
-
+    for raw_text, attributes in records:
         # Hyphenation correction
         cleaned_text = re.sub(r'-\s+', '', raw_text)
 
@@ -62,11 +65,7 @@ def generate_rag_json(
             "metadata": {
                 "publication_date": config.get("publication_date"),
                 "newspaper_title": config.get("newspaper_title"),
-                "id": text_block.get('ID'),
-                "height": text_block.get('HEIGHT'),
-                "width": text_block.get('WIDTH'),
-                "x": text_block.get('HPOS'),
-                "y": text_block.get('VPOS'),
+                **attributes,
             }
         }
         articles.append(article_object)
@@ -80,3 +79,134 @@ def generate_rag_json(
 
     logging.info("RAG-ready JSON saved to: %s", output_json_path)
     return True
+
+
+def _article_records(blocks):
+    """
+    Returns (raw_text, attributes) for every article formed by the blocks.
+    """
+    records = []
+    for article in segment_articles([layout for _, _, layout in blocks]):
+        members = [blocks[index] for index in article.blocks]
+        headline = article.headline
+        attributes = {
+            "id": members[0][1]["id"],
+            "block_ids": [attributes["id"] for _, attributes, _ in members],
+            "headline": blocks[headline][0] if headline is not None else None,
+            "height": None,
+            "width": None,
+            "x": None,
+            "y": None,
+        }
+        boxes = [
+            layout for _, _, layout in members
+            if layout.width > 0 and layout.height > 0
+        ]
+        if boxes:
+            x0 = min(box.x for box in boxes)
+            y0 = min(box.y for box in boxes)
+            x1 = max(box.x + box.width for box in boxes)
+            y1 = max(box.y + box.height for box in boxes)
+            attributes.update(
+                height=str(y1 - y0), width=str(x1 - x0), x=str(x0), y=str(y0)
+            )
+        raw_text = ' '.join(raw_text for raw_text, _, _ in members)
+        records.append((raw_text, attributes))
+    return records
+
+
+def _layout(block_id, box, line_heights):
+    """
+    Returns the Block used for article segmentation, from the block's box
+    and the heights of its lines (0 where unknown).
+    """
+    known = [height for height in line_heights if height > 0]
+    return Block(
+        block_id, *box, statistics.median(known) if known else 0,
+        len(line_heights)
+    )
+
+
+def _number(value, default):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def _blocks_from_alto(alto_path, with_layout=False):
+    """
+    Returns (raw_text, attributes, layout) for every TextBlock of an ALTO XML
+    file, or None if the file cannot be read. layout is None unless
+    with_layout is set; coordinates that are missing or not numbers leave
+    the block without a box.
+    """
+    try:
+        with open(alto_path, 'r', encoding='utf-8') as f:
+            xml_content = f.read()
+    except FileNotFoundError:
+        logging.error("ALTO XML file not found at: %s", alto_path)
+        return None
+    except IOError as e:
+        logging.error("Error reading ALTO XML file: %s", e)
+        return None
+
+    # Remove the default namespace declaration for easier parsing
+    xml_content = re.sub(' xmlns="[^"]+"', '', xml_content, count=1)
+
+    try:
+        root = etree.fromstring(xml_content.encode('utf-8'))
+    except etree.XMLSyntaxError as e:
+        logging.error("Error parsing ALTO XML: %s", e)
+        return None
+
+    blocks = []
+    for text_block in root.findall('.//TextBlock'):
+        raw_text = ' '.join(
+            string.get('CONTENT') for string in text_block.findall('.//String')
+        )
+        layout = None
+        if with_layout:
+            box = [
+                int(_number(text_block.get(name), -1))
+                for name in ('HPOS', 'VPOS', 'WIDTH', 'HEIGHT')
+            ]
+            line_heights = [
+                _number(line.get('HEIGHT'), 0)
+                for line in text_block.findall('.//TextLine')
+            ]
+            layout = _layout(text_block.get('ID'), box, line_heights)
+        blocks.append((raw_text, {
+            "id": text_block.get('ID'),
+            "height": text_block.get('HEIGHT'),
+            "width": text_block.get('WIDTH'),
+            "x": text_block.get('HPOS'),
+            "y": text_block.get('VPOS'),
+        }, layout))
+    return blocks
+
+
+def _blocks_from_cache(page, with_layout=False):
+    """
+    Returns (raw_text, attributes, layout) for every text block of an OCR
+    cache. layout is None unless with_layout is set.
+    """
+    def coordinate(value):
+        return None if value < 0 else str(value)
+
+    blocks = []
+    for index in range(page.block_count):
+        hpos, vpos, width, height = box = page.block_boxes[index].tolist()
+        layout = None
+        if with_layout:
+            first_line, stop_line = page.block_line_starts[index:index + 2]
+            line_heights = page.line_boxes[first_line:stop_line, 3].tolist()
+            layout = _layout(page.block_id(index), box, line_heights)
+        blocks.append((' '.join(page.block_contents(index)), {
+            "id": page.block_id(index),
+            "height": coordinate(height),
+            "width": coordinate(width),
+            "x": coordinate(hpos),
+            "y": coordinate(vpos),
+        }, layout))
+    return blocks
@@ -3,25 +3,53 @@ This module contains the OCR functionality for the project.
 """
 import logging
 import os
+import subprocess
+import time
 import pytesseract
+from lxml import etree
 from PIL import Image
+from src.ocr_backends import get_backend
+from src.utils.metrics import get_metrics
 
 
-def run_ocr(image_path, output_dir, psm):
+def run_ocr(image_path, output_dir, psm, backend=None, source=None,
+            fallback=None):
     """
-    Runs Tesseract OCR on the given image and saves the ALTO XML output.
+    Runs OCR on the given image and saves the ALTO XML output.
+
+    Args:
+        image_path: The image to OCR.
+        output_dir: The directory the ALTO XML is saved to.
+        psm: The page segmentation mode.
+        backend: Name of the OCR backend (defaults to Tesseract).
+        source: The (pdf_path, page_number) the image was rasterized from,
+                for backends that read the PDF.
+        fallback: Name of the backend used for pages the backend cannot
+                  handle (e.g. PDF pages without a text layer).
     """
-    logging.info("Running OCR on %s with PSM %s", image_path, psm)
+    engine = get_backend(backend)
+    logging.info(
+        "Running OCR on %s with PSM %s using %s", image_path, psm, engine.name
+    )
 
     # Construct the output path
     base_name = os.path.splitext(os.path.basename(image_path))[0]
     alto_path = os.path.join(output_dir, f"{base_name}.xml")
 
-    # Run Tesseract
+    # Run the OCR backend
     try:
-        xml_output = pytesseract.image_to_alto_xml(
-            Image.open(image_path), config=f'--psm {int(psm)}'
-        )
+        start = time.perf_counter()
+        with Image.open(image_path) as image:
+            xml_output = engine.recognize(image, psm, source)
+        _record_throughput(engine, 1, time.perf_counter() - start)
+        if xml_output is None and fallback is not None:
+            logging.info(
+                "The %s backend cannot OCR %s; using %s",
+                engine.name, image_path, fallback
+            )
+            return run_ocr(image_path, output_dir, psm, fallback, source)
+        if xml_output is None:
+            raise ValueError(f"The {engine.name} backend cannot OCR this page")
         with open(alto_path, 'wb') as f:
             f.write(xml_output)
         logging.info("ALTO XML saved to: %s", alto_path)
@@ -33,3 +61,76 @@ def run_ocr(image_path, output_dir, psm):
         raise
 
     return alto_path
+
+
+def run_ocr_batch(image_paths, output_dirs, psm, backend=None, sources=None,
+                  fallback=None):
+    """
+    Runs OCR on several images in one backend call where the backend
+    supports it (for Tesseract, one process start-up and model load per
+    batch), and saves one ALTO XML per image. If the batch fails, the images
+    are OCR'd one at a time instead.
+
+    Args:
+        image_paths: The images to OCR.
+        output_dirs: The directory each image's ALTO XML is saved to.
+        psm: The page segmentation mode.
+        backend: Name of the OCR backend (defaults to Tesseract).
+        sources: The (pdf_path, page_number) of each image, if any.
+        fallback: Name of the backend used for pages the backend cannot
+                  handle.
+
+    Returns:
+        The ALTO paths, with None for images whose OCR failed.
+    """
+    engine = get_backend(backend)
+    logging.info(
+        "Running OCR on a batch of %d images with PSM %s using %s",
+        len(image_paths), psm, engine.name
+    )
+    alto_paths = [
+        os.path.join(
+            output_dir,
+            f"{os.path.splitext(os.path.basename(image_path))[0]}.xml"
+        )
+        for image_path, output_dir in zip(image_paths, output_dirs)
+    ]
+    if engine.supports_batch:
+        try:
+            start = time.perf_counter()
+            pages = engine.recognize_files(image_paths, psm)
+            _record_throughput(
+                engine, len(image_paths), time.perf_counter() - start
+            )
+            for alto_path, page in zip(alto_paths, pages):
+                with open(alto_path, "wb") as f:
+                    f.write(page)
+                logging.info("ALTO XML saved to: %s", alto_path)
+            return alto_paths
+        except (OSError, ValueError, subprocess.CalledProcessError,
+                etree.XMLSyntaxError) as e:
+            logging.warning(
+                "Batch OCR failed (%s); falling back to one image at a time",
+                e
+            )
+
+    results = []
+    sources = sources or [None] * len(image_paths)
+    for image_path, output_dir, source in zip(
+        image_paths, output_dirs, sources
+    ):
+        try:
+            results.append(run_ocr(
+                image_path, output_dir, psm, backend=backend, source=source,
+                fallback=fallback,
+            ))
+        except Exception:  # pylint: disable=broad-except
+            # run_ocr has already logged the error.
+            results.append(None)
+    return results
+
+
+def _record_throughput(engine, pages, seconds):
+    metrics = get_metrics()
+    metrics.observe(f"ocr.backend.{engine.name}", seconds)
+    metrics.increment(f"ocr.backend.{engine.name}.pages", pages)
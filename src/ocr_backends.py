@@ -0,0 +1,398 @@
+"""
+This module defines the interface OCR engines implement and the registry the
+pipeline picks them from.
+
+A backend turns a page image into ALTO XML. Backends declare what else they
+can do: OCR a list of image files in one call (batching), report word
+confidences, and OCR cropped regions of a page. The available backends are:
+
+    tesseract   Tesseract in a subprocess, through pytesseract (the default).
+    tesserocr   Tesseract in-process, through the optional tesserocr package;
+                the model is loaded once per process.
+    pdf-text    The text layer of the source PDF, for born-digital or already
+                OCR'd documents. Pages without one fall back to another
+                backend.
+    stub        A fast, deterministic fake that lays out synthetic ground
+                truth as ALTO, for tests and benchmarks without Tesseract.
+"""
+import copy
+import logging
+import os
+import random
+import subprocess
+import tempfile
+import zlib
+
+import pytesseract
+from lxml import etree
+
+ALTO_XMLNS = "http://www.loc.gov/standards/alto/ns-v3#"
+DEFAULT_BACKEND = "tesseract"
+
+_BACKENDS = {}
+_INSTANCES = {}
+
+
+class OcrBackendError(Exception):
+    """
+    Raised when an OCR backend is unknown or cannot be used on this host.
+    """
+
+
+class OcrBackend:
+    """
+    Base class of OCR backends.
+
+    Attributes:
+        name: Registry name.
+        supports_batch: True if recognize_files() OCRs several files in one
+                        call rather than one at a time.
+        provides_confidences: True if the ALTO has word confidences (WC).
+        supports_regions: True if recognize() works on cropped regions.
+    """
+
+    name = None
+    supports_batch = False
+    provides_confidences = False
+    supports_regions = False
+
+    def recognize(self, image, psm, source=None):
+        """
+        OCRs one page.
+
+        Args:
+            image: The page as a PIL image.
+            psm: The page segmentation mode.
+            source: The (pdf_path, page_number) the page was rasterized
+                    from, or None for image files.
+
+        Returns:
+            The ALTO XML as bytes, or None if the backend cannot handle the
+            page.
+        """
+        raise NotImplementedError
+
+    def recognize_files(self, image_paths, psm):
+        """
+        OCRs several image files.
+
+        Returns:
+            The ALTO XML of each file, as bytes.
+        """
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+        results = []
+        for image_path in image_paths:
+            with Image.open(image_path) as image:
+                results.append(self.recognize(image, psm))
+        return results
+
+
+def register_backend(cls):
+    """
+    Class decorator that adds a backend to the registry under cls.name.
+    """
+    _BACKENDS[cls.name] = cls
+    return cls
+
+
+def available_backends():
+    """
+    Returns the names of the registered backends.
+    """
+    return sorted(_BACKENDS)
+
+
+def get_backend(name=None):
+    """
+    Returns the backend registered under name, creating it on first use in
+    this process.
+
+    Raises:
+        OcrBackendError: If the backend is unknown or unavailable.
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in _INSTANCES:
+        if name not in _BACKENDS:
+            raise OcrBackendError(
+                f"Unknown OCR backend '{name}'; available: "
+                f"{', '.join(available_backends())}"
+            )
+        _INSTANCES[name] = _BACKENDS[name]()
+    return _INSTANCES[name]
+
+
+@register_backend
+class TesseractBackend(OcrBackend):
+    """
+    Runs the tesseract executable in a subprocess.
+    """
+
+    name = "tesseract"
+    supports_batch = True
+    provides_confidences = True
+    supports_regions = True
+
+    def recognize(self, image, psm, source=None):
+        return pytesseract.image_to_alto_xml(
+            image, config=f"--psm {int(psm)}"
+        )
+
+    def recognize_files(self, image_paths, psm):
+        """
+        Runs Tesseract once on a list file of images, so the process
+        start-up and model load are paid once, and splits the multi-page
+        ALTO it writes.
+        """
+        with tempfile.TemporaryDirectory() as work_dir:
+            list_path = os.path.join(work_dir, "images.txt")
+            with open(list_path, "w", encoding="utf-8") as f:
+                for image_path in image_paths:
+                    f.write(os.path.abspath(image_path) + "\n")
+            output_base = os.path.join(work_dir, "batch")
+            subprocess.run(
+                [pytesseract.pytesseract.tesseract_cmd, list_path,
+                 output_base, "--psm", str(int(psm)), "alto"],
+                check=True, capture_output=True,
+            )
+            with open(output_base + ".xml", "rb") as f:
+                return split_alto_pages(
+                    f.read(),
+                    [os.path.basename(path) for path in image_paths]
+                )
+
+
+@register_backend
+class TesserocrBackend(OcrBackend):
+    """
+    Runs Tesseract in-process through tesserocr, keeping the model loaded
+    between pages.
+    """
+
+    name = "tesserocr"
+    provides_confidences = True
+    supports_regions = True
+
+    def __init__(self):
+        try:
+            import tesserocr  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise OcrBackendError(
+                "The tesserocr backend needs the tesserocr package"
+            ) from e
+        self._api = tesserocr.PyTessBaseAPI()
+
+    def recognize(self, image, psm, source=None):
+        # tesserocr.PSM only names the modes; the API takes the number.
+        self._api.SetPageSegMode(int(psm))
+        self._api.SetImage(image)
+        self._api.Recognize()
+        return self._api.GetAltoText(0).encode("utf-8")
+
+
+@register_backend
+class PdfTextBackend(OcrBackend):
+    """
+    Builds ALTO from the text layer of the page's source PDF, scaled to the
+    rasterized page.
+    """
+
+    name = "pdf-text"
+
+    def recognize(self, image, psm, source=None):
+        if source is None:
+            return None
+        import fitz  # pylint: disable=import-outside-toplevel
+        pdf_path, page_number = source
+        with fitz.open(pdf_path) as pdf_document:
+            page = pdf_document.load_page(page_number)
+            words = page.get_text("words")
+            scale_x = image.width / page.rect.width
+            scale_y = image.height / page.rect.height
+        if not words:
+            return None
+
+        lines = {}
+        for x0, y0, x1, y1, text, block, line, _ in words:
+            lines.setdefault((block, line), []).append((
+                round(x0 * scale_x), round(y0 * scale_y),
+                round((x1 - x0) * scale_x), round((y1 - y0) * scale_y), text,
+            ))
+        blocks = {}
+        for (block, _), line_words in sorted(lines.items()):
+            blocks.setdefault(block, []).append(line_words)
+        return build_alto(image.width, image.height, list(blocks.values()))
+
+
+@register_backend
+class StubBackend(OcrBackend):
+    """
+    Produces deterministic ALTO without OCR: synthetic ground truth, seeded
+    by the page's pixels, laid out in lines of words with confidences.
+    """
+
+    name = "stub"
+    provides_confidences = True
+    supports_regions = True
+
+    def recognize(self, image, psm, source=None):
+        seed = zlib.crc32(image.tobytes())
+        words_per_line = 8
+        line_height = max(image.height // 40, 1)
+        word_width = max(image.width // (words_per_line + 1), 1)
+        blocks = []
+        line = 0
+        for block_lines in stub_ground_truth(seed, image.height // line_height):
+            block = []
+            for line_words in block_lines:
+                block.append([
+                    (position * word_width, line * line_height,
+                     word_width * 9 // 10, line_height * 8 // 10, word)
+                    for position, word in enumerate(line_words)
+                ])
+                line += 1
+            blocks.append(block)
+        return build_alto(image.width, image.height, blocks, confidence=0.95)
+
+
+def stub_ground_truth(seed, lines, words_per_line=8, lines_per_block=6):
+    """
+    Returns the synthetic text the stub backend reports for a seed, as
+    blocks of lines of words.
+    """
+    rng = random.Random(seed)
+    blocks = []
+    for start in range(0, lines, lines_per_block):
+        blocks.append([
+            [
+                "".join(
+                    rng.choice("abcdefghijklmnopqrstuvwxyz")
+                    for _ in range(rng.randint(2, 9))
+                )
+                for _ in range(words_per_line)
+            ]
+            for _ in range(min(lines_per_block, lines - start))
+        ])
+    return blocks
+
+
+def build_alto(width, height, blocks, confidence=None):
+    """
+    Builds an ALTO v3 page.
+
+    Args:
+        width: Page width in pixels.
+        height: Page height in pixels.
+        blocks: A list of blocks, each a list of lines, each a list of
+                (hpos, vpos, width, height, content) words.
+        confidence: Word confidence to record, if any.
+
+    Returns:
+        The ALTO XML as bytes.
+    """
+    def element(parent, tag, box, **attributes):
+        x, y, w, h = box
+        return etree.SubElement(
+            parent, f"{{{ALTO_XMLNS}}}{tag}", HPOS=str(x), VPOS=str(y),
+            WIDTH=str(w), HEIGHT=str(h), **attributes
+        )
+
+    def union(boxes):
+        x0 = min(box[0] for box in boxes)
+        y0 = min(box[1] for box in boxes)
+        x1 = max(box[0] + box[2] for box in boxes)
+        y1 = max(box[1] + box[3] for box in boxes)
+        return x0, y0, x1 - x0, y1 - y0
+
+    alto = etree.Element(f"{{{ALTO_XMLNS}}}alto", nsmap={None: ALTO_XMLNS})
+    description = etree.SubElement(alto, f"{{{ALTO_XMLNS}}}Description")
+    etree.SubElement(
+        description, f"{{{ALTO_XMLNS}}}MeasurementUnit"
+    ).text = "pixel"
+    layout = etree.SubElement(alto, f"{{{ALTO_XMLNS}}}Layout")
+    page = etree.SubElement(
+        layout, f"{{{ALTO_XMLNS}}}Page", ID="page_0",
+        WIDTH=str(width), HEIGHT=str(height), PHYSICAL_IMG_NR="1",
+    )
+    print_space = element(page, "PrintSpace", (0, 0, width, height))
+    for block_number, block in enumerate(blocks):
+        words = [word[:4] for line in block for word in line]
+        if not words:
+            continue
+        block_element = element(
+            print_space, "TextBlock", union(words),
+            ID=f"block_{block_number}"
+        )
+        for line_number, line in enumerate(block):
+            if not line:
+                continue
+            line_element = element(
+                block_element, "TextLine",
+                union([word[:4] for word in line]),
+                ID=f"line_{block_number}_{line_number}",
+            )
+            for word_number, (*box, content) in enumerate(line):
+                attributes = {"CONTENT": content}
+                if confidence is not None:
+                    attributes["WC"] = f"{confidence:.2f}"
+                element(
+                    line_element, "String", box,
+                    ID=f"string_{block_number}_{line_number}_{word_number}",
+                    **attributes,
+                )
+    return etree.tostring(
+        alto, pretty_print=True, xml_declaration=True, encoding="UTF-8"
+    )
+
+
+def split_alto_pages(xml, file_names):
+    """
+    Splits the multi-page ALTO XML Tesseract writes for a list of images
+    into one document per image.
+
+    Args:
+        xml: The multi-page ALTO XML.
+        file_names: The source image file name of each page, in order.
+
+    Returns:
+        The ALTO XML of each page, as bytes.
+    """
+    root = etree.fromstring(xml)
+    xmlns = root.nsmap.get(None)
+    namespace = f"{{{xmlns}}}" if xmlns else ""
+    layout = root.find(f"{namespace}Layout")
+    pages = [] if layout is None else layout.findall(f"{namespace}Page")
+    if len(pages) != len(file_names):
+        raise ValueError(
+            f"Expected {len(file_names)} pages, Tesseract returned "
+            f"{len(pages)}"
+        )
+    for page in pages:
+        layout.remove(page)
+
+    documents = []
+    for page, file_name in zip(pages, file_names):
+        document = copy.deepcopy(root)
+        for element in document.iter(f"{namespace}fileName"):
+            element.text = file_name
+        document.find(f"{namespace}Layout").append(page)
+        documents.append(etree.tostring(
+            document, pretty_print=True, xml_declaration=True,
+            encoding="UTF-8"
+        ))
+    return documents
+
+
+def log_throughput(metrics_snapshot):
+    """
+    Logs the pages per second of every backend that ran, from a metrics
+    snapshot.
+    """
+    for name, timing in sorted(metrics_snapshot.get("timings", {}).items()):
+        if not name.startswith("ocr.backend.") or not timing["total"]:
+            continue
+        pages = metrics_snapshot["counters"].get(f"{name}.pages", 0)
+        logging.info(
+            "OCR backend %s: %d page(s) in %.1fs (%.2f pages/s)",
+            name[len("ocr.backend."):], pages, timing["total"],
+            pages / timing["total"],
+        )
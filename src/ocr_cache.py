@@ -0,0 +1,390 @@
+"""
+This module contains a compact binary representation of OCR results.
+
+An OCR cache file holds the same layout information as the ALTO XML the OCR
+stage produces, stored as columnar coordinate arrays, a string table and
+word confidences. Downstream stages memory-map it instead of reparsing XML,
+and ALTO can be exported from it again on demand.
+
+File layout: the magic bytes, a little-endian uint32 header length, a JSON
+header describing every array (dtype, shape and offset), then the raw
+arrays, each aligned to 16 bytes.
+"""
+import argparse
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+from lxml import etree
+
+CACHE_SUFFIX = ".ocrbin"
+MAGIC = b"ALTOBIN1"
+VERSION = 1
+XMLNS = "http://www.loc.gov/standards/alto/ns-v3#"
+_ALIGNMENT = 16
+_MISSING = -1
+
+
+class OcrPage:
+    """
+    A read-only, memory-mapped view of one page of OCR results.
+
+    Strings, lines and blocks are stored in document order, so the strings
+    of a block (or line) are the contiguous range given by its start offsets.
+
+    Attributes:
+        width: Page width, or -1 if unknown.
+        height: Page height, or -1 if unknown.
+        string_boxes: int32 array (n_strings, 4) of HPOS, VPOS, WIDTH, HEIGHT.
+        string_confidences: float32 array of word confidences (NaN if
+                            unknown).
+        line_boxes: int32 array (n_lines, 4).
+        line_starts: int32 array (n_lines + 1) of string offsets.
+        block_boxes: int32 array (n_blocks, 4).
+        block_starts: int32 array (n_blocks + 1) of string offsets.
+        block_line_starts: int32 array (n_blocks + 1) of line offsets.
+        illustration_boxes: int32 array (n_illustrations, 4).
+    """
+
+    def __init__(self, header, buffer):
+        self._buffer = buffer
+        self.width = header["page"]["width"]
+        self.height = header["page"]["height"]
+        arrays = {
+            name: np.frombuffer(
+                buffer,
+                dtype=np.dtype(spec["dtype"]),
+                count=int(np.prod(spec["shape"])),
+                offset=spec["offset"],
+            ).reshape(spec["shape"])
+            for name, spec in header["arrays"].items()
+        }
+        self.string_boxes = arrays["string_boxes"]
+        self.string_confidences = arrays["string_confidences"]
+        self.line_boxes = arrays["line_boxes"]
+        self.line_starts = arrays["line_starts"]
+        self.block_boxes = arrays["block_boxes"]
+        self.block_starts = arrays["block_starts"]
+        self.block_line_starts = arrays["block_line_starts"]
+        self.illustration_boxes = arrays["illustration_boxes"]
+        self._text_offsets = arrays["text_offsets"]
+        self._text = arrays["text"]
+        self._string_text = arrays["string_text"]
+        self._line_ids = arrays["line_ids"]
+        self._block_ids = arrays["block_ids"]
+
+    def __len__(self):
+        return len(self.string_boxes)
+
+    @property
+    def block_count(self):
+        """
+        Number of text blocks on the page.
+        """
+        return len(self.block_boxes)
+
+    def string_content(self, index):
+        """
+        Returns the CONTENT of a string.
+        """
+        return self._table_entry(self._string_text[index])
+
+    def block_id(self, index):
+        """
+        Returns the ID of a text block, or None if it has none.
+        """
+        return self._table_entry(self._block_ids[index])
+
+    def line_id(self, index):
+        """
+        Returns the ID of a text line, or None if it has none.
+        """
+        return self._table_entry(self._line_ids[index])
+
+    def block_contents(self, index):
+        """
+        Returns the CONTENT of every string in a text block.
+        """
+        start, stop = self.block_starts[index], self.block_starts[index + 1]
+        return [self.string_content(i) for i in range(start, stop)]
+
+    def _table_entry(self, entry):
+        if entry == _MISSING:
+            return None
+        start, stop = self._text_offsets[entry], self._text_offsets[entry + 1]
+        return bytes(self._text[start:stop]).decode("utf-8")
+
+
+def is_ocr_cache(path):
+    """
+    Returns True if path names an OCR cache file.
+    """
+    return path.endswith(CACHE_SUFFIX)
+
+
+def write_ocr_cache(alto_path, cache_path=None):
+    """
+    Converts an ALTO XML file into an OCR cache file.
+
+    Args:
+        alto_path: Path to the ALTO XML file.
+        cache_path: Output path. Defaults to alto_path with the cache
+                    suffix.
+
+    Returns:
+        The path of the written cache file.
+    """
+    if cache_path is None:
+        cache_path = os.path.splitext(alto_path)[0] + CACHE_SUFFIX
+    tree = etree.parse(alto_path)
+    arrays, page = _columns_from_alto(tree.getroot())
+
+    header = {"version": VERSION, "page": page, "arrays": {}}
+    offset = 0
+    for name, array in arrays.items():
+        offset = _align(offset)
+        header["arrays"][name] = {
+            "dtype": array.dtype.str,
+            "shape": list(array.shape),
+            "offset": offset,
+        }
+        offset += array.nbytes
+    # The data section starts after the header, whose length in turn
+    # depends on the offsets it records.
+    relative_offsets = {
+        name: spec["offset"] for name, spec in header["arrays"].items()
+    }
+    data_start = 0
+    while True:
+        for name, spec in header["arrays"].items():
+            spec["offset"] = relative_offsets[name] + data_start
+        header_bytes = json.dumps(header).encode("utf-8")
+        needed = _align(len(MAGIC) + 4 + len(header_bytes))
+        if needed <= data_start:
+            break
+        data_start = needed
+
+    temp_path = cache_path + ".tmp"
+    with open(temp_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(header_bytes)))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.write(b"\0" * (header["arrays"][name]["offset"] - f.tell()))
+            f.write(np.ascontiguousarray(array).tobytes())
+    os.replace(temp_path, cache_path)
+    return cache_path
+
+
+def load_ocr_cache(cache_path):
+    """
+    Memory-maps an OCR cache file.
+
+    Raises:
+        ValueError: If the file is not an OCR cache.
+    """
+    with open(cache_path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"Empty OCR cache file: {cache_path}")
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buffer[:len(MAGIC)] != MAGIC:
+        raise ValueError(f"Not an OCR cache file: {cache_path}")
+    (header_length,) = struct.unpack_from("<I", buffer, len(MAGIC))
+    header_start = len(MAGIC) + 4
+    header = json.loads(buffer[header_start:header_start + header_length])
+    if header["version"] != VERSION:
+        raise ValueError(
+            f"Unsupported OCR cache version {header['version']}: {cache_path}"
+        )
+    return OcrPage(header, buffer)
+
+
+def to_alto(page):
+    """
+    Rebuilds an ALTO v3 document from an OCR cache.
+
+    Returns:
+        The ALTO XML as bytes.
+    """
+    alto = etree.Element(f"{{{XMLNS}}}alto", nsmap={None: XMLNS})
+    layout = etree.SubElement(alto, f"{{{XMLNS}}}Layout")
+    page_element = etree.SubElement(layout, f"{{{XMLNS}}}Page")
+    _set_optional(page_element, "WIDTH", page.width)
+    _set_optional(page_element, "HEIGHT", page.height)
+    print_space = etree.SubElement(page_element, f"{{{XMLNS}}}PrintSpace")
+
+    for block in range(page.block_count):
+        block_element = etree.SubElement(print_space, f"{{{XMLNS}}}TextBlock")
+        _set_optional(block_element, "ID", page.block_id(block))
+        _set_box(block_element, page.block_boxes[block])
+        for line in range(
+            page.block_line_starts[block], page.block_line_starts[block + 1]
+        ):
+            line_element = etree.SubElement(
+                block_element, f"{{{XMLNS}}}TextLine"
+            )
+            _set_optional(line_element, "ID", page.line_id(line))
+            _set_box(line_element, page.line_boxes[line])
+            for string in range(
+                page.line_starts[line], page.line_starts[line + 1]
+            ):
+                string_element = etree.SubElement(
+                    line_element, f"{{{XMLNS}}}String"
+                )
+                _set_box(string_element, page.string_boxes[string])
+                confidence = page.string_confidences[string]
+                if not np.isnan(confidence):
+                    string_element.set("WC", f"{confidence:.2f}")
+                string_element.set("CONTENT", page.string_content(string))
+
+    for box in page.illustration_boxes:
+        _set_box(
+            etree.SubElement(print_space, f"{{{XMLNS}}}Illustration"), box
+        )
+
+    return etree.tostring(
+        alto, pretty_print=True, xml_declaration=True, encoding="UTF-8"
+    )
+
+
+def export_alto(cache_path, alto_path):
+    """
+    Writes the ALTO XML for an OCR cache file.
+    """
+    with open(alto_path, "wb") as f:
+        f.write(to_alto(load_ocr_cache(cache_path)))
+    return alto_path
+
+
+def _columns_from_alto(root):
+    table = _StringTable()
+    string_boxes, confidences, string_text = [], [], []
+    line_boxes, line_starts, line_ids = [], [], []
+    block_boxes, block_starts, block_line_starts, block_ids = [], [], [], []
+
+    for block in root.iterfind(".//{*}TextBlock"):
+        block_boxes.append(_box(block))
+        block_ids.append(table.add(block.get("ID")))
+        block_starts.append(len(string_boxes))
+        block_line_starts.append(len(line_boxes))
+        for line in block.iterfind(".//{*}TextLine"):
+            line_boxes.append(_box(line))
+            line_ids.append(table.add(line.get("ID")))
+            line_starts.append(len(string_boxes))
+            for string in line.iterfind("{*}String"):
+                string_boxes.append(_box(string))
+                confidence = string.get("WC")
+                confidences.append(
+                    float(confidence) if confidence is not None else np.nan
+                )
+                string_text.append(table.add(string.get("CONTENT") or ""))
+    block_starts.append(len(string_boxes))
+    block_line_starts.append(len(line_boxes))
+    line_starts.append(len(string_boxes))
+
+    illustrations = [
+        _box(element) for element in root.iterfind(".//{*}Illustration")
+    ]
+    page_element = next(root.iterfind(".//{*}Page"), None)
+    page = {
+        "width": _coordinate(page_element, "WIDTH"),
+        "height": _coordinate(page_element, "HEIGHT"),
+    }
+    text_offsets, text = table.to_arrays()
+    arrays = {
+        "string_boxes": _boxes(string_boxes),
+        "string_confidences": np.array(confidences, dtype=np.float32),
+        "string_text": np.array(string_text, dtype=np.int32),
+        "line_boxes": _boxes(line_boxes),
+        "line_starts": np.array(line_starts, dtype=np.int32),
+        "line_ids": np.array(line_ids, dtype=np.int32),
+        "block_boxes": _boxes(block_boxes),
+        "block_starts": np.array(block_starts, dtype=np.int32),
+        "block_line_starts": np.array(block_line_starts, dtype=np.int32),
+        "block_ids": np.array(block_ids, dtype=np.int32),
+        "illustration_boxes": _boxes(illustrations),
+        "text_offsets": text_offsets,
+        "text": text,
+    }
+    return arrays, page
+
+
+class _StringTable:
+    """
+    Interns strings into one UTF-8 blob addressed by entry number.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._chunks = []
+        self._offsets = [0]
+
+    def add(self, value):
+        """
+        Returns the entry number of value, or -1 for None.
+        """
+        if value is None:
+            return _MISSING
+        entry = self._entries.get(value)
+        if entry is None:
+            encoded = value.encode("utf-8")
+            entry = len(self._chunks)
+            self._entries[value] = entry
+            self._chunks.append(encoded)
+            self._offsets.append(self._offsets[-1] + len(encoded))
+        return entry
+
+    def to_arrays(self):
+        """
+        Returns the offsets and the blob as NumPy arrays.
+        """
+        return (
+            np.array(self._offsets, dtype=np.int64),
+            np.frombuffer(b"".join(self._chunks), dtype=np.uint8),
+        )
+
+
+def _coordinate(element, name):
+    if element is None or element.get(name) is None:
+        return _MISSING
+    return int(float(element.get(name)))
+
+
+def _box(element):
+    return [
+        _coordinate(element, name)
+        for name in ("HPOS", "VPOS", "WIDTH", "HEIGHT")
+    ]
+
+
+def _boxes(boxes):
+    return np.array(boxes, dtype=np.int32).reshape(-1, 4)
+
+
+def _set_optional(element, name, value):
+    if value is not None and value != _MISSING:
+        element.set(name, str(value))
+
+
+def _set_box(element, box):
+    for name, value in zip(("HPOS", "VPOS", "WIDTH", "HEIGHT"), box):
+        _set_optional(element, name, int(value))
+
+
+def _align(offset):
+    return (offset + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert between ALTO XML and OCR cache files"
+    )
+    parser.add_argument("source", help="An ALTO XML or OCR cache file.")
+    parser.add_argument("destination", help="The file to write.")
+    args = parser.parse_args()
+    if is_ocr_cache(args.source):
+        export_alto(args.source, args.destination)
+    else:
+        write_ocr_cache(args.source, args.destination)
@@ -1,16 +1,39 @@
 """
 This module contains the image preprocessing functionality.
+
+Binarized pages are stored as 1-bit data: packed NumPy bit arrays (eight
+pixels per byte, rows padded to whole bytes) in memory and CCITT Group 4
+compressed TIFF on disk, which Tesseract, OpenCV and PIL read natively. A
+PackedPage is decoded from the TIFF once and shared by the stages after OCR,
+which unpack only the regions they crop.
 """
 import logging
 import cv2
+import numpy as np
+from PIL import Image
 
 
-def preprocess_image(image_path, output_path):
+def preprocess_image(image_path, output_path, binarize=False):
     """
     Applies a series of preprocessing steps to the image.
+
+    With binarize, the page is thresholded to black and white and saved as
+    a Group 4 TIFF, whatever the extension of output_path.
     """
     logging.info("Preprocessing image: %s", image_path)
 
+    if binarize:
+        image = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+        if image is None:
+            raise IOError(f"Could not read image: {image_path}")
+        binary = cv2.adaptiveThreshold(
+            image, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY,
+            31, 15
+        )
+        write_g4_tiff(pack_bits(binary), binary.shape[1], output_path)
+        logging.info("Preprocessed image saved to: %s", output_path)
+        return output_path
+
     # Read the image
     image = cv2.imread(image_path)
 
@@ -18,3 +41,86 @@ def preprocess_image(image_path, output_path):
     cv2.imwrite(output_path, image)
     logging.info("Preprocessed image saved to: %s", output_path)
     return output_path
+
+
+def pack_bits(binary):
+    """
+    Packs a binary image (0 for black, anything else for white) into one
+    bit per pixel, with rows padded to whole bytes.
+    """
+    return np.packbits(binary > 0, axis=1)
+
+
+def unpack_bits(bits, width):
+    """
+    Unpacks packed rows into a uint8 image of 0 (black) and 255 (white).
+    """
+    return np.unpackbits(bits, axis=1, count=width) * np.uint8(255)
+
+
+def write_g4_tiff(bits, width, path):
+    """
+    Writes packed rows as a CCITT Group 4 compressed TIFF.
+    """
+    # Packed rows are the raw layout of a PIL 1-bit image, so the page is
+    # never expanded to one byte per pixel.
+    image = Image.frombytes(
+        "1", (width, bits.shape[0]), np.ascontiguousarray(bits).tobytes()
+    )
+    image.save(path, format="TIFF", compression="group4")
+
+
+def read_g4_tiff(path):
+    """
+    Reads a 1-bit TIFF into packed rows.
+
+    Returns:
+        The packed rows and the image width.
+    """
+    with Image.open(path) as image:
+        if image.mode != "1":
+            raise ValueError(f"Not a 1-bit image: {path}")
+        bits = np.frombuffer(image.tobytes(), dtype=np.uint8)
+        return bits.reshape(image.height, -1), image.width
+
+
+class PackedPage:
+    """
+    A binarized page held as packed rows. Slicing it like a 2-D array,
+    e.g. page[y0:y1, x0:x1], unpacks only that region into a uint8 image of
+    0 (black) and 255 (white).
+    """
+
+    def __init__(self, bits, width):
+        self.bits = bits
+        self.width = width
+
+    @classmethod
+    def read(cls, path):
+        """
+        Decodes a 1-bit TIFF.
+        """
+        return cls(*read_g4_tiff(path))
+
+    @property
+    def shape(self):
+        """
+        The (height, width) of the page.
+        """
+        return self.bits.shape[0], self.width
+
+    def __getitem__(self, region):
+        rows, columns = region
+        y0, y1, _ = rows.indices(self.bits.shape[0])
+        x0, x1, _ = columns.indices(self.width)
+        x1 = max(x1, x0)
+        first, last = x0 // 8, -(-x1 // 8)
+        unpacked = np.unpackbits(self.bits[y0:y1, first:last], axis=1)
+        offset = first * 8
+        return unpacked[:, x0 - offset:x1 - offset] * np.uint8(255)
+
+    def unpack(self):
+        """
+        Returns the whole page as a uint8 image.
+        """
+        return unpack_bits(self.bits, self.width)
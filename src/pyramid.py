@@ -0,0 +1,162 @@
+"""
+This module generates Deep Zoom (DZI) image pyramids and a lightweight tile
+viewer, so a reader only downloads the tiles visible at the current zoom
+level instead of the full-resolution scan.
+"""
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+from lxml import etree
+
+DZI_XMLNS = "http://schemas.microsoft.com/deepzoom/2008"
+VIEWER_TEMPLATE = os.path.join(os.path.dirname(__file__), "deepzoom.html")
+
+_ENCODE_PARAMS = {
+    "jpg": [cv2.IMWRITE_JPEG_QUALITY, 85],
+    "webp": [cv2.IMWRITE_WEBP_QUALITY, 80],
+}
+
+
+def level_count(width, height):
+    """
+    Returns the number of pyramid levels for an image, down to 1x1 pixel.
+    """
+    return int(math.ceil(math.log2(max(width, height, 1)))) + 1
+
+
+def tile_bounds(position, tile_size, overlap, limit):
+    """
+    Returns the start and stop pixel of a tile along one axis, including the
+    overlap shared with its neighbours.
+    """
+    start = max(position * tile_size - overlap, 0)
+    stop = min((position + 1) * tile_size + overlap, limit)
+    return start, stop
+
+
+def build_pyramid(
+    image,
+    output_dir,
+    name,
+    tile_size=256,
+    overlap=1,
+    tile_format="jpg",
+    workers=1,
+):
+    """
+    Writes a Deep Zoom pyramid of an already-decoded image.
+
+    Each level is downsampled from the previous one with a single area
+    resize, and the tiles of a level are encoded and written in parallel
+    (OpenCV releases the GIL while encoding).
+
+    Args:
+        image: The page as a NumPy array (grayscale or BGR).
+        output_dir: Directory for the .dzi descriptor and the tile folder.
+        name: Base name of the pyramid.
+        tile_size: Tile edge length in pixels.
+        overlap: Pixels of overlap between neighbouring tiles.
+        tile_format: "jpg" or "webp".
+        workers: Number of encoding threads; callers pass their thread
+                 budget (see src.utils.resources.thread_budget).
+
+    Returns:
+        The path of the written .dzi descriptor.
+    """
+    if tile_format not in _ENCODE_PARAMS:
+        raise ValueError(f"Unsupported tile format: {tile_format}")
+    height, width = image.shape[:2]
+    levels = level_count(width, height)
+    tiles_dir = os.path.join(output_dir, f"{name}_files")
+    params = _ENCODE_PARAMS[tile_format]
+
+    def write_tile(level_image, level_dir, col, row):
+        level_height, level_width = level_image.shape[:2]
+        x0, x1 = tile_bounds(col, tile_size, overlap, level_width)
+        y0, y1 = tile_bounds(row, tile_size, overlap, level_height)
+        ok, encoded = cv2.imencode(
+            f".{tile_format}", level_image[y0:y1, x0:x1], params
+        )
+        if not ok:
+            raise IOError(f"Could not encode tile {col}_{row}")
+        with open(
+            os.path.join(level_dir, f"{col}_{row}.{tile_format}"), "wb"
+        ) as f:
+            f.write(encoded.tobytes())
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        level_image = image
+        for level in range(levels - 1, -1, -1):
+            level_height, level_width = level_image.shape[:2]
+            level_dir = os.path.join(tiles_dir, str(level))
+            os.makedirs(level_dir, exist_ok=True)
+            futures = [
+                executor.submit(write_tile, level_image, level_dir, col, row)
+                for col in range(math.ceil(level_width / tile_size))
+                for row in range(math.ceil(level_height / tile_size))
+            ]
+            for future in futures:
+                future.result()
+            if level > 0:
+                level_image = cv2.resize(
+                    level_image,
+                    (max(1, math.ceil(level_width / 2)),
+                     max(1, math.ceil(level_height / 2))),
+                    interpolation=cv2.INTER_AREA,
+                )
+
+    dzi_path = os.path.join(output_dir, f"{name}.dzi")
+    with open(dzi_path, "w", encoding="utf-8") as f:
+        f.write(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Image xmlns="{DZI_XMLNS}" '
+            f'Format="{tile_format}" Overlap="{overlap}" '
+            f'TileSize="{tile_size}">\n'
+            f'  <Size Width="{width}" Height="{height}"/>\n'
+            '</Image>\n'
+        )
+    logging.info(
+        "Deep Zoom pyramid with %d levels saved to: %s", levels, dzi_path
+    )
+    return dzi_path
+
+
+def write_viewer(dzi_path, viewer_path, title):
+    """
+    Writes a self-contained HTML viewer for a pyramid.
+
+    Args:
+        dzi_path: Path of the .dzi descriptor written by build_pyramid.
+        viewer_path: Where to write the viewer page.
+        title: Page title.
+
+    Returns:
+        The viewer path.
+    """
+    descriptor = etree.parse(dzi_path).getroot()
+    size = descriptor.find(f"{{{DZI_XMLNS}}}Size")
+    name = os.path.splitext(os.path.basename(dzi_path))[0]
+    tiles_url = os.path.relpath(
+        os.path.join(os.path.dirname(dzi_path), f"{name}_files"),
+        os.path.dirname(viewer_path) or ".",
+    ).replace(os.sep, "/")
+    pyramid = {
+        "tiles": tiles_url,
+        "format": descriptor.get("Format"),
+        "overlap": int(descriptor.get("Overlap")),
+        "tileSize": int(descriptor.get("TileSize")),
+        "width": int(size.get("Width")),
+        "height": int(size.get("Height")),
+    }
+    with open(VIEWER_TEMPLATE, "r", encoding="utf-8") as f:
+        template = f.read()
+    html = template.replace("__TITLE__", title).replace(
+        "__PYRAMID__", json.dumps(pyramid)
+    )
+    with open(viewer_path, "w", encoding="utf-8") as f:
+        f.write(html)
+    return viewer_path
@@ -0,0 +1,504 @@
+"""
+This module contains the HTTP OCR service mode, which OCRs single pages on
+demand for other local systems.
+
+A page is POSTed to /ocr as the raw request body: an image, or a PDF with
+the page to OCR in the page query parameter (1-based). The response is a
+JSON object with the page's ALTO XML, RAG records and HTML.
+
+Requests are queued and grouped into micro-batches: a batch is dispatched
+as soon as a worker is free, taking the requests that arrived within
+BatchWaitMs of the first one, up to MaxBatch pages, so each batch costs one
+OCR invocation on a warm worker. At most one batch per worker is in flight;
+once MaxQueue requests are waiting or running, new ones are turned away
+with 503 Service Unavailable. GET /status reports the queue and the queue
+wait and latency timings, and GET /health whether the workers are up.
+"""
+import configparser
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from src.utils.metrics import get_metrics
+from src.utils.resources import CpuAllocator, ResourcePolicy
+from src.workers import create_worker_pool, run_task
+
+SERVICE_DIR = "service"
+UPLOAD_EXTENSIONS = {
+    "image/png": ".png",
+    "image/jpeg": ".jpg",
+    "image/tiff": ".tiff",
+    "image/bmp": ".bmp",
+    "application/pdf": ".pdf",
+}
+
+
+class ServiceBusy(Exception):
+    """
+    Raised when the service queue is full.
+    """
+
+
+class _Request:
+    def __init__(self, request_id, upload_path, page_number):
+        self.id = request_id
+        self.upload_path = upload_path
+        self.page_number = page_number
+        self.received = time.monotonic()
+        self.dispatched = None
+        self.finished = None
+        self.succeeded = False
+        self.error = None
+        self.done = threading.Event()
+        self.abandoned = False
+
+
+class OcrService:
+    """
+    Queues OCR requests and runs them in micro-batches on a pool of warm
+    workers.
+
+    Args:
+        output_dir: Root directory for the processed output; each request
+                    is processed in its own directory under service/.
+        config_path: Path to the configuration file loaded by the workers.
+        handler: Picklable callable run as handler(requests, output_dir,
+                 config) for every batch, where requests is a list of
+                 (upload_path, page_number) tuples. Returns whether each
+                 request succeeded.
+        settings: Dictionary with "workers", "max_batch", "batch_wait",
+                  "max_queue" and "keep_outputs". With zero workers,
+                  batches run in the service's dispatcher thread.
+    """
+
+    def __init__(self, output_dir, config_path, handler, settings):
+        self.output_dir = output_dir
+        self.config_path = config_path
+        self.handler = handler
+        self.settings = settings
+        self.request_root = os.path.join(output_dir, SERVICE_DIR)
+        self.healthy = True
+        self._config = configparser.ConfigParser()
+        self._config.read(config_path)
+        workers = settings["workers"]
+        self._policy = ResourcePolicy.from_config(
+            self._config, max(workers, 1)
+        )
+        self._queue = queue.Queue()
+        self._slots = threading.Semaphore(max(workers, 1))
+        self._cpus = CpuAllocator(self._policy.cpus)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._in_flight = 0
+        self._pool = None
+        self._stop = threading.Event()
+        self._dispatcher = threading.Thread(
+            target=self._dispatch_loop, name="ocr-dispatcher", daemon=True
+        )
+
+    def start(self):
+        """
+        Starts the workers and the dispatcher.
+        """
+        os.makedirs(self.request_root, exist_ok=True)
+        if self.settings["workers"] > 0:
+            self._pool = create_worker_pool(
+                self.config_path, self.settings["workers"], self._policy
+            )
+        self._dispatcher.start()
+
+    def stop(self):
+        """
+        Stops the dispatcher and waits for the running batches.
+        """
+        self._stop.set()
+        if self._dispatcher.is_alive():
+            self._dispatcher.join()
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+
+    def submit(self, upload, extension, page_number=0):
+        """
+        Queues a page for OCR.
+
+        Args:
+            upload: The image or PDF, as bytes.
+            extension: File extension of the upload, e.g. ".png" or ".pdf".
+            page_number: The page of a PDF to OCR (0-based).
+
+        Returns:
+            The request; its done event is set once it has been processed.
+
+        Raises:
+            ServiceBusy: If MaxQueue requests are already waiting or
+                         running.
+        """
+        metrics = get_metrics()
+        with self._lock:
+            if self._pending >= self.settings["max_queue"]:
+                metrics.increment("service.rejected")
+                raise ServiceBusy(
+                    f"{self._pending} requests are already queued"
+                )
+            self._pending += 1
+        request_id = uuid.uuid4().hex
+        request_dir = os.path.join(self.request_root, request_id)
+        os.makedirs(request_dir)
+        name = "upload" if extension == ".pdf" else "page"
+        upload_path = os.path.join(request_dir, name + extension)
+        with open(upload_path, "wb") as f:
+            f.write(upload)
+        request = _Request(request_id, upload_path, page_number)
+        metrics.increment("service.requests")
+        self._queue.put(request)
+        return request
+
+    def result(self, request):
+        """
+        Returns the outputs of a processed request as a JSON-serializable
+        dictionary, and removes them from disk unless KeepOutputs is set.
+        """
+        request_dir = os.path.dirname(request.upload_path)
+        response = {
+            "id": request.id,
+            "succeeded": request.succeeded,
+            "alto": None,
+            "rag": None,
+            "html": None,
+            "latency": {
+                "queued": request.dispatched - request.received,
+                "processing": request.finished - request.dispatched,
+                "total": request.finished - request.received,
+            },
+        }
+        if request.succeeded:
+            response.update(_read_outputs(request_dir))
+        self._remove_outputs(request)
+        return response
+
+    def abandon(self, request):
+        """
+        Gives up on a request whose client stopped waiting; its outputs are
+        removed once it has been processed.
+        """
+        with self._lock:
+            if request.done.is_set():
+                self._remove_outputs(request)
+            else:
+                request.abandoned = True
+
+    def _remove_outputs(self, request):
+        if not self.settings["keep_outputs"]:
+            shutil.rmtree(
+                os.path.dirname(request.upload_path), ignore_errors=True
+            )
+
+    def status(self):
+        """
+        Returns the queue state and the service metrics.
+        """
+        with self._lock:
+            pending, in_flight = self._pending, self._in_flight
+        return {
+            "healthy": self.healthy,
+            "workers": self.settings["workers"],
+            "pending": pending,
+            "batches_in_flight": in_flight,
+            **get_metrics().snapshot(),
+        }
+
+    def _dispatch_loop(self):
+        while not self._stop.is_set():
+            try:
+                first = self._queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            # Requests keep queueing while every worker is busy, so the next
+            # batch grows with the load.
+            self._slots.acquire()
+            batch = [first]
+            deadline = time.monotonic() + self.settings["batch_wait"]
+            while len(batch) < self.settings["max_batch"]:
+                remaining = deadline - time.monotonic()
+                try:
+                    if remaining > 0:
+                        batch.append(self._queue.get(timeout=remaining))
+                    else:
+                        batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._dispatch(batch)
+            except Exception as e:  # pylint: disable=broad-except
+                # The batch fails, but the service keeps dispatching.
+                logging.exception("Could not dispatch a batch")
+                if not batch[0].done.is_set():
+                    self._complete(batch, _failure(e))
+
+    def _dispatch(self, batch):
+        with self._lock:
+            self._in_flight += 1
+        metrics = get_metrics()
+        metrics.increment("service.batches")
+        metrics.increment("service.batched_requests", len(batch))
+        now = time.monotonic()
+        for request in batch:
+            request.dispatched = now
+            metrics.observe("service.queue_wait", now - request.received)
+        requests = [
+            (request.upload_path, request.page_number) for request in batch
+        ]
+
+        if self._pool is None:
+            self._complete(batch, _run_inline(
+                self.handler, requests, self.output_dir, self._config
+            ))
+            return
+        plan = self._policy.plan(self._in_flight + self._queue.qsize())
+        # Waits for the batches in flight to leave a CPU free.
+        cpus = self._cpus.acquire(plan.threads)
+        future = None
+        try:
+            # A worker that died while idle only shows when submitting, so
+            # the batch is resubmitted once to a new pool.
+            for _ in range(2):
+                if not self.healthy:
+                    self._restart_pool()
+                try:
+                    future = self._pool.submit(
+                        run_task, self.handler, requests, self.output_dir,
+                        cpus=cpus,
+                    )
+                    break
+                except BrokenProcessPool as e:
+                    logging.error("Worker pool failed: %s", e)
+                    self.healthy = False
+        finally:
+            if future is None:
+                self._cpus.release(cpus)
+        if future is None:
+            self._complete(batch, _failure("The worker pool failed"))
+            return
+        future.add_done_callback(
+            lambda f: self._complete(batch, self._outcome(f), cpus)
+        )
+
+    def _restart_pool(self):
+        logging.warning("Restarting the worker pool")
+        self._pool.shutdown(wait=False)
+        self._pool = create_worker_pool(
+            self.config_path, self.settings["workers"], self._policy
+        )
+        self.healthy = True
+
+    def _outcome(self, future):
+        try:
+            return future.result()
+        except BrokenProcessPool as e:
+            # A worker died; the pool is replaced before the next batch.
+            logging.error("Worker pool failed: %s", e)
+            self.healthy = False
+            return _failure(e)
+        except Exception as e:  # pylint: disable=broad-except
+            logging.error("Batch failed: %s", e)
+            return _failure(e)
+
+    def _complete(self, batch, outcome, cpus=None):
+        metrics = get_metrics()
+        metrics.merge(outcome["metrics"])
+        results = outcome["result"] or [False] * len(batch)
+        now = time.monotonic()
+        for request, succeeded in zip(batch, results):
+            request.finished = now
+            request.succeeded = bool(succeeded)
+            request.error = None if succeeded else (
+                outcome["error"] or "OCR failed"
+            )
+            metrics.increment(
+                "service.completed" if succeeded else "service.failed"
+            )
+            metrics.observe("service.latency", now - request.received)
+        with self._lock:
+            for request in batch:
+                request.done.set()
+                if request.abandoned:
+                    self._remove_outputs(request)
+            self._in_flight -= 1
+            self._pending -= len(batch)
+        if cpus is not None:
+            self._cpus.release(cpus)
+        self._slots.release()
+
+
+def _failure(error):
+    return {"result": False, "error": str(error), "metrics": {}}
+
+
+def _run_inline(handler, requests, output_dir, config):
+    try:
+        return {
+            "result": handler(requests, output_dir, config),
+            "error": None,
+            "metrics": {},
+        }
+    except Exception as e:  # pylint: disable=broad-except
+        return _failure(e)
+
+
+def _read_outputs(request_dir):
+    # pylint: disable=import-outside-toplevel
+    from src.ocr_cache import load_ocr_cache, to_alto
+
+    outputs = {}
+    alto_path = os.path.join(request_dir, "ocr", "page.xml")
+    cache_path = os.path.join(request_dir, "ocr", "page.ocrbin")
+    if os.path.exists(alto_path):
+        with open(alto_path, "rb") as f:
+            outputs["alto"] = f.read().decode("utf-8")
+    elif os.path.exists(cache_path):
+        outputs["alto"] = to_alto(load_ocr_cache(cache_path)).decode("utf-8")
+    rag_path = os.path.join(request_dir, "rag", "page.json")
+    if os.path.exists(rag_path):
+        with open(rag_path, "r", encoding="utf-8") as f:
+            outputs["rag"] = json.load(f)
+    html_path = os.path.join(request_dir, "html", "page.html")
+    if os.path.exists(html_path):
+        with open(html_path, "r", encoding="utf-8") as f:
+            outputs["html"] = f.read()
+    return outputs
+
+
+class _ServiceRequestHandler(BaseHTTPRequestHandler):
+    server_version = "OCRService/1.0"
+    # Seconds a client may stall while sending a request before its
+    # connection is dropped, so a stalled upload does not hold a thread.
+    timeout = 60
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """
+        Reports the service's status at /status and its health at /health.
+        """
+        service = self.server.service
+        path = urlparse(self.path).path
+        if path == "/status":
+            self._send_json(200, service.status())
+        elif path == "/health":
+            self._send_json(200 if service.healthy else 503,
+                            {"healthy": service.healthy})
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """
+        OCRs the image or PDF page uploaded to /ocr and returns its outputs.
+        """
+        service = self.server.service
+        url = urlparse(self.path)
+        if url.path != "/ocr":
+            self._send_json(404, {"error": "Not found"})
+            return
+        content_type = self.headers.get("Content-Type", "").split(";")[0]
+        extension = UPLOAD_EXTENSIONS.get(content_type.strip().lower())
+        if extension is None:
+            self._send_json(415, {
+                "error": f"Unsupported content type '{content_type}'"
+            })
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self._send_json(411, {"error": "Content-Length is required"})
+            return
+        if not length.strip().isdecimal():
+            self._send_json(400, {
+                "error": "Content-Length must be a non-negative integer"
+            })
+            return
+        length = int(length)
+        if length > service.settings["max_upload_bytes"]:
+            self._send_json(413, {"error": "Upload too large"})
+            return
+        try:
+            page = int(parse_qs(url.query).get("page", ["1"])[0])
+        except ValueError:
+            page = 0
+        if page < 1:
+            self._send_json(400, {"error": "page must be a positive integer"})
+            return
+
+        upload = self.rfile.read(length)
+        if len(upload) < length:
+            self._send_json(400, {"error": "Incomplete upload"})
+            return
+        try:
+            request = service.submit(upload, extension, page - 1)
+        except ServiceBusy as e:
+            self._send_json(503, {"error": str(e)}, {"Retry-After": "1"})
+            return
+        if not request.done.wait(service.settings["request_timeout"]):
+            service.abandon(request)
+            self._send_json(504, {"id": request.id, "error": "Timed out"})
+            return
+        response = service.result(request)
+        if request.succeeded:
+            self._send_json(200, response)
+        else:
+            self._send_json(422, {**response, "error": request.error})
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logging.debug("%s - %s", self.address_string(), format % args)
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def create_server(service, host, port):
+    """
+    Returns a threading HTTP server bound to (host, port) that hands
+    requests to service. Port 0 picks a free port.
+    """
+    server = ThreadingHTTPServer((host, port), _ServiceRequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    return server
+
+
+def run_service(output_dir, config_path, handler, settings, stop_event=None):
+    """
+    Runs the OCR service until stop_event is set (or forever).
+
+    Args:
+        settings: The OcrService settings plus "host", "port",
+                  "request_timeout" and "max_upload_bytes".
+    """
+    service = OcrService(output_dir, config_path, handler, settings)
+    server = create_server(service, settings["host"], settings["port"])
+    service.start()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logging.info(
+        "OCR service listening on http://%s:%d with %d worker(s)",
+        *server.server_address[:2], settings["workers"]
+    )
+    try:
+        while stop_event is None or not stop_event.is_set():
+            time.sleep(0.5)
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.stop()
+        logging.info("OCR service stopped")
@@ -0,0 +1,243 @@
+"""
+This module maintains a static, paginated index of the processed collection:
+title -> issue date -> document -> pages.
+
+The index is updated incrementally as documents complete. Its state is
+sharded into small JSON files (one per title and one per issue), and only
+the listing pages affected by a change are regenerated, so adding an issue
+touches a handful of files however large the collection is.
+"""
+import fcntl
+import json
+import logging
+import os
+import re
+from contextlib import contextmanager
+
+from lxml import etree
+
+INDEX_DIR = "index"
+UNDATED = "undated"
+UNTITLED = "Untitled"
+
+_DATE_PATTERN = re.compile(r"(\d{4})[-_]?(\d{2})[-_]?(\d{2})")
+_ISSUE_DATE_PATTERN = re.compile(r"(\d{4})[-_/.]?(\d{2})[-_/.]?(\d{2})")
+
+
+def slugify(value, default="untitled"):
+    """
+    Returns a file-name-safe version of value, or default if nothing of it
+    is left.
+    """
+    return re.sub(r"[^a-z0-9]+", "-", value.lower()).strip("-") or default
+
+
+def issue_key(issue_date):
+    """
+    Returns the form of an issue date used in the index and its paths:
+    YYYY-MM-DD if it is a date (e.g. 1901/01/02), else a slug of it.
+    """
+    if not issue_date:
+        return UNDATED
+    match = _ISSUE_DATE_PATTERN.fullmatch(issue_date.strip())
+    if match is not None:
+        return "-".join(match.groups())
+    key = slugify(issue_date, UNDATED)
+    logging.warning(
+        "Issue date '%s' is not YYYY-MM-DD; it is indexed as '%s'",
+        issue_date, key
+    )
+    return key
+
+
+def issue_date_from_name(file_name):
+    """
+    Returns the YYYY-MM-DD date embedded in a file name, or None.
+    """
+    match = _DATE_PATTERN.search(file_name)
+    if match is None:
+        return None
+    return "-".join(match.groups())
+
+
+class SiteIndex:
+    """
+    The collection index rooted at <output_dir>/index.
+    """
+
+    def __init__(self, output_dir, page_size=100):
+        self.output_dir = output_dir
+        self.index_dir = os.path.join(output_dir, INDEX_DIR)
+        self.data_dir = os.path.join(self.index_dir, "_data")
+        self.page_size = page_size
+
+    def add_document(self, title, issue_date, document, pages):
+        """
+        Adds (or replaces) a document and its pages.
+
+        Args:
+            title: Newspaper title, or None.
+            issue_date: Issue date (YYYY-MM-DD), or None.
+            document: Document name.
+            pages: List of (page_name, path) tuples, where path is the
+                   page's HTML file relative to the output directory.
+
+        Returns:
+            The list of index files that were written.
+        """
+        title = title or UNTITLED
+        # The date names a directory, so it must not add or leave one.
+        issue_date = issue_key(issue_date)
+        title_slug = slugify(title)
+        written = []
+
+        with self._locked():
+            titles = self._load("titles.json", {})
+            if title_slug not in titles:
+                titles[title_slug] = title
+                self._save("titles.json", titles)
+                written += self._write_listing(
+                    self.index_dir, "Titles",
+                    [(name, f"{slug}/index.html")
+                     for slug, name in sorted(titles.items())],
+                    sorted(titles).index(title_slug),
+                )
+
+            title_dir = os.path.join(self.index_dir, title_slug)
+            issues_file = os.path.join(title_slug, "issues.json")
+            issues = self._load(issues_file, [])
+            if issue_date not in issues:
+                issues.append(issue_date)
+                issues.sort()
+                self._save(issues_file, issues)
+                written += self._write_listing(
+                    title_dir, title,
+                    [(date, f"{date}/index.html") for date in issues],
+                    issues.index(issue_date),
+                )
+
+            issue_dir = os.path.join(title_dir, issue_date)
+            issue_file = os.path.join(title_slug, f"{issue_date}.json")
+            documents = self._load(issue_file, {})
+            is_new_document = document not in documents
+            documents[document] = [list(page) for page in pages]
+            self._save(issue_file, documents)
+            if is_new_document:
+                names = sorted(documents)
+                written += self._write_listing(
+                    issue_dir, f"{title}, {issue_date}",
+                    [(name, f"{slugify(name)}/index.html") for name in names],
+                    names.index(document),
+                )
+
+            written += self._write_listing(
+                os.path.join(issue_dir, slugify(document)), document,
+                [(page_name,
+                  os.path.abspath(os.path.join(self.output_dir, path)))
+                 for page_name, path in pages],
+                0,
+            )
+
+        logging.info(
+            "Site index updated for %s (%d files written)",
+            document, len(written)
+        )
+        return written
+
+    def _write_listing(self, directory, heading, entries, first_changed):
+        """
+        Writes the paginated listing pages (index.html, index-2.html, ...)
+        from the one holding entry first_changed onwards, plus the page
+        before it when the page count grew and it needs a "next" link.
+        """
+        os.makedirs(directory, exist_ok=True)
+        page_count = max(1, -(-len(entries) // self.page_size))
+        start_page = first_changed // self.page_size
+        if start_page > 0 and not os.path.exists(
+            os.path.join(directory, _listing_name(page_count))
+        ):
+            start_page -= 1
+
+        written = []
+        for page_number in range(start_page, page_count):
+            chunk = entries[
+                page_number * self.page_size:
+                (page_number + 1) * self.page_size
+            ]
+            path = os.path.join(directory, _listing_name(page_number + 1))
+            _write_listing_page(
+                path, heading, chunk, page_number + 1, page_count
+            )
+            written.append(path)
+
+        # Drop pages left over from a listing that used to be longer.
+        stale_page = page_count + 1
+        while os.path.exists(
+            os.path.join(directory, _listing_name(stale_page))
+        ):
+            os.remove(os.path.join(directory, _listing_name(stale_page)))
+            stale_page += 1
+        return written
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        with open(os.path.join(self.data_dir, ".lock"), "w",
+                  encoding="utf-8") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self, name, default):
+        path = os.path.join(self.data_dir, name)
+        if not os.path.exists(path):
+            return default
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _save(self, name, value):
+        path = os.path.join(self.data_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(value, f, indent=4)
+        os.replace(temp_path, path)
+
+
+def _listing_name(page_number):
+    return "index.html" if page_number == 1 else f"index-{page_number}.html"
+
+
+def _write_listing_page(path, heading, entries, page_number, page_count):
+    directory = os.path.dirname(path)
+    html = etree.Element("html")
+    head = etree.SubElement(html, "head")
+    etree.SubElement(head, "title").text = heading
+    body = etree.SubElement(html, "body")
+    etree.SubElement(body, "h1").text = heading
+    listing = etree.SubElement(body, "ul")
+    for label, target in entries:
+        if os.path.isabs(target):
+            target = os.path.relpath(target, os.path.abspath(directory))
+        link = etree.SubElement(
+            etree.SubElement(listing, "li"), "a",
+            href=target.replace(os.sep, "/")
+        )
+        link.text = label
+
+    navigation = etree.SubElement(body, "nav")
+    if page_number > 1:
+        etree.SubElement(
+            navigation, "a", href=_listing_name(page_number - 1)
+        ).text = "Previous"
+    if page_number < page_count:
+        etree.SubElement(
+            navigation, "a", href=_listing_name(page_number + 1)
+        ).text = "Next"
+
+    with open(path, "wb") as f:
+        f.write(etree.tostring(
+            html, pretty_print=True, method="html", encoding="utf-8"
+        ))
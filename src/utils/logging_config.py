@@ -1,31 +1,234 @@
 """
 This module contains the logging configuration for the project.
+
+Records are not written by the code that logs them: the root logger only
+has a QueueHandler, which puts each record on a multiprocessing queue, and
+a single listener thread in the main process writes them to the console and
+to pipeline.log. Worker processes log through the same queue, so the log
+file has one writer and a page's OCR never waits on log I/O.
+
+The listener drops warnings and errors whose message repeats more than
+RateLimit times a minute, and reports how many were dropped with the next
+copy that gets through. Records carry the document, page and
+stage set with log_context(), which the JSON-lines format includes.
 """
+import atexit
+import contextlib
+import contextvars
+import json
 import logging
+import multiprocessing
 import os
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+CONTEXT_FIELDS = ('document', 'page', 'stage')
+# Messages remembered by RateLimitFilter before expired ones are forgotten.
+_MAX_LIMITED_MESSAGES = 1000
 
+_CONTEXT = contextvars.ContextVar('log_context', default={})
+_STATE = None
 
-def setup_logging(log_dir):
+
+class RateLimitFilter(logging.Filter):
     """
-    Configures logging to both console and file.
+    Lets through at most limit copies of the same warning or error message
+    in each window of seconds. Lower levels are never limited, and distinct
+    messages (e.g. the failures of different files) are always let through.
     """
-    log_file = os.path.join(log_dir, 'pipeline.log')
 
-    # Create a logger
-    logger = logging.getLogger()
-    logger.setLevel(logging.INFO)
+    def __init__(self, limit=10, window=60.0):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self._messages = {}
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING or self.limit <= 0:
+            return True
+        message = record.getMessage()
+        key = (message, record.levelno)
+        seen = self._messages.get(key)
+        if seen is None or record.created - seen[0] >= self.window:
+            if seen is None and len(self._messages) >= _MAX_LIMITED_MESSAGES:
+                self._forget_expired(record.created)
+            # [window start, records let through, records dropped]
+            self._messages[key] = [record.created, 1, 0]
+            if seen is not None and seen[2]:
+                record.msg = (
+                    f"{message} ({seen[2]} repeated message(s) suppressed)"
+                )
+                record.args = None
+            return True
+        if seen[1] < self.limit:
+            seen[1] += 1
+            return True
+        seen[2] += 1
+        return False
+
+    def _forget_expired(self, now):
+        self._messages = {
+            key: seen for key, seen in self._messages.items()
+            if now - seen[0] < self.window
+        }
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats records as one JSON object per line, with the log context
+    fields of the record.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'process': record.process,
+            'message': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _ContextQueueHandler(QueueHandler):
+    def prepare(self, record):
+        record = super().prepare(record)
+        for field, value in _CONTEXT.get().items():
+            setattr(record, field, value)
+        return record
+
+
+class _LogWriter(QueueListener):
+    def __init__(self, queue, handlers, record_filter):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.record_filter = record_filter
+
+    def handle(self, record):
+        # Filtered once here rather than per handler.
+        if self.record_filter.filter(record):
+            super().handle(record)
 
-    # Create handlers
-    file_handler = logging.FileHandler(log_file)
-    stream_handler = logging.StreamHandler()
 
-    # Create formatters and add it to handlers
-    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-    file_handler.setFormatter(formatter)
-    stream_handler.setFormatter(formatter)
+class _LoggingState:
+    def __init__(self, settings, queue, listener, handler):
+        self.settings = settings
+        self.queue = queue
+        self.listener = listener
+        self.handler = handler
 
-    # Add handlers to the logger
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+
+def setup_logging(log_dir, level=logging.INFO, json_lines=False,
+                  rate_limit=10):
+    """
+    Configures logging to both console and file. Calling it again with the
+    same settings does nothing; with other settings, the previous log
+    writer is flushed and replaced.
+
+    Args:
+        log_dir: Directory of pipeline.log.
+        level: The lowest level that is logged.
+        json_lines: If True, records are written as JSON lines.
+        rate_limit: Repeated warnings and errors allowed per line of code
+                    and minute (0 for no limit).
+    """
+    global _STATE  # pylint: disable=global-statement
+    log_file = os.path.join(log_dir, 'pipeline.log')
+    settings = (log_file, level, json_lines, rate_limit)
+    root = logging.getLogger()
+    if _STATE is not None and _STATE.settings == settings:
+        if _STATE.handler not in root.handlers:
+            root.addHandler(_STATE.handler)
+        return
+    shutdown_logging()
+
+    if json_lines:
+        formatter = JsonLinesFormatter()
+    else:
+        formatter = logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    queue = multiprocessing.Queue(-1)
+    listener = _LogWriter(queue, handlers, RateLimitFilter(rate_limit))
+    listener.start()
+    # Registered after the queue, so the writer is stopped before
+    # multiprocessing closes the queue at exit.
+    atexit.unregister(shutdown_logging)
+    atexit.register(shutdown_logging)
+    queue_handler = _ContextQueueHandler(queue)
+    root.setLevel(level)
+    root.addHandler(queue_handler)
+    _STATE = _LoggingState(settings, queue, listener, queue_handler)
 
     logging.info("Logging configured. Log file at: %s", log_file)
+
+
+def logging_options(config):
+    """
+    Returns the setup_logging() keyword arguments set in the [Logging]
+    section of the configuration.
+    """
+    log_format = config.get('Logging', 'Format', fallback='text')
+    return {
+        'level': config.get('Logging', 'Level', fallback='INFO').upper(),
+        'json_lines': log_format == 'json',
+        'rate_limit': config.getint('Logging', 'RateLimit', fallback=10),
+    }
+
+
+def shutdown_logging():
+    """
+    Writes the queued records and stops the log writer.
+    """
+    global _STATE  # pylint: disable=global-statement
+    if _STATE is None:
+        return
+    logging.getLogger().removeHandler(_STATE.handler)
+    _STATE.listener.stop()
+    for handler in _STATE.listener.handlers:
+        handler.close()
+    _STATE = None
+
+
+def logging_settings():
+    """
+    Returns the settings a worker process needs to log through this
+    process's log writer, or None when logging is not set up.
+    """
+    if _STATE is None:
+        return None
+    return {'queue': _STATE.queue, 'level': logging.getLogger().level}
+
+
+def configure_worker_logging(settings):
+    """
+    Sends the records of this worker process to the log writer of the
+    process that created it.
+    """
+    global _STATE  # pylint: disable=global-statement
+    if settings is None:
+        return
+    # A forked worker inherits the parent's state, but not its writer.
+    _STATE = None
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        if isinstance(handler, _ContextQueueHandler):
+            root.removeHandler(handler)
+    root.setLevel(settings['level'])
+    root.addHandler(_ContextQueueHandler(settings['queue']))
+
+
+@contextlib.contextmanager
+def log_context(**fields):
+    """
+    Adds fields (document, page, stage) to the records logged in the
+    enclosed code.
+    """
+    token = _CONTEXT.set({**_CONTEXT.get(), **fields})
+    try:
+        yield
+    finally:
+        _CONTEXT.reset(token)
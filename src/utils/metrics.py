@@ -0,0 +1,90 @@
+"""
+This module contains simple in-process counters and timings used to report
+pipeline progress and health.
+"""
+import threading
+
+
+class Metrics:
+    """
+    A thread-safe collection of named counters and timings.
+
+    Snapshots are plain dictionaries so they can be returned from worker
+    processes and merged into the parent's metrics.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._timings = {}
+
+    def increment(self, name, value=1):
+        """
+        Adds value to the named counter.
+        """
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set(self, name, value):
+        """
+        Sets the named counter to an absolute value (a gauge).
+        """
+        with self._lock:
+            self._counters[name] = value
+
+    def observe(self, name, seconds):
+        """
+        Records one duration for the named timing.
+        """
+        with self._lock:
+            timing = self._timings.setdefault(
+                name, {"count": 0, "total": 0.0, "max": 0.0}
+            )
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+
+    def merge(self, snapshot):
+        """
+        Adds the counters and timings of another snapshot to this one.
+        """
+        with self._lock:
+            for name, value in snapshot.get("counters", {}).items():
+                self._counters[name] = self._counters.get(name, 0) + value
+            for name, other in snapshot.get("timings", {}).items():
+                timing = self._timings.setdefault(
+                    name, {"count": 0, "total": 0.0, "max": 0.0}
+                )
+                timing["count"] += other["count"]
+                timing["total"] += other["total"]
+                timing["max"] = max(timing["max"], other["max"])
+
+    def snapshot(self, reset=False):
+        """
+        Returns a copy of all counters and timings.
+
+        Args:
+            reset: If True, clears the metrics after taking the snapshot.
+        """
+        with self._lock:
+            snapshot = {
+                "counters": dict(self._counters),
+                "timings": {
+                    name: dict(timing)
+                    for name, timing in self._timings.items()
+                },
+            }
+            if reset:
+                self._counters.clear()
+                self._timings.clear()
+        return snapshot
+
+
+_METRICS = Metrics()
+
+
+def get_metrics():
+    """
+    Returns the process-wide metrics instance.
+    """
+    return _METRICS
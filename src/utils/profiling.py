@@ -0,0 +1,219 @@
+"""
+This module contains the optional per-stage profiler.
+
+When profiling is off, profile_stage() returns a shared no-op context
+manager, so the pipeline pays nothing for the instrumentation. When it is
+on, every stage gets its own cProfile profiler; each process dumps its
+profiles into the profile directory, and write_profile_report() merges the
+dumps of all processes into one report with the top functions by cumulative
+time and collapsed stacks for flame graphs.
+"""
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import shutil
+from collections import defaultdict
+
+_NULL_CONTEXT = contextlib.nullcontext()
+_MAX_STACK_DEPTH = 64
+_STATE = None
+
+
+class _ProfilingState:
+    def __init__(self, profile_dir, sample_every):
+        self.profile_dir = profile_dir
+        self.sample_every = max(1, sample_every)
+        self.pages_seen = 0
+        self.page_sampled = True
+        self.active_stage = None
+        self.profilers = {}
+
+
+def configure_profiling(profile_dir, sample_every=1, reset=True):
+    """
+    Enables profiling for this process.
+
+    Args:
+        profile_dir: Directory the profiles are written to.
+        sample_every: Profile every Nth page only.
+        reset: If True, profiles of earlier runs are removed.
+    """
+    global _STATE  # pylint: disable=global-statement
+    if reset:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+    os.makedirs(profile_dir, exist_ok=True)
+    _STATE = _ProfilingState(profile_dir, sample_every)
+    logging.info(
+        "Profiling every %d page(s) into %s", _STATE.sample_every, profile_dir
+    )
+
+
+def disable_profiling():
+    """
+    Disables profiling for this process, discarding unflushed profiles.
+    """
+    global _STATE  # pylint: disable=global-statement
+    _STATE = None
+
+
+def profiling_settings():
+    """
+    Returns the settings needed to enable the same profiling in a worker
+    process, or None when profiling is off.
+    """
+    if _STATE is None:
+        return None
+    return {
+        "profile_dir": _STATE.profile_dir,
+        "sample_every": _STATE.sample_every,
+    }
+
+
+def begin_page():
+    """
+    Marks the start of a page and decides whether it is sampled.
+    """
+    if _STATE is None:
+        return
+    _STATE.page_sampled = _STATE.pages_seen % _STATE.sample_every == 0
+    _STATE.pages_seen += 1
+
+
+def profile_stage(stage):
+    """
+    Returns a context manager that profiles the enclosed code as stage.
+    """
+    if _STATE is None or not _STATE.page_sampled:
+        return _NULL_CONTEXT
+    if _STATE.active_stage is not None:
+        # Only one profiler can run at a time; nested code is attributed
+        # to the enclosing stage.
+        return _NULL_CONTEXT
+    return _profiled(stage)
+
+
+@contextlib.contextmanager
+def _profiled(stage):
+    profiler = _STATE.profilers.get(stage)
+    if profiler is None:
+        profiler = _STATE.profilers[stage] = cProfile.Profile()
+    _STATE.active_stage = stage
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        _STATE.active_stage = None
+
+
+def flush_profiles():
+    """
+    Writes this process's accumulated profiles to the profile directory.
+    """
+    if _STATE is None:
+        return
+    for stage, profiler in _STATE.profilers.items():
+        stage_dir = os.path.join(_STATE.profile_dir, stage)
+        os.makedirs(stage_dir, exist_ok=True)
+        profiler.dump_stats(os.path.join(stage_dir, f"{os.getpid()}.prof"))
+
+
+def write_profile_report(profile_dir, top_n=25):
+    """
+    Merges the profiles of all processes and writes, per stage, a combined
+    .prof file and a .collapsed file of stacks for flame graph tools, plus
+    a report.txt listing the top functions by cumulative time.
+
+    Returns:
+        The path of the report.
+    """
+    report = io.StringIO()
+    for stage in sorted(os.listdir(profile_dir)):
+        stage_dir = os.path.join(profile_dir, stage)
+        if not os.path.isdir(stage_dir):
+            continue
+        dumps = [
+            os.path.join(stage_dir, name)
+            for name in sorted(os.listdir(stage_dir))
+            if name.endswith(".prof")
+        ]
+        if not dumps:
+            continue
+        stats = pstats.Stats(*dumps, stream=report)
+        stats.dump_stats(os.path.join(profile_dir, f"{stage}.prof"))
+        with open(os.path.join(profile_dir, f"{stage}.collapsed"), "w",
+                  encoding="utf-8") as f:
+            for stack, microseconds in sorted(
+                collapsed_stacks(stats.stats).items()
+            ):
+                f.write(f"{stage};{stack} {microseconds}\n")
+
+        report.write(
+            f"=== {stage}: {stats.total_tt:.3f}s across "
+            f"{len(dumps)} process(es) ===\n"
+        )
+        stats.sort_stats("cumulative").print_stats(top_n)
+
+    report_path = os.path.join(profile_dir, "report.txt")
+    with open(report_path, "w", encoding="utf-8") as f:
+        f.write(report.getvalue())
+    logging.info("Profile report saved to: %s", report_path)
+    return report_path
+
+
+def collapsed_stacks(stats):
+    """
+    Reconstructs approximate call stacks from pstats data.
+
+    cProfile only records caller/callee pairs, so each callee's time is
+    split over its callers in proportion to the time spent on each edge.
+
+    Args:
+        stats: The stats dictionary of a pstats.Stats object.
+
+    Returns:
+        A dictionary mapping "outer;...;inner" stacks to their self time in
+        microseconds.
+    """
+    callees = defaultdict(dict)
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees[caller][func] = edge
+
+    stacks = defaultdict(float)
+
+    def visit(func, path, weight):
+        path = path + (func,)
+        stacks[path] += stats[func][2] * weight
+        if len(path) >= _MAX_STACK_DEPTH:
+            return
+        for callee, edge in callees.get(func, {}).items():
+            callee_time = stats.get(callee, (0, 0, 0, 0))[3]
+            if callee in path or callee_time <= 0:
+                continue
+            share = weight * edge[3] / callee_time
+            if share * callee_time >= 1e-6:
+                visit(callee, path, share)
+
+    for func, (_, _, _, _, callers) in stats.items():
+        if not callers:
+            visit(func, (), 1.0)
+
+    collapsed = defaultdict(int)
+    for path, seconds in stacks.items():
+        microseconds = round(seconds * 1e6)
+        if microseconds > 0:
+            collapsed[";".join(_frame_label(func) for func in path)] += (
+                microseconds
+            )
+    return dict(collapsed)
+
+
+def _frame_label(func):
+    file_name, line, name = func
+    if file_name == "~":
+        return name.replace(";", ",")
+    return f"{name} ({os.path.basename(file_name)}:{line})".replace(";", ",")
@@ -0,0 +1,224 @@
+"""
+This module owns the pipeline's CPU thread budget.
+
+Tesseract (OpenMP), OpenCV's internal thread pool and the worker processes
+would each use every core on their own. A single ResourcePolicy decides how
+many workers run and how many threads each one may use, a CpuAllocator
+reserves disjoint CPUs for the tasks in flight so their threads never
+exceed the CPUs, and apply_thread_budget() enforces that decision inside a
+process through OMP_THREAD_LIMIT, cv2.setNumThreads and CPU affinity.
+"""
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+
+ThreadPlan = namedtuple("ThreadPlan", ["workers", "threads"])
+
+
+def available_cpus():
+    """
+    Returns the sorted list of CPUs this process may run on.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+class ResourcePolicy:
+    """
+    Splits the available CPUs between concurrently running pages.
+
+    With a deep queue, the policy runs many single-threaded workers, which
+    scales best because pages are independent. With a shallow queue of
+    large pages, it runs few workers and lets each use several threads so
+    cores do not sit idle. Small pages always run single-threaded, since
+    Tesseract's and OpenCV's threading only pays off on large images.
+    """
+
+    def __init__(self, cpus=None, max_workers=None,
+                 large_page_megapixels=8.0):
+        self.cpus = list(cpus) if cpus is not None else available_cpus()
+        self.max_workers = max_workers or len(self.cpus)
+        self.large_page_megapixels = large_page_megapixels
+
+    @classmethod
+    def from_config(cls, config, max_workers=None):
+        """
+        Creates a policy from the [Resources] section of a configuration.
+        """
+        cpus = available_cpus()
+        max_threads = config.getint("Resources", "MaxThreads", fallback=0)
+        if max_threads > 0:
+            cpus = cpus[:max_threads]
+        return cls(
+            cpus,
+            max_workers,
+            config.getfloat(
+                "Resources", "LargePageMegapixels", fallback=8.0
+            ),
+        )
+
+    def plan(self, queue_depth, megapixels=None):
+        """
+        Decides how many workers should run and how many threads each gets.
+
+        Args:
+            queue_depth: Number of items waiting or running.
+            megapixels: Size of the next page, if known.
+
+        Returns:
+            A ThreadPlan.
+        """
+        workers = max(1, min(queue_depth, self.max_workers, len(self.cpus)))
+        if (megapixels is not None
+                and megapixels < self.large_page_megapixels):
+            return ThreadPlan(workers, 1)
+        return ThreadPlan(workers, max(1, len(self.cpus) // workers))
+
+    def cpu_set(self, slot, threads):
+        """
+        Returns the CPUs reserved for a worker slot running with the given
+        number of threads.
+        """
+        start = (slot * threads) % len(self.cpus)
+        return {
+            self.cpus[(start + i) % len(self.cpus)]
+            for i in range(min(threads, len(self.cpus)))
+        }
+
+
+class CpuAllocator:
+    """
+    Reserves disjoint sets of CPUs for the tasks running at the same time.
+
+    A plan is made for the queue as it is when a task starts, so a task
+    planned later may ask for more threads than the tasks still running
+    left free. Taking its CPUs from an allocator caps it to those, so the
+    threads in flight never exceed the CPUs.
+    """
+
+    def __init__(self, cpus):
+        self._free = list(cpus)
+        self._released = threading.Condition()
+
+    def free(self):
+        """
+        Returns the number of CPUs not reserved by a running task.
+        """
+        with self._released:
+            return len(self._free)
+
+    def acquire(self, threads):
+        """
+        Reserves up to the given number of free CPUs, and at least one,
+        waiting for a task to release one if none is free.
+
+        Returns:
+            The list of reserved CPUs.
+        """
+        with self._released:
+            self._released.wait_for(lambda: self._free)
+            count = max(1, min(threads, len(self._free)))
+            cpus, self._free = self._free[:count], self._free[count:]
+            return cpus
+
+    def release(self, cpus):
+        """
+        Returns the CPUs of a finished task.
+        """
+        with self._released:
+            self._free = sorted(self._free + list(cpus))
+            self._released.notify_all()
+
+
+def apply_thread_budget(threads, cpu_set=None):
+    """
+    Limits this process (and the Tesseract processes it starts) to a number
+    of threads and, optionally, to a set of CPUs.
+    """
+    os.environ["OMP_THREAD_LIMIT"] = str(threads)
+    cv2.setNumThreads(threads)
+    if cpu_set and hasattr(os, "sched_setaffinity"):
+        try:
+            os.sched_setaffinity(0, cpu_set)
+        except OSError as e:
+            logging.warning("Could not set CPU affinity: %s", e)
+
+
+def thread_budget():
+    """
+    Returns the number of threads this process may use, as set by
+    apply_thread_budget(), or the number of available CPUs if it was not.
+    """
+    try:
+        return max(1, int(os.environ["OMP_THREAD_LIMIT"]))
+    except (KeyError, ValueError):
+        return len(available_cpus())
+
+
+def page_megapixels(path):
+    """
+    Returns the size of an image in megapixels without decoding it, or None
+    if it cannot be determined (e.g. for PDFs).
+    """
+    try:
+        from PIL import Image  # pylint: disable=import-outside-toplevel
+        with Image.open(path) as image:
+            width, height = image.size
+    except Exception:  # pylint: disable=broad-except
+        return None
+    return width * height / 1e6
+
+
+def process_cpu_seconds(children=True):
+    """
+    Returns the CPU time used by this process and, unless children is
+    False, its reaped children.
+    """
+    times = os.times()
+    seconds = times.user + times.system
+    if children:
+        seconds += times.children_user + times.children_system
+    return seconds
+
+
+class CpuUtilization:
+    """
+    Measures the CPU time used by this process and its reaped children
+    (e.g. Tesseract) against the wall-clock capacity of the CPUs available
+    to the pipeline. Pool workers are long-lived, so they measure their own
+    CPU time per task and it is added with add(). Once it is, the reaped
+    children are left out of this process's CPU time, since a worker's time
+    would otherwise be counted again when the pool is shut down.
+    """
+
+    def __init__(self, cpu_count):
+        self.cpu_count = cpu_count
+        self._start_wall = time.perf_counter()
+        self._start_cpu = process_cpu_seconds()
+        self._start_own_cpu = process_cpu_seconds(children=False)
+        self._added = None
+
+    def add(self, cpu_seconds):
+        """
+        Adds CPU time measured in another process.
+        """
+        self._added = (self._added or 0.0) + cpu_seconds
+
+    def report(self):
+        """
+        Returns (utilization, cpu_seconds, wall_seconds), where utilization
+        is the fraction of the available CPU capacity that was used.
+        """
+        wall = time.perf_counter() - self._start_wall
+        if self._added is None:
+            cpu = process_cpu_seconds() - self._start_cpu
+        else:
+            cpu = (process_cpu_seconds(children=False)
+                   - self._start_own_cpu + self._added)
+        utilization = cpu / (wall * self.cpu_count) if wall > 0 else 0.0
+        return utilization, cpu, wall
@@ -0,0 +1,185 @@
+"""
+This module moves page images between processes through shared memory.
+
+Pickling a page array through a pipe copies it twice and costs as much as
+the processing it feeds. A SlabPool instead allocates a fixed number of
+fixed-size shared memory slabs once; a page is written into a free slab and
+handed to another process as a small PageBuffer descriptor (slab name,
+shape and dtype), which the receiver maps as a NumPy array without copying.
+
+Slabs are reference counted across processes. The process that allocates
+a page holds one reference; every process that is handed the descriptor
+and will release it needs its own, taken with retain() before handing it
+over. Once the last reference is released the slab goes back to the pool,
+so a view of it must not be used after its release. Allocation blocks
+while every slab is in use, which bounds the memory used by pages in
+flight to slabs * slab_bytes.
+"""
+import contextlib
+import os
+from collections import namedtuple
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+PageBuffer = namedtuple("PageBuffer", ["name", "shape", "dtype"])
+
+
+class SlabPool:
+    """
+    A recycled pool of fixed-size shared memory slabs for page arrays.
+
+    The pool is created in the parent process and passed to workers when
+    they start (e.g. through a process pool's initializer), since its locks
+    cannot be sent to a running process.
+
+    Args:
+        slab_bytes: Size of every slab; larger pages are rejected.
+        slabs: Number of slabs.
+        context: The multiprocessing context of the worker processes.
+    """
+
+    def __init__(self, slab_bytes, slabs, context=None):
+        context = context or get_context()
+        self.slab_bytes = slab_bytes
+        segments = [
+            SharedMemory(create=True, size=slab_bytes) for _ in range(slabs)
+        ]
+        self.names = [segment.name for segment in segments]
+        self._index = {name: index for index, name in enumerate(self.names)}
+        self._refcounts = context.Array("i", slabs, lock=False)
+        self._lock = context.Lock()
+        self._free = context.Semaphore(slabs)
+        self._owner = os.getpid()
+        self._created = segments
+        self._segments = dict(zip(self.names, segments))
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # Receivers map the slabs by name on first use.
+        state["_segments"] = {}
+        state["_created"] = []
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def allocate(self, shape, dtype, timeout=None):
+        """
+        Takes a free slab for an array of the given shape and dtype. The
+        caller holds its only reference.
+
+        Raises:
+            ValueError: If the array does not fit in a slab.
+            TimeoutError: If no slab was released within timeout seconds.
+        """
+        dtype = np.dtype(dtype)
+        shape = tuple(int(size) for size in shape)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if nbytes > self.slab_bytes:
+            raise ValueError(
+                f"A {nbytes}-byte page does not fit in a "
+                f"{self.slab_bytes}-byte slab"
+            )
+        if not self._free.acquire(timeout=timeout):
+            raise TimeoutError("No free page slab")
+        with self._lock:
+            index = next(
+                index for index, count in enumerate(self._refcounts)
+                if count == 0
+            )
+            self._refcounts[index] = 1
+        return PageBuffer(self.names[index], shape, dtype.str)
+
+    def put(self, array, timeout=None):
+        """
+        Copies an array into a free slab.
+
+        Returns:
+            The PageBuffer describing it; the caller holds its only
+            reference.
+        """
+        buffer = self.allocate(array.shape, array.dtype, timeout)
+        np.copyto(self.view(buffer), array)
+        return buffer
+
+    def view(self, buffer):
+        """
+        Returns a NumPy array backed by the slab of a PageBuffer, without
+        copying it.
+        """
+        segment = self._segments.get(buffer.name)
+        if segment is None:
+            if buffer.name not in self._index:
+                raise ValueError(f"Not a slab of this pool: {buffer.name}")
+            segment = SharedMemory(name=buffer.name)
+            self._segments[buffer.name] = segment
+        return np.ndarray(
+            buffer.shape, dtype=np.dtype(buffer.dtype), buffer=segment.buf
+        )
+
+    def retain(self, buffer):
+        """
+        Takes another reference to a page, for a process it is handed to.
+        """
+        index = self._index[buffer.name]
+        with self._lock:
+            if self._refcounts[index] <= 0:
+                raise ValueError(f"Page slab is not in use: {buffer.name}")
+            self._refcounts[index] += 1
+
+    def release(self, buffer):
+        """
+        Drops a reference to a page; the last one returns its slab to the
+        pool.
+        """
+        index = self._index[buffer.name]
+        with self._lock:
+            if self._refcounts[index] <= 0:
+                raise ValueError(f"Page slab is not in use: {buffer.name}")
+            self._refcounts[index] -= 1
+            freed = self._refcounts[index] == 0
+        if freed:
+            self._free.release()
+
+    @contextlib.contextmanager
+    def page(self, buffer):
+        """
+        Context manager yielding the array of a page and releasing this
+        process's reference on exit.
+        """
+        try:
+            yield self.view(buffer)
+        finally:
+            self.release(buffer)
+
+    def in_use(self):
+        """
+        Returns the number of slabs holding a page.
+        """
+        with self._lock:
+            return sum(1 for count in self._refcounts if count > 0)
+
+    def close(self):
+        """
+        Unmaps the slabs in this process; in the process that created the
+        pool, also frees them.
+        """
+        for segment in self._segments.values():
+            try:
+                segment.close()
+            except BufferError:
+                # A view is still alive; the mapping goes with the process.
+                pass
+        if os.getpid() == self._owner:
+            for segment in self._created:
+                try:
+                    segment.unlink()
+                except FileNotFoundError:
+                    pass
+            self._created = []
+        self._segments = {}
@@ -0,0 +1,392 @@
+"""
+This module contains the watch-folder service mode, which processes new
+scans as soon as they have been completely written to the input directory.
+"""
+import configparser
+import ctypes
+import ctypes.util
+import json
+import logging
+import os
+import select
+import struct
+import time
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+from src.dedup import reuse_ratio
+from src.utils.metrics import get_metrics
+from src.utils.resources import (
+    CpuAllocator, CpuUtilization, ResourcePolicy, page_megapixels
+)
+from src.workers import create_worker_pool, run_task
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_NONBLOCK = 0x00000800
+IN_CLOEXEC = 0x00080000
+_EVENT_HEADER = struct.Struct("iIII")
+
+LEDGER_FILE = "watch_processed.tsv"
+STATUS_FILE = "watch_status.json"
+
+
+class _PollingSource:
+    """
+    Reports files in a directory whose size or modification time changed
+    since the previous scan.
+    """
+
+    name = "polling"
+
+    def __init__(self, directory, interval):
+        self.directory = directory
+        self.interval = interval
+        self._seen = {}
+
+    def poll(self, timeout):
+        """
+        Waits up to timeout seconds and returns the changed file names.
+        """
+        time.sleep(min(timeout, self.interval))
+        changed = []
+        current = {}
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                current[entry.name] = (stat.st_size, stat.st_mtime_ns)
+                if self._seen.get(entry.name) != current[entry.name]:
+                    changed.append(entry.name)
+        self._seen = current
+        return changed
+
+    def close(self):
+        """
+        Releases the resources held by the source.
+        """
+
+
+class _InotifySource:
+    """
+    Reports files that were closed after writing or moved into a directory,
+    using the Linux inotify API.
+    """
+
+    name = "inotify"
+
+    def __init__(self, directory):
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("libc not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+        self._fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        wd = libc.inotify_add_watch(
+            self._fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO
+        )
+        if wd < 0:
+            os.close(self._fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+    def poll(self, timeout):
+        """
+        Waits up to timeout seconds and returns the changed file names.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changed = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            _, _, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if name:
+                changed.append(os.fsdecode(name))
+        return changed
+
+    def close(self):
+        """
+        Releases the resources held by the source.
+        """
+        os.close(self._fd)
+
+
+def _open_source(directory, interval, use_inotify):
+    if use_inotify:
+        try:
+            return _InotifySource(directory)
+        except (OSError, AttributeError) as e:
+            logging.warning(
+                "inotify unavailable (%s); falling back to polling", e
+            )
+    return _PollingSource(directory, interval)
+
+
+class _StabilityTracker:
+    """
+    Decides when a file has been completely written: its size and
+    modification time must stay unchanged for settle_seconds.
+    """
+
+    def __init__(self, settle_seconds):
+        self.settle_seconds = settle_seconds
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, path):
+        """
+        Starts (or restarts) tracking a file.
+        """
+        self._pending[path] = None
+
+    def ready(self, now):
+        """
+        Returns the tracked files that have settled, with their (size,
+        mtime) signature, and stops tracking them.
+        """
+        ready = []
+        for path, previous in list(self._pending.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._pending[path]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if previous is None or previous[0] != signature:
+                self._pending[path] = (signature, now)
+            elif now - previous[1] >= self.settle_seconds:
+                del self._pending[path]
+                ready.append((path, signature))
+        return ready
+
+
+class _Ledger:
+    """
+    Remembers which files (by name, size and mtime) were already processed,
+    so a restarted service does not reprocess the whole directory.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = set()
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    parts = line.rstrip("\n").split("\t")
+                    if len(parts) == 3:
+                        self._entries.add(
+                            (parts[0], int(parts[1]), int(parts[2]))
+                        )
+
+    def __contains__(self, entry):
+        return entry in self._entries
+
+    def add(self, entry):
+        """
+        Records a processed file.
+        """
+        self._entries.add(entry)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write("\t".join(str(part) for part in entry) + "\n")
+
+
+def watch_directory(
+    input_dir,
+    output_dir,
+    config_path,
+    handler,
+    is_supported,
+    settings,
+    stop_event=None,
+):
+    """
+    Watches input_dir and hands every new, completely written file to a pool
+    of warm workers until stop_event is set.
+
+    Args:
+        input_dir: Directory receiving new scans.
+        output_dir: Root directory for the processed output.
+        config_path: Path to the configuration file loaded by the workers.
+        handler: Picklable callable run as handler(file_path, output_dir,
+                 config) for every new file.
+        is_supported: Callable deciding whether a file name is processed.
+        settings: Dictionary with "workers", "poll_interval",
+                  "settle_seconds" and "use_inotify". With zero workers,
+                  files are processed in the watching process.
+        stop_event: Optional threading.Event that ends the loop.
+    """
+    logs_dir = os.path.join(output_dir, "logs")
+    os.makedirs(logs_dir, exist_ok=True)
+    ledger = _Ledger(os.path.join(logs_dir, LEDGER_FILE))
+    tracker = _StabilityTracker(settings["settle_seconds"])
+    source = _open_source(
+        input_dir, settings["poll_interval"], settings["use_inotify"]
+    )
+    metrics = get_metrics()
+    workers = settings["workers"]
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    policy = ResourcePolicy.from_config(config, max(workers, 1))
+    pool = (
+        create_worker_pool(config_path, workers, policy)
+        if workers > 0 else None
+    )
+    utilization = CpuUtilization(len(policy.cpus))
+    allocator = CpuAllocator(policy.cpus)
+    queued = deque()
+    in_flight = {}
+    healthy = True
+    started = time.time()
+    last_status = 0.0
+    logging.info(
+        "Watching %s using %s with %d worker(s)",
+        input_dir, source.name, workers
+    )
+
+    # Files already present when the service starts are candidates too.
+    for file_name in sorted(os.listdir(input_dir)):
+        if is_supported(file_name):
+            tracker.add(os.path.join(input_dir, file_name))
+
+    try:
+        while stop_event is None or not stop_event.is_set():
+            for file_name in source.poll(settings["poll_interval"]):
+                if is_supported(file_name):
+                    metrics.increment("watch.discovered")
+                    tracker.add(os.path.join(input_dir, file_name))
+
+            for path, signature in tracker.ready(time.monotonic()):
+                entry = (os.path.basename(path),) + signature
+                if entry in ledger:
+                    continue
+                logging.info("New file ready: %s", path)
+                if pool is None:
+                    _record_result(
+                        metrics, ledger, entry,
+                        _run_inline(handler, path, output_dir, config)
+                    )
+                    continue
+                queued.append((path, entry))
+
+            # Files are planned when a worker and a CPU are free, from the
+            # files actually in flight.
+            while (healthy and queued and len(in_flight) < workers
+                   and allocator.free()):
+                path, entry = queued.popleft()
+                plan = policy.plan(
+                    len(in_flight) + len(queued) + 1, page_megapixels(path)
+                )
+                cpus = allocator.acquire(plan.threads)
+                try:
+                    future = pool.submit(
+                        run_task, handler, path, output_dir, cpus=cpus
+                    )
+                except BrokenProcessPool as e:
+                    # A worker died while idle, or since the last pass.
+                    logging.error(
+                        "Worker pool failed before %s: %s", entry[0], e
+                    )
+                    allocator.release(cpus)
+                    healthy = False
+                    # Retried once the pool has been restarted.
+                    queued.appendleft((path, entry))
+                    break
+                in_flight[future] = (entry, cpus)
+
+            for future in [f for f in in_flight if f.done()]:
+                entry, cpus = in_flight.pop(future)
+                allocator.release(cpus)
+                try:
+                    outcome = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died (e.g. killed by the OOM killer); the
+                    # file is left out of the ledger and retried once the
+                    # pool has been restarted.
+                    logging.error("Worker pool failed on %s: %s", entry[0], e)
+                    healthy = False
+                    tracker.add(os.path.join(input_dir, entry[0]))
+                    continue
+                utilization.add(outcome["cpu_seconds"])
+                _record_result(metrics, ledger, entry, outcome)
+
+            if not healthy and not in_flight:
+                logging.warning("Restarting the worker pool")
+                pool.shutdown(wait=False)
+                pool = create_worker_pool(config_path, workers, policy)
+                healthy = True
+
+            now = time.time()
+            if now - last_status >= 1.0:
+                metrics.set("watch.cpu_utilization", utilization.report()[0])
+                snapshot = metrics.snapshot()
+                _write_status(logs_dir, {
+                    "source": source.name,
+                    "started": started,
+                    "uptime": now - started,
+                    "workers": workers,
+                    "pending": len(tracker) + len(queued),
+                    "in_flight": len(in_flight),
+                    "healthy": healthy,
+                    "ocr_reuse_ratio": reuse_ratio(snapshot["counters"]),
+                    **snapshot,
+                })
+                last_status = now
+    finally:
+        source.close()
+        if pool is not None:
+            pool.shutdown(wait=True)
+        logging.info("Stopped watching %s", input_dir)
+
+
+def _run_inline(handler, path, output_dir, config):
+    start = time.perf_counter()
+    try:
+        return {
+            "result": handler(path, output_dir, config),
+            "error": None,
+            "seconds": time.perf_counter() - start,
+            "metrics": {},
+        }
+    except Exception as e:  # pylint: disable=broad-except
+        return {
+            "result": False,
+            "error": str(e),
+            "seconds": time.perf_counter() - start,
+            "metrics": {},
+        }
+
+
+def _record_result(metrics, ledger, entry, outcome):
+    metrics.merge(outcome["metrics"])
+    metrics.observe("watch.latency", outcome["seconds"])
+    if outcome["result"]:
+        metrics.increment("watch.completed")
+        metrics.set("watch.last_completed_at", time.time())
+    else:
+        metrics.increment("watch.failed")
+        logging.error(
+            "Error processing file %s: %s",
+            entry[0], outcome["error"] or "one or more pages failed"
+        )
+    ledger.add(entry)
+
+
+def _write_status(logs_dir, status):
+    status_path = os.path.join(logs_dir, STATUS_FILE)
+    temp_path = status_path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(status, f, indent=4)
+    os.replace(temp_path, status_path)
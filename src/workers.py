@@ -0,0 +1,161 @@
+"""
+This module manages the pool of pre-warmed worker processes used by the
+long-running pipeline modes.
+"""
+import configparser
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from src.utils.logging_config import (
+    configure_worker_logging, logging_settings
+)
+from src.utils.metrics import get_metrics
+from src.utils.profiling import (
+    configure_profiling, flush_profiles, profiling_settings
+)
+from src.utils.resources import (
+    ResourcePolicy, apply_thread_budget, process_cpu_seconds
+)
+
+_WORKER_CONFIG = None
+_WORKER_POLICY = None
+_WORKER_SLOT = 0
+_WORKER_PAGES = None
+
+
+def create_worker_pool(config_path, workers, policy=None, pages=None):
+    """
+    Starts a process pool whose workers load the configuration and warm up
+    the OCR and normalization dependencies once, at start-up. Workers
+    inherit the current profiling settings and log through this process's
+    log writer.
+
+    Args:
+        config_path: Path to the configuration file each worker loads.
+        workers: Number of worker processes.
+        policy: ResourcePolicy deciding each worker's threads and CPUs.
+                Defaults to one built from the configuration.
+        pages: SlabPool through which page arrays are handed to and from
+               the workers; tasks reach it with worker_page_pool().
+
+    Returns:
+        A ProcessPoolExecutor.
+    """
+    if policy is None:
+        config = configparser.ConfigParser()
+        config.read(config_path)
+        policy = ResourcePolicy.from_config(config, workers)
+    slot_counter = multiprocessing.Value("i", 0)
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=_init_worker,
+        initargs=(
+            config_path, profiling_settings(), logging_settings(), policy,
+            slot_counter, pages,
+        ),
+    )
+
+
+def load_worker_config(config_path):
+    """
+    Loads the configuration used by tasks running in this process.
+    """
+    global _WORKER_CONFIG  # pylint: disable=global-statement
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    _WORKER_CONFIG = config
+    return config
+
+
+def worker_page_pool():
+    """
+    Returns the SlabPool the workers of this process's pool were started
+    with, or None.
+    """
+    return _WORKER_PAGES
+
+
+def warm_up():
+    """
+    Imports the pipeline stages and loads their data files so the first
+    page a worker receives does not pay for it.
+    """
+    start = time.perf_counter()
+    # pylint: disable=import-outside-toplevel,unused-import
+    import src.preprocess
+    import src.generate_html
+    import src.normalize_rag
+    import src.ocr
+    try:
+        from nltk.corpus import stopwords
+        stopwords.words('english')
+    except LookupError as e:
+        logging.warning("NLTK data could not be preloaded: %s", e)
+    try:
+        import pytesseract
+        pytesseract.get_tesseract_version()
+    except Exception as e:  # pylint: disable=broad-except
+        logging.warning("Tesseract could not be preloaded: %s", e)
+    logging.debug(
+        "Worker warmed up in %.2fs", time.perf_counter() - start
+    )
+
+
+def run_task(handler, *args, cpus=None):
+    """
+    Runs handler(*args, config) in a worker and reports its outcome.
+
+    Args:
+        handler: The callable to run.
+        args: Positional arguments passed before the configuration.
+        cpus: The CPUs the parent's CpuAllocator reserved for this task;
+              it runs one thread on each. Defaults to one thread on the
+              worker's own CPU.
+
+    Returns:
+        A dictionary with the handler's result, its duration, the CPU time
+        it used and the metrics recorded while it ran.
+    """
+    if cpus:
+        apply_thread_budget(len(cpus), set(cpus))
+    else:
+        apply_thread_budget(1, _WORKER_POLICY.cpu_set(_WORKER_SLOT, 1))
+    metrics = get_metrics()
+    metrics.snapshot(reset=True)
+    start = time.perf_counter()
+    start_cpu = process_cpu_seconds()
+    try:
+        result = handler(*args, _WORKER_CONFIG)
+        error = None
+    except Exception as e:  # pylint: disable=broad-except
+        result = False
+        error = str(e)
+    flush_profiles()
+    return {
+        "result": result,
+        "error": error,
+        "seconds": time.perf_counter() - start,
+        "cpu_seconds": process_cpu_seconds() - start_cpu,
+        "metrics": metrics.snapshot(reset=True),
+    }
+
+
+def _init_worker(config_path, profiling, log_settings, policy, slot_counter,
+                 pages):
+    # pylint: disable-next=global-statement
+    global _WORKER_POLICY, _WORKER_SLOT, _WORKER_PAGES
+    configure_worker_logging(log_settings)
+    with slot_counter.get_lock():
+        _WORKER_SLOT = slot_counter.value
+        slot_counter.value += 1
+    _WORKER_POLICY = policy
+    _WORKER_PAGES = pages
+    apply_thread_budget(1, policy.cpu_set(_WORKER_SLOT, 1))
+    load_worker_config(config_path)
+    if profiling is not None:
+        configure_profiling(
+            profiling["profile_dir"], profiling["sample_every"], reset=False
+        )
+    warm_up()
@@ -0,0 +1,17 @@
+"""
+Helpers shared by the test modules.
+"""
+import functools
+
+
+@functools.lru_cache(maxsize=None)
+def nltk_data_available():
+    """Returns True if the NLTK data the RAG stage needs is installed."""
+    try:
+        from nltk.corpus import stopwords
+        from nltk.tokenize import word_tokenize
+        stopwords.words('english')
+        word_tokenize('a test')
+        return True
+    except LookupError:
+        return False
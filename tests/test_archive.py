@@ -0,0 +1,107 @@
+import os
+import shutil
+import threading
+import unittest
+import urllib.request
+from http.server import ThreadingHTTPServer
+from src.archive import PageArchive, ArchiveRequestHandler, STYLESHEET
+
+
+class TestPageArchive(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = 'test_output'
+        self.archive_path = os.path.join(self.output_dir, 'doc.zip')
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _write(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def _stage_page(self, archive, page_name):
+        page_dir = archive.page_staging_dir(page_name)
+        self._write(os.path.join(page_dir, 'preprocessed', page_name + '.png'),
+                    b'png ' + page_name.encode())
+        self._write(os.path.join(page_dir, 'ocr', page_name + '.xml'),
+                    b'<alto/>')
+        self._write(os.path.join(page_dir, 'rag', page_name + '.json'), b'[]')
+        self._write(os.path.join(page_dir, 'html', page_name + '.html'),
+                    b'<html>' + page_name.encode() + b'</html>')
+        self._write(os.path.join(page_dir, 'html', 'images',
+                                 'illustration_0.png'), b'img')
+        self._write(os.path.join(page_dir, 'html', STYLESHEET), b'body {}')
+        return page_dir
+
+    def test_pack_and_read_pages(self):
+        """Test that pages are packed with one shared stylesheet."""
+        with PageArchive(self.archive_path, 'w') as archive:
+            for page_name in ('page_001', 'page_002'):
+                page_dir = self._stage_page(archive, page_name)
+                archive.add_page(page_name, page_dir)
+                self.assertFalse(os.path.exists(page_dir))
+            staging_dir = archive.staging_dir
+
+        self.assertFalse(os.path.exists(staging_dir))
+        self.assertEqual(os.listdir(self.output_dir), ['doc.zip'])
+
+        with PageArchive(self.archive_path) as archive:
+            index = archive.read_index()
+            self.assertEqual(sorted(index), ['page_001', 'page_002'])
+            self.assertEqual(
+                sorted(index['page_001']),
+                ['html', 'ocr', 'preprocessed', 'rag']
+            )
+            self.assertEqual(
+                archive.read('page_002', 'preprocessed'), b'png page_002'
+            )
+            self.assertEqual(
+                archive.read('page_001', 'html', 'images/illustration_0.png'),
+                b'img'
+            )
+            self.assertEqual(
+                archive.read_member('page_001/html/style.css'), b'body {}'
+            )
+            with self.assertRaises(KeyError):
+                archive.read('page_003', 'ocr')
+
+    def test_failed_archive_is_discarded(self):
+        """Test that an archive is not published when writing fails."""
+        with self.assertRaises(RuntimeError):
+            with PageArchive(self.archive_path, 'w'):
+                raise RuntimeError("Test error")
+        self.assertEqual(os.listdir(self.output_dir), [])
+
+    def test_serve_archive(self):
+        """Test that the viewer serves pages and the shared stylesheet."""
+        with PageArchive(self.archive_path, 'w') as archive:
+            archive.add_page('page_001', self._stage_page(archive, 'page_001'))
+
+        with PageArchive(self.archive_path) as archive:
+            handler = type('Handler', (ArchiveRequestHandler,),
+                           {'archive': archive, 'log_message': print})
+            server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+            thread = threading.Thread(target=server.serve_forever)
+            thread.start()
+            try:
+                base = f'http://127.0.0.1:{server.server_address[1]}/'
+                with urllib.request.urlopen(base) as response:
+                    self.assertIn(b'page_001/html/page_001.html',
+                                  response.read())
+                with urllib.request.urlopen(
+                        base + 'page_001/html/page_001.html') as response:
+                    self.assertEqual(response.read(), b'<html>page_001</html>')
+                with urllib.request.urlopen(
+                        base + 'page_001/html/style.css') as response:
+                    self.assertEqual(response.read(), b'body {}')
+            finally:
+                server.shutdown()
+                server.server_close()
+                thread.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
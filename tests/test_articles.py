@@ -0,0 +1,119 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from src.articles import Block, GridIndex, segment_articles
+from conftest import nltk_data_available
+from src.normalize_rag import _blocks_from_alto, generate_rag_json
+
+
+def body(block_id, x, y, height=200, width=280):
+    return Block(block_id, x, y, width, height, 20, height // 24)
+
+
+def headline(block_id, x, y, width):
+    return Block(block_id, x, y, width, 50, 44, 1)
+
+
+class TestArticles(unittest.TestCase):
+
+    def test_grid_index(self):
+        """Test that the grid finds the items in the cells a box overlaps."""
+        grid = GridIndex(100)
+        grid.insert('a', (0, 0, 50, 50))
+        grid.insert('b', (250, 250, 300, 40))
+        self.assertEqual(grid.query((10, 10, 10, 10)), {'a'})
+        self.assertEqual(grid.query((420, 260, 10, 10)), {'b'})
+        self.assertEqual(grid.query((0, 120, 90, 50)), set())
+
+    def test_headline_spanning_columns(self):
+        """Test that a headline collects the columns under it and stops at the next headline."""
+        blocks = [
+            headline('h1', 0, 0, 580),
+            body('a1', 0, 70), body('a2', 0, 290),
+            body('b1', 300, 70), body('b2', 300, 290),
+            headline('h2', 600, 0, 280),
+            body('c1', 600, 70),
+            headline('h3', 0, 520, 580),
+            body('d1', 0, 590),
+            body('orphan', 1200, 1200),
+        ]
+        articles = segment_articles(blocks)
+        groups = [[blocks[index].id for index in article.blocks] for article in articles]
+        self.assertEqual(groups, [
+            ['h1', 'a1', 'a2', 'b1', 'b2'],
+            ['h2', 'c1'],
+            ['h3', 'd1'],
+            ['orphan'],
+        ])
+        self.assertEqual(blocks[articles[0].headline].id, 'h1')
+        self.assertIsNone(articles[3].headline)
+
+    def test_column_continuation_without_headline(self):
+        """Test that stacked body blocks in one column form one article."""
+        blocks = [body('a', 0, 0), body('b', 0, 210), body('c', 0, 1000), body('d', 400, 0)]
+        groups = [article.blocks for article in segment_articles(blocks)]
+        self.assertEqual(groups, [[0, 1], [2], [3]])
+
+    def test_blocks_without_boxes(self):
+        """Test that blocks without coordinates stay on their own."""
+        blocks = [Block('x', -1, -1, -1, -1, 0, 1), Block('y', -1, -1, -1, -1, 0, 1)]
+        self.assertEqual([article.blocks for article in segment_articles(blocks)], [[0], [1]])
+
+    def test_near_linear_time(self):
+        """Test that a page with thousands of blocks is segmented quickly."""
+        blocks = [body(f'b{n}', (n % 40) * 300, (n // 40) * 210) for n in range(8000)]
+        start = time.perf_counter()
+        articles = segment_articles(blocks)
+        self.assertLess(time.perf_counter() - start, 5.0)
+        # Every column is one article.
+        self.assertEqual(len(articles), 40)
+
+    def test_layout_only_for_articles(self):
+        """Test that block layouts are only read, and coordinates only parsed, for articles."""
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        alto_path = os.path.join(work_dir, 'page.xml')
+        with open(alto_path, 'w') as f:
+            f.write("""<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#"><Layout><Page><PrintSpace>
+<TextBlock ID="a" HPOS="n/a" VPOS="10" WIDTH="280" HEIGHT="40">
+  <TextLine HEIGHT="x"><String CONTENT="Word"/></TextLine></TextBlock>
+</PrintSpace></Page></Layout></alto>""")
+
+        blocks = _blocks_from_alto(alto_path)
+        self.assertEqual(blocks[0][1]['x'], 'n/a')
+        self.assertIsNone(blocks[0][2])
+        layout = _blocks_from_alto(alto_path, with_layout=True)[0][2]
+        self.assertEqual(layout.x, -1)
+
+    @unittest.skipUnless(nltk_data_available(), 'NLTK data is not installed')
+    def test_generate_rag_json_articles(self):
+        """Test that RAG records are articles listing their block IDs."""
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        alto_path = os.path.join(work_dir, 'page.xml')
+        json_path = os.path.join(work_dir, 'page.json')
+        with open(alto_path, 'w') as f:
+            f.write("""<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#"><Layout><Page><PrintSpace>
+<TextBlock ID="h" HPOS="0" VPOS="0" WIDTH="580" HEIGHT="50">
+  <TextLine HEIGHT="44"><String CONTENT="Harbour"/><String CONTENT="Opens"/></TextLine></TextBlock>
+<TextBlock ID="a" HPOS="0" VPOS="70" WIDTH="280" HEIGHT="40">
+  <TextLine HEIGHT="20"><String CONTENT="The"/><String CONTENT="new"/><String CONTENT="har-"/></TextLine></TextBlock>
+<TextBlock ID="b" HPOS="300" VPOS="70" WIDTH="280" HEIGHT="40">
+  <TextLine HEIGHT="20"><String CONTENT="bour"/><String CONTENT="opened"/></TextLine></TextBlock>
+</PrintSpace></Page></Layout></alto>""")
+
+        self.assertTrue(generate_rag_json(alto_path, json_path, {'articles': True}))
+        with open(json_path) as f:
+            records = json.load(f)
+        self.assertEqual(len(records), 1)
+        self.assertEqual(records[0]['metadata']['block_ids'], ['h', 'a', 'b'])
+        self.assertEqual(records[0]['metadata']['headline'], 'Harbour Opens')
+        self.assertEqual(records[0]['metadata']['width'], '580')
+        self.assertIn('harbour opened', records[0]['text'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import shutil
+import unittest
+from unittest.mock import patch
+import cv2
+import numpy as np
+from lxml import etree
+from main import main
+from src.dedup import PageHashIndex, hamming_distances, page_hash, scale_alto
+
+ALTO_PATH = os.path.join(os.path.dirname(__file__), 'alto.xml')
+NS = {'alto': 'http://www.loc.gov/standards/alto/ns-v4#'}
+
+
+def make_page(seed, width=800, height=1000):
+    """Draws a page of random 'text lines' as black boxes on white."""
+    rng = np.random.default_rng(seed)
+    page = np.full((height, width), 255, dtype=np.uint8)
+    for y in range(40, height - 40, 30):
+        x = 40
+        while x < width - 80:
+            word = int(rng.integers(20, 80))
+            cv2.rectangle(page, (x, y), (x + word, y + 15), 0, -1)
+            x += word + int(rng.integers(10, 40))
+    return page
+
+
+class TestPageHash(unittest.TestCase):
+
+    def test_rescan_is_near_duplicate(self):
+        """Test that a rescan at another resolution hashes almost the same."""
+        page = make_page(1)
+        rescan = cv2.resize(page, (1200, 1500), interpolation=cv2.INTER_LINEAR)
+        distance = hamming_distances(page_hash(page), page_hash(rescan))
+        self.assertLessEqual(distance, 10)
+
+    def test_different_pages_are_far_apart(self):
+        """Test that different pages are not within the tolerance."""
+        distance = hamming_distances(page_hash(make_page(1)), page_hash(make_page(2)))
+        self.assertGreater(distance, 40)
+
+    def test_scale_alto(self):
+        """Test that every coordinate of the layout is rescaled."""
+        with open(ALTO_PATH, 'rb') as f:
+            alto = f.read()
+        root = etree.fromstring(scale_alto(alto, 1.5, 2.0, 'rescan.png'))
+        page = root.find('.//alto:Page', NS)
+        self.assertEqual((page.get('WIDTH'), page.get('HEIGHT')), ('1200', '2000'))
+        string = root.find('.//alto:String[@ID="S2"]', NS)
+        self.assertEqual(string.get('HPOS'), str(round(155 * 1.5)))
+        self.assertEqual(string.get('VPOS'), '100')
+        self.assertEqual(root.find('.//alto:fileName', NS).text, 'rescan.png')
+
+
+class TestPageHashIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index_dir = 'test_dedup_index'
+
+    def tearDown(self):
+        shutil.rmtree(self.index_dir)
+
+    def test_find_and_reuse(self):
+        """Test that a rescan finds the indexed page and gets aligned ALTO."""
+        index = PageHashIndex(self.index_dir)
+        self.assertIsNone(index.find(page_hash(make_page(1)), 800, 1000))
+        self.assertEqual(index.add(page_hash(make_page(1)), 800, 1000, ALTO_PATH), 0)
+        index.add(page_hash(make_page(2)), 800, 1000, ALTO_PATH)
+
+        # A second handle sees the records appended through the first one.
+        other = PageHashIndex(self.index_dir)
+        self.assertEqual(len(other), 2)
+        rescan = cv2.resize(make_page(1), (1600, 2000))
+        record_id, _ = other.find(page_hash(rescan), 1600, 2000)
+        self.assertEqual(record_id, 0)
+
+        reused_path = os.path.join(self.index_dir, 'reused.xml')
+        other.reuse(record_id, 1600, 2000, reused_path)
+        page = etree.parse(reused_path).find('.//alto:Page', NS)
+        self.assertEqual(page.get('WIDTH'), '1600')
+
+    def test_aspect_ratio_mismatch(self):
+        """Test that pages with other proportions are never reused."""
+        index = PageHashIndex(self.index_dir)
+        index.add(page_hash(make_page(1)), 800, 1000, ALTO_PATH)
+        self.assertIsNone(index.find(page_hash(make_page(1)), 800, 1200))
+
+
+class TestPipelineDedup(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = 'test_input'
+        self.output_dir = 'test_output'
+        self.config_path = 'test_config.ini'
+        os.makedirs(self.input_dir, exist_ok=True)
+        cv2.imwrite(os.path.join(self.input_dir, 'a_paper.png'), make_page(1))
+        cv2.imwrite(os.path.join(self.input_dir, 'b_microfilm.png'),
+                    cv2.resize(make_page(1), (1200, 1500)))
+        with open(self.config_path, 'w') as f:
+            f.write('[OCR]\nPSM = 3\n[Dedup]\nEnabled = true\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+        shutil.rmtree(self.output_dir)
+        os.remove(self.config_path)
+
+    @patch('src.normalize_rag.generate_rag_json', return_value=True)
+    @patch('src.ocr.run_ocr')
+    def test_pipeline_reuses_ocr(self, mock_run_ocr, mock_generate_rag_json):
+        """Test that the second copy of a page is not OCR'd again."""
+        def fake_ocr(image_path, output_dir, psm, **kwargs):
+            # ALTO matching the size of the page, as Tesseract would write.
+            height, width = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE).shape
+            base_name = os.path.splitext(os.path.basename(image_path))[0]
+            alto_path = os.path.join(output_dir, f'{base_name}.xml')
+            with open(ALTO_PATH, 'rb') as f:
+                alto = scale_alto(f.read(), width / 800, height / 1000)
+            with open(alto_path, 'wb') as f:
+                f.write(alto)
+            return alto_path
+        mock_run_ocr.side_effect = fake_ocr
+
+        main(self.input_dir, self.output_dir, self.config_path)
+
+        mock_run_ocr.assert_called_once()
+        for name, width in (('a_paper', '800'), ('b_microfilm', '1200')):
+            alto = etree.parse(os.path.join(self.output_dir, name, 'ocr', f'{name}.xml'))
+            self.assertEqual(alto.find('.//alto:Page', NS).get('WIDTH'), width)
+            self.assertTrue(os.path.exists(os.path.join(
+                self.output_dir, name, 'html', f'{name}.html')))
+
+
+if __name__ == '__main__':
+    unittest.main()
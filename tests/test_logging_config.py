@@ -0,0 +1,92 @@
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from src.utils.logging_config import (
+    RateLimitFilter, configure_worker_logging, log_context, logging_settings, setup_logging,
+    shutdown_logging
+)
+
+
+def log_from_worker(settings):
+    configure_worker_logging(settings)
+    with log_context(page='page_007'):
+        logging.warning("Logged by a worker")
+
+
+class TestLoggingConfig(unittest.TestCase):
+
+    def setUp(self):
+        self.log_dir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.log_dir, 'pipeline.log')
+
+    def tearDown(self):
+        shutdown_logging()
+        shutil.rmtree(self.log_dir)
+
+    def read_log(self):
+        # Stopping the writer flushes the queue.
+        shutdown_logging()
+        with open(self.log_file, encoding='utf-8') as f:
+            return f.read().splitlines()
+
+    def test_setup_is_idempotent(self):
+        """Test that repeated setup does not duplicate log lines."""
+        setup_logging(self.log_dir)
+        setup_logging(self.log_dir)
+        logging.info("Logged once")
+        lines = [line for line in self.read_log() if 'Logged once' in line]
+        self.assertEqual(len(lines), 1)
+
+    def test_json_lines_with_context(self):
+        """Test that JSON lines carry the document, page and stage fields."""
+        setup_logging(self.log_dir, json_lines=True)
+        with log_context(document='issue.pdf', page='page_001'):
+            with log_context(stage='ocr'):
+                logging.info("Recognized %d words", 42)
+        entries = [json.loads(line) for line in self.read_log()]
+        entry = entries[-1]
+        self.assertEqual(entry['message'], 'Recognized 42 words')
+        self.assertEqual((entry['document'], entry['page'], entry['stage']),
+                         ('issue.pdf', 'page_001', 'ocr'))
+        self.assertNotIn('page', entries[0])
+
+    def test_worker_records_reach_the_writer(self):
+        """Test that a worker process logs through the parent's log file."""
+        setup_logging(self.log_dir, json_lines=True)
+        worker = multiprocessing.Process(
+            target=log_from_worker, args=(logging_settings(),))
+        worker.start()
+        worker.join()
+        entry = json.loads(self.read_log()[-1])
+        self.assertEqual(entry['message'], 'Logged by a worker')
+        self.assertEqual(entry['page'], 'page_007')
+        self.assertEqual(entry['process'], worker.pid)
+
+    def test_rate_limit(self):
+        """Test that a repeated warning is dropped and counted, but distinct ones are kept."""
+        record_filter = RateLimitFilter(limit=2, window=60.0)
+
+        def record(created, level=logging.WARNING, name='x'):
+            record = logging.LogRecord('root', level, 'main.py', 10, 'Page %s failed', (name,), None)
+            record.created = created
+            return record
+
+        self.assertEqual([record_filter.filter(record(t)) for t in (0, 1, 2, 3)],
+                         [True, True, False, False])
+        self.assertTrue(record_filter.filter(record(1, logging.INFO)))
+        late = record(61)
+        self.assertTrue(record_filter.filter(late))
+        self.assertEqual(late.getMessage(), 'Page x failed (2 repeated message(s) suppressed)')
+
+        # Each file's failure is logged from the same line, but is a new message.
+        self.assertTrue(all(
+            record_filter.filter(record(62, logging.ERROR, f'page_{n:03}.png'))
+            for n in range(15)
+        ))
+
+if __name__ == '__main__':
+    unittest.main()
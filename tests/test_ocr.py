@@ -1,7 +1,10 @@
 import unittest
 from unittest.mock import patch, MagicMock
 import os
-from src.ocr import run_ocr
+import subprocess
+from lxml import etree
+from src.ocr import run_ocr, run_ocr_batch
+from src.ocr_backends import split_alto_pages
 import pytesseract
 from PIL import Image
 
@@ -56,5 +59,67 @@ class TestRunOCR(unittest.TestCase):
             run_ocr(self.image_path, self.output_dir, 3)
 
 
+MULTI_PAGE_ALTO = b"""<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#">
+<Description><sourceImageInformation><fileName>images.txt</fileName>
+</sourceImageInformation></Description><Layout>
+<Page ID="page_0" WIDTH="100" HEIGHT="100"><PrintSpace/></Page>
+<Page ID="page_1" WIDTH="200" HEIGHT="100"><PrintSpace/></Page>
+</Layout></alto>"""
+NS = {'alto': 'http://www.loc.gov/standards/alto/ns-v3#'}
+
+
+class TestRunOCRBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = "test_output"
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.image_paths = []
+        for name in ("page_001.png", "page_002.png"):
+            path = os.path.join(self.output_dir, name)
+            Image.new('L', (100, 100), color='white').save(path)
+            self.image_paths.append(path)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.output_dir)
+
+    def test_split_alto_pages(self):
+        """Test that each page becomes a document naming its own image."""
+        pages = split_alto_pages(MULTI_PAGE_ALTO, ['a.png', 'b.png'])
+        self.assertEqual(len(pages), 2)
+        second = etree.fromstring(pages[1])
+        self.assertEqual([page.get('ID') for page in second.iterfind('.//alto:Page', NS)], ['page_1'])
+        self.assertEqual(second.find('.//alto:fileName', NS).text, 'b.png')
+        with self.assertRaises(ValueError):
+            split_alto_pages(MULTI_PAGE_ALTO, ['a.png'])
+
+    @patch('subprocess.run')
+    def test_run_ocr_batch(self, mock_run):
+        """Test that one Tesseract call OCRs the whole list of images."""
+        def tesseract(command, **kwargs):
+            list_path, output_base = command[1], command[2]
+            with open(list_path) as f:
+                self.assertEqual(len(f.read().split()), 2)
+            with open(output_base + '.xml', 'wb') as f:
+                f.write(MULTI_PAGE_ALTO)
+        mock_run.side_effect = tesseract
+
+        alto_paths = run_ocr_batch(self.image_paths, [self.output_dir] * 2, 3)
+
+        mock_run.assert_called_once()
+        self.assertEqual(alto_paths, [os.path.join(self.output_dir, 'page_001.xml'),
+                                      os.path.join(self.output_dir, 'page_002.xml')])
+        page = etree.parse(alto_paths[1]).find('.//alto:Page', NS)
+        self.assertEqual(page.get('WIDTH'), '200')
+
+    @patch('src.ocr.run_ocr', side_effect=['page_001.xml', ValueError('bad page')])
+    @patch('subprocess.run', side_effect=subprocess.CalledProcessError(1, 'tesseract'))
+    def test_run_ocr_batch_falls_back(self, mock_run, mock_run_ocr):
+        """Test that a failed batch is retried one image at a time."""
+        alto_paths = run_ocr_batch(self.image_paths, [self.output_dir] * 2, 3)
+        self.assertEqual(mock_run_ocr.call_count, 2)
+        self.assertEqual(alto_paths, ['page_001.xml', None])
+
+
 if __name__ == '__main__':
     unittest.main()
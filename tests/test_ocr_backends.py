@@ -0,0 +1,164 @@
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from unittest.mock import patch
+import fitz
+from lxml import etree
+from PIL import Image
+from main import main
+from src.ocr import run_ocr
+from src.ocr_backends import (
+    ALTO_XMLNS, OcrBackendError, TesserocrBackend, available_backends, get_backend,
+    log_throughput
+)
+from src.utils.metrics import get_metrics
+
+NS = {'a': ALTO_XMLNS}
+
+
+class FakeTessBaseAPI:
+    """Records the calls tesserocr's PyTessBaseAPI receives."""
+
+    def __init__(self):
+        self.calls = []
+
+    def SetPageSegMode(self, psm):
+        self.calls.append(('SetPageSegMode', psm))
+
+    def SetImage(self, image):
+        self.calls.append(('SetImage', image))
+
+    def Recognize(self):
+        self.calls.append(('Recognize',))
+
+    def GetAltoText(self, page_number):
+        return f'<alto xmlns="{ALTO_XMLNS}"/>'
+
+
+class PSM:
+    """Like tesserocr.PSM, only names the page segmentation modes."""
+    AUTO = 3
+    SINGLE_BLOCK = 6
+
+
+class TestOcrBackends(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.image_path = os.path.join(self.work_dir, 'page.png')
+        Image.new('L', (400, 600), color=255).save(self.image_path)
+        get_metrics().snapshot(reset=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_registry(self):
+        """Test that the built-in backends are registered and unknown ones rejected."""
+        for name in ('tesseract', 'tesserocr', 'pdf-text', 'stub'):
+            self.assertIn(name, available_backends())
+        self.assertEqual(get_backend().name, 'tesseract')
+        self.assertIs(get_backend('stub'), get_backend('stub'))
+        with self.assertRaises(OcrBackendError):
+            get_backend('nonexistent')
+
+    def test_stub_is_deterministic(self):
+        """Test that the stub backend returns the same parsable ALTO for the same page."""
+        backend = get_backend('stub')
+        with Image.open(self.image_path) as image:
+            first = backend.recognize(image, 3)
+            second = backend.recognize(image, 3)
+        self.assertEqual(first, second)
+        root = etree.fromstring(first)
+        strings = root.findall('.//a:String', NS)
+        self.assertEqual(len(strings), 40 * 8)
+        self.assertTrue(all(string.get('WC') == '0.95' for string in strings))
+        page = root.find('.//a:Page', NS)
+        self.assertEqual((page.get('WIDTH'), page.get('HEIGHT')), ('400', '600'))
+
+    def test_pdf_text(self):
+        """Test that the pdf-text backend scales the PDF's words to the page image."""
+        pdf_path = os.path.join(self.work_dir, 'document.pdf')
+        pdf_document = fitz.open()
+        pdf_document.new_page(width=200, height=300).insert_text((20, 50), 'Hello world')
+        pdf_document.new_page(width=200, height=300)
+        pdf_document.save(pdf_path)
+        backend = get_backend('pdf-text')
+
+        with Image.open(self.image_path) as image:
+            alto = backend.recognize(image, 3, (pdf_path, 0))
+            self.assertIsNone(backend.recognize(image, 3, (pdf_path, 1)))
+            self.assertIsNone(backend.recognize(image, 3))
+
+        strings = etree.fromstring(alto).findall('.//a:String', NS)
+        self.assertEqual([s.get('CONTENT') for s in strings], ['Hello', 'world'])
+        # The 200x300 pt page was rasterized at 400x600 px.
+        self.assertAlmostEqual(int(strings[0].get('HPOS')), 40, delta=1)
+
+    def test_tesserocr(self):
+        """Test that the tesserocr backend sets the page segmentation mode by its number."""
+        tesserocr = types.SimpleNamespace(PyTessBaseAPI=FakeTessBaseAPI, PSM=PSM)
+        with patch.dict(sys.modules, {'tesserocr': tesserocr}):
+            backend = TesserocrBackend()
+        with Image.open(self.image_path) as image:
+            alto = backend.recognize(image, '6')
+        self.assertEqual(backend._api.calls[0], ('SetPageSegMode', PSM.SINGLE_BLOCK))
+        self.assertEqual([call[0] for call in backend._api.calls[1:]], ['SetImage', 'Recognize'])
+        self.assertEqual(etree.fromstring(alto).tag, f'{{{ALTO_XMLNS}}}alto')
+
+    def test_run_ocr_records_throughput(self):
+        """Test that run_ocr records the time and pages of each backend."""
+        run_ocr(self.image_path, self.work_dir, 3, backend='stub')
+        snapshot = get_metrics().snapshot()
+        self.assertEqual(snapshot['counters']['ocr.backend.stub.pages'], 1)
+        self.assertEqual(snapshot['timings']['ocr.backend.stub']['count'], 1)
+        with self.assertLogs(level='INFO') as logs:
+            log_throughput(snapshot)
+        self.assertIn('OCR backend stub: 1 page(s)', logs.output[0])
+
+    def test_run_ocr_fallback(self):
+        """Test that pages the backend cannot handle go to the fallback backend."""
+        alto_path = run_ocr(self.image_path, self.work_dir, 3, backend='pdf-text', fallback='stub')
+        self.assertTrue(etree.parse(alto_path).findall('.//a:String', NS))
+        with self.assertRaises(ValueError):
+            run_ocr(self.image_path, self.work_dir, 3, backend='pdf-text')
+
+
+class TestPipelineWithBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.input_dir = os.path.join(self.work_dir, 'input')
+        self.output_dir = os.path.join(self.work_dir, 'output')
+        os.makedirs(self.input_dir)
+        self.config_path = os.path.join(self.work_dir, 'config.ini')
+        with open(self.config_path, 'w') as f:
+            f.write('[OCR]\nBackend = pdf-text\nFallbackBackend = stub\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    @patch('src.normalize_rag.generate_rag_json', return_value=True)
+    def test_pdf_text_with_fallback(self, mock_generate_rag_json):
+        """Test that a PDF mixing text and scanned pages is OCR'd without Tesseract."""
+        pdf_document = fitz.open()
+        pdf_document.new_page(width=200, height=300).insert_text((20, 50), 'Chronicle')
+        pdf_document.new_page(width=200, height=300)
+        pdf_document.save(os.path.join(self.input_dir, 'issue.pdf'))
+
+        with patch('pytesseract.image_to_alto_xml') as mock_tesseract:
+            main(self.input_dir, self.output_dir, self.config_path)
+            mock_tesseract.assert_not_called()
+
+        ocr_dir = os.path.join(self.output_dir, 'issue', 'ocr')
+        first = etree.parse(os.path.join(ocr_dir, 'page_001.xml'))
+        self.assertEqual([s.get('CONTENT') for s in first.findall('.//a:String', NS)],
+                         ['Chronicle'])
+        second = etree.parse(os.path.join(ocr_dir, 'page_002.xml'))
+        self.assertGreater(len(second.findall('.//a:String', NS)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import shutil
+import unittest
+import cv2
+import numpy as np
+from lxml import etree
+from src.generate_html import create_html_from_alto
+from src.normalize_rag import _blocks_from_alto, _blocks_from_cache
+from src.preprocess import PackedPage, pack_bits, write_g4_tiff
+from src.ocr_cache import (
+    write_ocr_cache, load_ocr_cache, export_alto, is_ocr_cache, XMLNS
+)
+
+ALTO_PATH = os.path.join(os.path.dirname(__file__), 'alto.xml')
+
+
+class TestOcrCache(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = 'test_output'
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.cache_path = os.path.join(self.output_dir, 'alto.ocrbin')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_write_and_load_cache(self):
+        """Test that the cache holds the layout of the ALTO file."""
+        self.assertEqual(
+            write_ocr_cache(ALTO_PATH, self.cache_path), self.cache_path
+        )
+        self.assertTrue(is_ocr_cache(self.cache_path))
+
+        page = load_ocr_cache(self.cache_path)
+        self.assertEqual((page.width, page.height), (800, 1000))
+        self.assertEqual(len(page), 16)
+        self.assertEqual(page.block_count, 2)
+        self.assertEqual(page.block_id(1), 'BLOCK2')
+        self.assertEqual(page.line_id(2), 'LINE3')
+        self.assertEqual(page.string_content(7), 'normali-')
+        self.assertEqual(page.string_boxes[8].tolist(), [50, 100, 120, 50])
+        self.assertEqual(
+            page.block_contents(1),
+            ['This', 'is', 'another', 'block', 'of', 'text.']
+        )
+        self.assertTrue(np.isnan(page.string_confidences).all())
+
+    def test_blocks_match_alto(self):
+        """Test that RAG normalization sees the same blocks in both formats."""
+        write_ocr_cache(ALTO_PATH, self.cache_path)
+        self.assertEqual(
+            _blocks_from_cache(load_ocr_cache(self.cache_path)),
+            _blocks_from_alto(ALTO_PATH)
+        )
+
+    def test_export_alto_round_trip(self):
+        """Test that ALTO exported from the cache converts back unchanged."""
+        write_ocr_cache(ALTO_PATH, self.cache_path)
+        exported_path = os.path.join(self.output_dir, 'exported.xml')
+        export_alto(self.cache_path, exported_path)
+
+        tree = etree.parse(exported_path)
+        strings = tree.findall(f'.//{{{XMLNS}}}String')
+        self.assertEqual(len(strings), 16)
+        self.assertEqual(strings[0].get('CONTENT'), 'This')
+        self.assertEqual(strings[0].get('HPOS'), '50')
+
+        second_cache = write_ocr_cache(
+            exported_path, os.path.join(self.output_dir, 'second.ocrbin')
+        )
+        self.assertEqual(
+            load_ocr_cache(second_cache).string_boxes.tolist(),
+            load_ocr_cache(self.cache_path).string_boxes.tolist()
+        )
+
+    def test_create_html_from_cache(self):
+        """Test that HTML can be generated straight from the cache."""
+        write_ocr_cache(ALTO_PATH, self.cache_path)
+        scan_path = os.path.join(self.output_dir, 'scan.png')
+        cv2.imwrite(scan_path, np.zeros((1000, 800, 3), dtype=np.uint8))
+        html_path = os.path.join(self.output_dir, 'page.html')
+
+        self.assertTrue(create_html_from_alto(
+            self.cache_path, html_path,
+            os.path.join(self.output_dir, 'images'), scan_path
+        ))
+        tree = etree.parse(html_path, etree.HTMLParser())
+        spans = tree.findall('.//span')
+        self.assertEqual(len(spans), 16)
+        self.assertIn('left: 565px', spans[7].get('style'))
+
+    def test_create_html_from_cache_with_scan(self):
+        """Test that illustrations and deep zoom use the scan, not the cache."""
+        alto_path = os.path.join(self.output_dir, 'page.xml')
+        with open(alto_path, 'w') as f:
+            f.write(f"""<alto xmlns="{XMLNS}"><Layout><Page><PrintSpace>
+<Illustration ID="i1" HPOS="10" VPOS="20" WIDTH="30" HEIGHT="40"/>
+<TextBlock ID="b1"><TextLine><String CONTENT="Word" HPOS="100" VPOS="100" WIDTH="50" HEIGHT="20"/></TextLine></TextBlock>
+</PrintSpace></Page></Layout></alto>""")
+        write_ocr_cache(alto_path, self.cache_path)
+        scan = np.full((200, 300), 255, dtype=np.uint8)
+        scan[20:60, 10:40] = 0
+        scan_path = os.path.join(self.output_dir, 'scan.tif')
+        write_g4_tiff(pack_bits(scan), 300, scan_path)
+        image_dir = os.path.join(self.output_dir, 'images')
+
+        for page in (None, PackedPage.read(scan_path)):
+            html_path = os.path.join(self.output_dir, 'page.html')
+            self.assertTrue(create_html_from_alto(
+                self.cache_path, html_path, image_dir, scan_path,
+                deep_zoom={'tile_size': 128}, page=page
+            ))
+            illustration = cv2.imread(
+                os.path.join(image_dir, 'illustration_0.png'), cv2.IMREAD_GRAYSCALE
+            )
+            self.assertEqual(illustration.shape, (40, 30))
+            self.assertEqual(illustration.max(), 0)
+            self.assertTrue(os.path.exists(
+                os.path.join(self.output_dir, 'page_scan.dzi')
+            ))
+            shutil.rmtree(image_dir)
+
+    def test_load_invalid_cache(self):
+        """Test that a file that is not a cache is rejected."""
+        with self.assertRaises(ValueError):
+            load_ocr_cache(ALTO_PATH)
+
+
+if __name__ == '__main__':
+    unittest.main()
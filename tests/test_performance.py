@@ -0,0 +1,261 @@
+"""
+Performance regression tests.
+
+Each stage function runs on deterministic, generated fixtures (a 50,000-word
+ALTO page and a synthetic scan) and its run time, peak traced memory and
+retained allocations (the memory blocks it leaves allocated, from a
+tracemalloc snapshot diff) are compared against tests/perf_baseline.json.
+Run times are stored relative to a fixed calibration workload, so the
+baseline carries over between machines of different speeds. A stage fails
+when it is slower than its baseline by more than PERF_TIME_TOLERANCE
+(default 1.0, i.e. twice as slow), uses more memory by more than
+PERF_MEMORY_TOLERANCE (default 0.25), or retains more blocks by more than
+PERF_ALLOCATION_TOLERANCE (default 0.25) plus ALLOCATION_SLACK blocks. Run
+times are the best of PERF_REPEAT runs (default 2).
+
+OCR is replaced by a stub that returns the fixture, so the tests run offline
+without Tesseract. Stages that need NLTK data are skipped when it is not
+installed; every stage that runs without a baseline fails. The baselines of
+those stages must be recorded with the real NLTK data installed.
+
+To record a new baseline after an intended change:
+
+    PERF_UPDATE_BASELINE=1 python -m pytest tests/test_performance.py
+"""
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+import unittest
+from unittest.mock import patch
+import cv2
+import numpy as np
+from lxml import etree
+from conftest import nltk_data_available
+from main import process_image
+from src.dedup import page_hash
+from src.generate_html import create_html_from_alto
+from src.normalize_rag import generate_rag_json
+from src.ocr_cache import load_ocr_cache, to_alto, write_ocr_cache
+from src.preprocess import preprocess_image
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'perf_baseline.json')
+UPDATE_BASELINE = os.environ.get('PERF_UPDATE_BASELINE') == '1'
+TIME_TOLERANCE = float(os.environ.get('PERF_TIME_TOLERANCE', '1.0'))
+MEMORY_TOLERANCE = float(os.environ.get('PERF_MEMORY_TOLERANCE', '0.25'))
+ALLOCATION_TOLERANCE = float(os.environ.get('PERF_ALLOCATION_TOLERANCE', '0.25'))
+# Caches filled by a run (e.g. lxml's and re's) make small counts noisy.
+ALLOCATION_SLACK = 100
+REPEAT = int(os.environ.get('PERF_REPEAT', '2'))
+
+XMLNS = 'http://www.loc.gov/standards/alto/ns-v3#'
+PAGE_WIDTH, PAGE_HEIGHT = 2500, 3500
+
+
+def generate_alto(strings=50000, words_per_line=10, lines_per_block=20, seed=0):
+    """Returns a deterministic ALTO page with the given number of Strings."""
+    rng = random.Random(seed)
+    vocabulary = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(2, 10)))
+                  for _ in range(2000)]
+    alto = etree.Element(f'{{{XMLNS}}}alto', nsmap={None: XMLNS})
+    description = etree.SubElement(alto, f'{{{XMLNS}}}Description')
+    etree.SubElement(description, f'{{{XMLNS}}}MeasurementUnit').text = 'pixel'
+    layout = etree.SubElement(alto, f'{{{XMLNS}}}Layout')
+    page = etree.SubElement(layout, f'{{{XMLNS}}}Page', ID='page_0',
+                            WIDTH=str(PAGE_WIDTH), HEIGHT=str(PAGE_HEIGHT))
+    print_space = etree.SubElement(page, f'{{{XMLNS}}}PrintSpace', HPOS='0', VPOS='0',
+                                   WIDTH=str(PAGE_WIDTH), HEIGHT=str(PAGE_HEIGHT))
+    lines = strings // words_per_line
+    for block_number in range(lines // lines_per_block):
+        block = etree.SubElement(print_space, f'{{{XMLNS}}}TextBlock', ID=f'block_{block_number}',
+                                 HPOS='0', VPOS='0', WIDTH='0', HEIGHT='0')
+        for line_number in range(lines_per_block):
+            line_id = block_number * lines_per_block + line_number
+            y = line_id % 200 * 17
+            line = etree.SubElement(block, f'{{{XMLNS}}}TextLine', ID=f'line_{line_id}',
+                                    HPOS='0', VPOS=str(y), WIDTH=str(PAGE_WIDTH), HEIGHT='15')
+            for word_number in range(words_per_line):
+                word = rng.choice(vocabulary)
+                if word_number == words_per_line - 1 and rng.random() < 0.1:
+                    word += '-'
+                etree.SubElement(line, f'{{{XMLNS}}}String', ID=f'string_{line_id}_{word_number}',
+                                 CONTENT=word, HPOS=str(word_number * 240), VPOS=str(y),
+                                 WIDTH=str(len(word) * 20), HEIGHT='15',
+                                 WC=f'{rng.uniform(0.5, 1.0):.2f}')
+    return etree.tostring(alto, xml_declaration=True, encoding='UTF-8')
+
+
+def generate_page(seed=0):
+    """Returns a deterministic synthetic scan: dark 'words' on a noisy page."""
+    rng = np.random.default_rng(seed)
+    page = rng.normal(230, 10, (PAGE_HEIGHT, PAGE_WIDTH)).clip(0, 255).astype(np.uint8)
+    for y in range(100, PAGE_HEIGHT - 100, 40):
+        x = 100
+        while x < PAGE_WIDTH - 200:
+            width = int(rng.integers(40, 160))
+            page[y:y + 20, x:x + width] = 30
+            x += width + int(rng.integers(20, 50))
+    return page
+
+
+def calibrate():
+    """Times a fixed workload used as the unit for stage run times."""
+    def workload():
+        rng = random.Random(1)
+        values = [rng.random() for _ in range(200000)]
+        values.sort()
+        text = ' '.join(str(value) for value in values[:50000])
+        return len(text.split())
+    return measure_time(workload)
+
+
+def measure_time(func):
+    """Returns the best run time of func over REPEAT runs."""
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def measure_memory(func):
+    """
+    Returns the peak memory traced by tracemalloc while func runs and the
+    number of memory blocks it allocated and still holds when it returns,
+    its result included.
+    """
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        result = func()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        after = tracemalloc.take_snapshot()
+        del result
+    finally:
+        tracemalloc.stop()
+    allocations = sum(
+        max(stat.count_diff, 0) for stat in after.compare_to(before, 'lineno')
+    )
+    return peak_memory, allocations
+
+
+def stub_run_ocr(alto):
+    """Returns a run_ocr replacement that writes alto instead of running Tesseract."""
+    def run_ocr(image_path, output_dir, psm, **kwargs):
+        base_name = os.path.splitext(os.path.basename(image_path))[0]
+        alto_path = os.path.join(output_dir, f'{base_name}.xml')
+        with open(alto_path, 'wb') as f:
+            f.write(alto)
+        return alto_path
+    return run_ocr
+
+
+class TestPerformance(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir = tempfile.mkdtemp(prefix='perf_')
+        cls.alto = generate_alto()
+        cls.alto_path = os.path.join(cls.work_dir, 'page.xml')
+        with open(cls.alto_path, 'wb') as f:
+            f.write(cls.alto)
+        cls.page = generate_page()
+        cls.image_path = os.path.join(cls.work_dir, 'page.png')
+        cv2.imwrite(cls.image_path, cls.page)
+        cls.cache_path = write_ocr_cache(cls.alto_path)
+        cls.unit = calibrate()
+        cls.baseline = {}
+        if os.path.exists(BASELINE_PATH):
+            with open(BASELINE_PATH, 'r', encoding='utf-8') as f:
+                cls.baseline = json.load(f)
+        cls.results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.work_dir)
+        if UPDATE_BASELINE and cls.results:
+            cls.baseline.update(cls.results)
+            with open(BASELINE_PATH, 'w', encoding='utf-8') as f:
+                json.dump(dict(sorted(cls.baseline.items())), f, indent=4)
+                f.write('\n')
+
+    def check_stage(self, stage, func):
+        """Measures a stage and compares it against its baseline."""
+        relative_time = measure_time(func) / self.unit
+        peak_memory, allocations = measure_memory(func)
+        self.results[stage] = {
+            'relative_time': round(relative_time, 3),
+            'peak_memory': peak_memory,
+            'allocations': allocations,
+        }
+        if UPDATE_BASELINE:
+            return
+        self.assertIn(stage, self.baseline,
+                      f'No baseline for {stage}; run with PERF_UPDATE_BASELINE=1')
+        baseline = self.baseline[stage]
+        self.assertLessEqual(
+            relative_time, baseline['relative_time'] * (1 + TIME_TOLERANCE),
+            f'{stage} is slower than its baseline '
+            f'({relative_time:.3f} vs {baseline["relative_time"]:.3f} calibration units)')
+        self.assertLessEqual(
+            peak_memory, baseline['peak_memory'] * (1 + MEMORY_TOLERANCE),
+            f'{stage} uses more memory than its baseline '
+            f'({peak_memory} vs {baseline["peak_memory"]} bytes)')
+        self.assertLessEqual(
+            allocations, baseline['allocations'] * (1 + ALLOCATION_TOLERANCE) + ALLOCATION_SLACK,
+            f'{stage} retains more allocations than its baseline '
+            f'({allocations} vs {baseline["allocations"]} blocks)')
+
+    def test_fixture_size(self):
+        """Test that the ALTO fixture has the expected number of words."""
+        root = etree.fromstring(self.alto)
+        self.assertEqual(len(root.findall(f'.//{{{XMLNS}}}String')), 50000)
+
+    def test_preprocess_image(self):
+        output_path = os.path.join(self.work_dir, 'preprocessed.png')
+        self.check_stage('preprocess_image', lambda: preprocess_image(self.image_path, output_path))
+
+    def test_write_ocr_cache(self):
+        cache_path = os.path.join(self.work_dir, 'written.ocrbin')
+        self.check_stage('write_ocr_cache', lambda: write_ocr_cache(self.alto_path, cache_path))
+
+    def test_ocr_cache_to_alto(self):
+        self.check_stage('ocr_cache_to_alto', lambda: to_alto(load_ocr_cache(self.cache_path)))
+
+    def test_create_html_from_alto(self):
+        html_path = os.path.join(self.work_dir, 'page.html')
+        image_dir = os.path.join(self.work_dir, 'images')
+        self.check_stage('create_html_from_alto', lambda: self.assertTrue(
+            create_html_from_alto(self.alto_path, html_path, image_dir, self.image_path)))
+
+    def test_create_html_from_cache(self):
+        html_path = os.path.join(self.work_dir, 'page_cache.html')
+        image_dir = os.path.join(self.work_dir, 'images')
+        self.check_stage('create_html_from_cache', lambda: self.assertTrue(
+            create_html_from_alto(self.cache_path, html_path, image_dir, self.image_path)))
+
+    def test_page_hash(self):
+        self.check_stage('page_hash', lambda: page_hash(self.page))
+
+    @unittest.skipUnless(nltk_data_available(), 'NLTK data is not installed')
+    def test_generate_rag_json(self):
+        json_path = os.path.join(self.work_dir, 'page.json')
+        self.check_stage('generate_rag_json', lambda: self.assertTrue(
+            generate_rag_json(self.alto_path, json_path, {})))
+
+    @unittest.skipUnless(nltk_data_available(), 'NLTK data is not installed')
+    def test_process_image_with_stub_ocr(self):
+        import configparser
+        config = configparser.ConfigParser()
+        output_dir = os.path.join(self.work_dir, 'pipeline')
+        with patch('src.ocr.run_ocr', side_effect=stub_run_ocr(self.alto)):
+            self.check_stage('process_image', lambda: self.assertTrue(
+                process_image(self.image_path, output_dir, config)))
+
+
+if __name__ == '__main__':
+    unittest.main()
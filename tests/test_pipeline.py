@@ -4,7 +4,9 @@ import unittest
 from unittest.mock import patch, MagicMock
 import cv2
 import numpy as np
-from main import main
+import configparser
+import json
+from main import _file_batches, main
 
 
 class TestPipeline(unittest.TestCase):
@@ -75,6 +77,118 @@ class TestPipeline(unittest.TestCase):
         mock_generate_rag_json.assert_called_once()
         mock_create_html_from_alto.assert_called_once()
 
+    @patch('src.generate_html.create_html_from_alto', return_value=True)
+    @patch('src.normalize_rag.generate_rag_json', return_value=True)
+    @patch('src.ocr.run_ocr_batch')
+    @patch('src.ocr.run_ocr')
+    def test_image_files_batched_ocr(self, mock_run_ocr, mock_run_ocr_batch, *mocks):
+        """Test that single image files are OCR'd in batches of BatchSize."""
+        os.remove(os.path.join(self.input_dir, 'test_image.png'))
+        for n in range(5):
+            cv2.imwrite(os.path.join(self.input_dir, f'scan_{n}.png'), np.zeros((10, 10), dtype=np.uint8))
+        with open(self.config_path, 'w') as f:
+            f.write('[OCR]\nPSM = 3\nBatchSize = 2\n')
+
+        def run_ocr_batch_mock(image_paths, output_dirs, psm, **kwargs):
+            return [os.path.join(output_dir, 'page.xml') for output_dir in output_dirs]
+
+        mock_run_ocr_batch.side_effect = run_ocr_batch_mock
+        mock_run_ocr.side_effect = lambda image_path, output_dir, psm, **kwargs: os.path.join(output_dir, 'page.xml')
+
+        main(self.input_dir, self.output_dir, self.config_path)
+
+        self.assertEqual(mock_run_ocr_batch.call_count, 2)
+        self.assertEqual([len(c[0][0]) for c in mock_run_ocr_batch.call_args_list], [2, 2])
+        self.assertEqual(mock_run_ocr.call_count, 1)
+        for n in range(5):
+            with open(os.path.join(self.output_dir, f'scan_{n}', '_complete.json')) as f:
+                self.assertEqual(json.load(f)['pages'], [f'scan_{n}'])
+
+    def test_file_batches(self):
+        """Test that only runs of consecutive image files are grouped, and not in packed mode."""
+        config = configparser.ConfigParser()
+        config.read_string('[OCR]\nBatchSize = 2\n')
+        names = ['a.png', 'b.tiff', 'c.jpg', 'd.pdf', 'e.png', 'notes.txt', 'f.png']
+        self.assertEqual(_file_batches(names, config),
+                         [['a.png', 'b.tiff'], ['c.jpg'], ['d.pdf'], ['e.png'], ['notes.txt'], ['f.png']])
+        config.read_string('[Output]\nMode = packed\n')
+        self.assertEqual(_file_batches(names, config), [[name] for name in names])
+
+    @patch('src.ocr.run_ocr')
+    def test_pipeline_packed_output(self, mock_run_ocr):
+        """Test that packed mode writes a single archive per document."""
+        import zipfile
+
+        def run_ocr_mock(image_path, output_dir, psm, **kwargs):
+            path = os.path.join(output_dir, 'test_image.xml')
+            with open(path, 'w') as f:
+                f.write('<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#"/>')
+            return path
+
+        mock_run_ocr.side_effect = run_ocr_mock
+        with open(self.config_path, 'a') as f:
+            f.write('[Output]\n')
+            f.write('Mode = packed\n')
+
+        with patch('src.normalize_rag.generate_rag_json', return_value=True):
+            main(self.input_dir, self.output_dir, self.config_path)
+
+        self.assertEqual(sorted(os.listdir(self.output_dir)),
+                         ['logs', 'test_image.zip'])
+        with zipfile.ZipFile(os.path.join(self.output_dir, 'test_image.zip')) as archive:
+            names = archive.namelist()
+            html = archive.read('test_image/html/test_image.html')
+        self.assertIn('test_image/preprocessed/test_image.png', names)
+        self.assertIn('test_image/ocr/test_image.xml', names)
+        self.assertIn('style.css', names)
+        self.assertIn(b'href="../preprocessed/test_image.png"', html)
+
+    @patch('src.ocr.run_ocr')
+    def test_pipeline_packed_output_index(self, mock_run_ocr):
+        """Test that the collection index links a packed document to its archive."""
+        import glob
+        import re
+
+        def run_ocr_mock(image_path, output_dir, psm, **kwargs):
+            path = os.path.join(output_dir, 'test_image.xml')
+            with open(path, 'w') as f:
+                f.write('<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#"/>')
+            return path
+
+        mock_run_ocr.side_effect = run_ocr_mock
+        with open(self.config_path, 'a') as f:
+            f.write('[Output]\nMode = packed\n[Site]\nIndex = true\n')
+
+        with patch('src.normalize_rag.generate_rag_json', return_value=True):
+            main(self.input_dir, self.output_dir, self.config_path)
+
+        listings = [path for path in glob.glob(os.path.join(self.output_dir, 'index', '**', 'index.html'),
+                                               recursive=True)
+                    if 'test_image.zip' in open(path).read()]
+        self.assertEqual(len(listings), 1)
+        with open(listings[0]) as f:
+            links = re.findall(r'href="([^"]+)"', f.read())
+        self.assertEqual(len(links), 1)
+        target = os.path.normpath(os.path.join(os.path.dirname(listings[0]), links[0]))
+        self.assertEqual(target, os.path.join(self.output_dir, 'test_image.zip'))
+
+    @patch('src.generate_html.create_html_from_alto', return_value=True)
+    @patch('src.normalize_rag.generate_rag_json', return_value=True)
+    @patch('src.ocr.run_ocr', return_value='test_image.xml')
+    @patch('src.preprocess.preprocess_image', return_value='test_image.png')
+    def test_pipeline_profile_report(self, *mocks):
+        """Test that --profile writes a per-stage report."""
+        main(self.input_dir, self.output_dir, self.config_path, profile=True)
+
+        profile_dir = os.path.join(self.output_dir, 'logs', 'profiles')
+        with open(os.path.join(profile_dir, 'report.txt')) as f:
+            report = f.read()
+        for stage in ('preprocess', 'ocr', 'rag', 'html'):
+            self.assertIn(f'=== {stage}:', report)
+            self.assertTrue(os.path.exists(
+                os.path.join(profile_dir, f'{stage}.collapsed')
+            ))
+
 
 if __name__ == '__main__':
     unittest.main()
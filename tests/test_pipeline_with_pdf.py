@@ -1,10 +1,36 @@
 import os
 import shutil
 import unittest
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from conftest import nltk_data_available
 from main import main
 from unittest.mock import patch
 
 
+class BrokenAfterFirstTaskPool:
+    """A worker pool whose first task succeeds and whose worker then dies."""
+
+    def __init__(self, *args, **kwargs):
+        self.submitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def submit(self, run_task, handler, file_path, output_dir, *args, cpus=None):
+        self.submitted += 1
+        future = Future()
+        if self.submitted == 1:
+            future.set_result({"result": (True, ["page_001"]), "error": None,
+                               "cpu_seconds": 0.1, "metrics": {}})
+        else:
+            future.set_exception(BrokenProcessPool("A worker died"))
+        return future
+
+
 class TestPipelineWithPDF(unittest.TestCase):
 
     def setUp(self):
@@ -45,7 +71,7 @@ class TestPipelineWithPDF(unittest.TestCase):
                 f.write("dummy preprocessed image")
             return output_path
 
-        def run_ocr_mock(image_path, output_dir, psm):
+        def run_ocr_mock(image_path, output_dir, psm, **kwargs):
             path = os.path.join(output_dir, "page_001.xml")
             with open(path, "w") as f:
                 f.write("dummy xml")
@@ -57,7 +83,7 @@ class TestPipelineWithPDF(unittest.TestCase):
             return True
 
         def create_html_from_alto_mock(
-                alto_path, output_html_path, image_dir_path, original_scan_path
+                alto_path, output_html_path, image_dir_path, original_scan_path, **kwargs
         ):
             with open(output_html_path, "w") as f:
                 f.write("dummy html")
@@ -104,6 +130,95 @@ class TestPipelineWithPDF(unittest.TestCase):
         html_file_path = os.path.join(html_dir, "page_001.html")
         self.assertTrue(os.path.isfile(html_file_path))
 
+    @patch('src.generate_html.create_html_from_alto', return_value=True)
+    @patch('src.normalize_rag.generate_rag_json', return_value=True)
+    @patch('src.ocr.run_ocr_batch')
+    @patch('src.ocr.run_ocr')
+    @patch('fitz.open')
+    def test_pdf_batched_ocr(self, mock_fitz_open, mock_run_ocr,
+                             mock_run_ocr_batch, mock_generate_rag_json,
+                             mock_create_html_from_alto):
+        """Test that PDF pages are OCR'd in batches of BatchSize."""
+        mock_doc = unittest.mock.MagicMock()
+        mock_fitz_open.return_value = mock_doc
+        mock_doc.__len__.return_value = 5
+        import cv2
+        import numpy as np
+        png = cv2.imencode('.png', np.zeros((10, 10), dtype=np.uint8))[1].tobytes()
+        mock_doc.load_page.return_value.get_pixmap.return_value.tobytes.return_value = png
+
+        def run_ocr_batch_mock(image_paths, output_dirs, psm, **kwargs):
+            # The second page of each batch fails.
+            return [os.path.join(output_dir, "page.xml") if i != 1 else None
+                    for i, output_dir in enumerate(output_dirs)]
+
+        mock_run_ocr_batch.side_effect = run_ocr_batch_mock
+        mock_run_ocr.return_value = "page_005.xml"
+        with open(self.config_path, 'a') as f:
+            f.write('BatchSize = 2\n')
+        with open(os.path.join(self.input_dir, "dummy.pdf"), "w") as f:
+            f.write("dummy content")
+
+        main(self.input_dir, self.output_dir, self.config_path)
+
+        self.assertEqual(mock_run_ocr_batch.call_count, 2)
+        self.assertEqual(len(mock_run_ocr_batch.call_args_list[0][0][0]), 2)
+        # The last, incomplete batch has a single page.
+        self.assertEqual(mock_run_ocr_batch.call_count + mock_run_ocr.call_count, 3)
+        self.assertEqual(mock_create_html_from_alto.call_count, 3)
+
+    @unittest.skipUnless(nltk_data_available(), 'NLTK data is not installed')
+    def test_pdf_sharding(self):
+        """Test that a large PDF is split into page-range shards and reassembled."""
+        import fitz
+        import json
+
+        # The worker processes run the real pipeline with the stub OCR backend.
+        with open(self.config_path, 'a') as f:
+            f.write('Backend = stub\n')
+        pdf_document = fitz.open()
+        for _ in range(5):
+            pdf_document.new_page(width=100, height=100)
+        pdf_document.save(os.path.join(self.input_dir, "volume.pdf"))
+        with open(self.config_path, 'a') as f:
+            f.write('[Resources]\nWorkers = 2\nShardPages = 2\n')
+
+        main(self.input_dir, self.output_dir, self.config_path)
+
+        document_dir = os.path.join(self.output_dir, "volume")
+        with open(os.path.join(document_dir, "_complete.json")) as f:
+            marker = json.load(f)
+        self.assertEqual(marker["shards"], 3)
+        self.assertTrue(marker["succeeded"])
+        self.assertEqual(marker["pages"], [f"page_{n:03}" for n in range(1, 6)])
+        for n in range(1, 6):
+            self.assertTrue(os.path.isfile(
+                os.path.join(document_dir, "html", f"page_{n:03}.html")))
+
+    @patch('src.workers.create_worker_pool', BrokenAfterFirstTaskPool)
+    def test_broken_pool_fails_remaining_shards(self):
+        """Test that a dead worker fails the document instead of aborting the run."""
+        import fitz
+        import json
+
+        pdf_document = fitz.open()
+        for _ in range(5):
+            pdf_document.new_page(width=100, height=100)
+        pdf_document.save(os.path.join(self.input_dir, "volume.pdf"))
+        with open(self.config_path, 'a') as f:
+            f.write('[Resources]\nWorkers = 2\nShardPages = 2\n')
+
+        with self.assertLogs(level='INFO') as logs:
+            main(self.input_dir, self.output_dir, self.config_path)
+
+        with open(os.path.join(self.output_dir, "volume", "_complete.json")) as f:
+            marker = json.load(f)
+        self.assertFalse(marker["succeeded"])
+        self.assertEqual(marker["pages"], ["page_001"])
+        log = "\n".join(logs.output)
+        self.assertIn("Worker pool failed", log)
+        self.assertIn("CPU utilization", log)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,110 @@
+import configparser
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+import cv2
+import numpy as np
+from PIL import Image
+from main import process_image
+from src.preprocess import (
+    PackedPage, pack_bits, preprocess_image, read_g4_tiff, unpack_bits, write_g4_tiff
+)
+
+
+def scanned_page(height=1200, width=900, seed=0):
+    """Returns a synthetic grayscale scan: dark 'words' on a noisy page."""
+    rng = np.random.default_rng(seed)
+    page = rng.normal(220, 12, (height, width)).clip(0, 255).astype(np.uint8)
+    for y in range(60, height - 60, 36):
+        x = 50
+        while x < width - 150:
+            word = int(rng.integers(30, 120))
+            page[y:y + 18, x:x + word] = 40
+            x += word + int(rng.integers(15, 40))
+    return page
+
+
+class TestPreprocess(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.image_path = os.path.join(self.work_dir, 'scan.png')
+        cv2.imwrite(self.image_path, scanned_page())
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_pack_bits_round_trip(self):
+        """Test that packing keeps every pixel of a page whose width is not a multiple of 8."""
+        binary = (np.random.default_rng(1).random((37, 53)) > 0.5).astype(np.uint8) * 255
+        bits = pack_bits(binary)
+        self.assertEqual(bits.shape, (37, 7))
+        np.testing.assert_array_equal(unpack_bits(bits, 53), binary)
+
+        tiff_path = os.path.join(self.work_dir, 'page.tif')
+        write_g4_tiff(bits, 53, tiff_path)
+        read_bits, width = read_g4_tiff(tiff_path)
+        self.assertEqual(width, 53)
+        np.testing.assert_array_equal(unpack_bits(read_bits, width), binary)
+
+    def test_packed_page_regions(self):
+        """Test that a packed page unpacks any region to the same pixels as the whole page."""
+        output_path = os.path.join(self.work_dir, 'scan.tif')
+        preprocess_image(self.image_path, output_path, binarize=True)
+        page = PackedPage.read(output_path)
+        full = page.unpack()
+        self.assertEqual(page.shape, (1200, 900))
+        np.testing.assert_array_equal(full, cv2.imread(output_path, cv2.IMREAD_GRAYSCALE))
+        for y0, y1, x0, x1 in [(0, 1200, 0, 900), (37, 91, 13, 611), (1190, 1300, 893, 950), (5, 5, 3, 9)]:
+            np.testing.assert_array_equal(page[y0:y1, x0:x1], full[y0:y1, x0:x1])
+
+    def test_binarized_page_is_g4_tiff(self):
+        """Test that a binarized page is a small 1-bit G4 TIFF that OpenCV can read."""
+        output_path = os.path.join(self.work_dir, 'scan.tif')
+        preprocess_image(self.image_path, output_path, binarize=True)
+
+        with Image.open(output_path) as image:
+            self.assertEqual(image.mode, '1')
+            self.assertEqual(image.info['compression'], 'group4')
+        page = cv2.imread(output_path, cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(page.shape, (1200, 900))
+        self.assertEqual(set(np.unique(page)), {0, 255})
+        # The same page as an 8-bit PNG.
+        copy_path = os.path.join(self.work_dir, 'copy.png')
+        preprocess_image(self.image_path, copy_path)
+        self.assertLess(os.path.getsize(output_path) * 8, os.path.getsize(copy_path))
+
+    @patch('src.normalize_rag.generate_rag_json', return_value=True)
+    def test_pipeline_with_binarize(self, mock_generate_rag_json):
+        """Test that the pipeline OCRs and renders the binarized TIFF."""
+        config = configparser.ConfigParser()
+        config.read_string('[Preprocessing]\nBinarize = true\n[OCR]\nBackend = stub\n')
+        output_dir = os.path.join(self.work_dir, 'output')
+
+        self.assertTrue(process_image(self.image_path, output_dir, config))
+
+        preprocessed_path = os.path.join(output_dir, 'preprocessed', 'scan.tif')
+        self.assertTrue(os.path.isfile(preprocessed_path))
+        self.assertTrue(os.path.isfile(os.path.join(output_dir, 'ocr', 'scan.xml')))
+        with open(os.path.join(output_dir, 'html', 'scan.html'), 'rb') as f:
+            self.assertIn(b'scan.tif', f.read())
+
+    @patch('src.normalize_rag.generate_rag_json', return_value=True)
+    def test_pipeline_decodes_binarized_page_once(self, mock_generate_rag_json):
+        """Test that the stages after OCR share one decode of the binarized page."""
+        config = configparser.ConfigParser()
+        config.read_string('[Preprocessing]\nBinarize = true\n[OCR]\nBackend = stub\n')
+        output_dir = os.path.join(self.work_dir, 'output')
+
+        with patch('src.preprocess.read_g4_tiff', side_effect=read_g4_tiff) as mock_read, \
+                patch('cv2.imread', side_effect=cv2.imread) as mock_imread:
+            self.assertTrue(process_image(self.image_path, output_dir, config))
+        mock_read.assert_called_once()
+        # Only preprocessing reads an image with OpenCV.
+        mock_imread.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
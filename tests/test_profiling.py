@@ -0,0 +1,93 @@
+import os
+import pstats
+import shutil
+import unittest
+from src.utils.profiling import (
+    configure_profiling, disable_profiling, begin_page, profile_stage,
+    flush_profiles, write_profile_report
+)
+
+
+def _busy_inner():
+    return sum(i * i for i in range(20000))
+
+
+def _busy_outer():
+    return _busy_inner() + _busy_inner()
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        self.profile_dir = 'test_profiles'
+
+    def tearDown(self):
+        disable_profiling()
+        if os.path.exists(self.profile_dir):
+            shutil.rmtree(self.profile_dir)
+
+    def test_disabled_profiling_is_a_no_op(self):
+        """Test that stages share one no-op context when profiling is off."""
+        self.assertIs(profile_stage('ocr'), profile_stage('html'))
+        with profile_stage('ocr'):
+            _busy_inner()
+        flush_profiles()
+        self.assertFalse(os.path.exists(self.profile_dir))
+
+    def test_report_contains_stages_and_stacks(self):
+        """Test that profiled stages end up in the merged report."""
+        configure_profiling(self.profile_dir)
+        begin_page()
+        with profile_stage('ocr'):
+            _busy_outer()
+        with profile_stage('html'):
+            _busy_inner()
+        flush_profiles()
+
+        report_path = write_profile_report(self.profile_dir)
+        with open(report_path) as f:
+            report = f.read()
+        self.assertIn('=== ocr:', report)
+        self.assertIn('=== html:', report)
+        self.assertIn('_busy_outer', report)
+        self.assertTrue(os.path.exists(
+            os.path.join(self.profile_dir, 'ocr.prof')
+        ))
+
+        with open(os.path.join(self.profile_dir, 'ocr.collapsed')) as f:
+            stacks = [line.rsplit(' ', 1) for line in f.read().splitlines()]
+        self.assertTrue(all(int(count) > 0 for _, count in stacks))
+        self.assertTrue(any(
+            stack.startswith('ocr;') and '_busy_inner' in stack
+            and stack.index('_busy_outer') < stack.index('_busy_inner')
+            for stack, _ in stacks
+        ))
+
+    def test_sampling_skips_pages(self):
+        """Test that only every Nth page is profiled."""
+        configure_profiling(self.profile_dir, sample_every=2)
+        for _ in range(4):
+            begin_page()
+            with profile_stage('ocr'):
+                _busy_inner()
+        flush_profiles()
+
+        stats = pstats.Stats(os.path.join(self.profile_dir, 'ocr',
+                                          f'{os.getpid()}.prof'))
+        calls = [value[1] for func, value in stats.stats.items()
+                 if func[2] == '_busy_inner']
+        self.assertEqual(calls, [2])
+
+    def test_nested_stages_are_attributed_to_the_outer_stage(self):
+        """Test that a stage inside another stage is not profiled twice."""
+        configure_profiling(self.profile_dir)
+        begin_page()
+        with profile_stage('ocr'):
+            self.assertIs(profile_stage('rag'),
+                          profile_stage('html'))
+        flush_profiles()
+        self.assertEqual(os.listdir(self.profile_dir), ['ocr'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import json
+import os
+import shutil
+import threading
+import unittest
+from unittest.mock import patch
+import cv2
+import numpy as np
+from lxml import etree
+from src.generate_html import create_html_from_alto
+from src.pyramid import build_pyramid, write_viewer, level_count, DZI_XMLNS
+
+
+class TestPyramid(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = 'test_output'
+        os.makedirs(self.output_dir, exist_ok=True)
+        # A 600x1000 page with a gradient so tiles differ.
+        self.image = np.tile(
+            np.linspace(0, 255, 1000, dtype=np.uint8), (600, 1)
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_build_pyramid(self):
+        """Test that every level is tiled with the expected tile grid."""
+        dzi_path = build_pyramid(
+            self.image, self.output_dir, 'page', tile_size=256, overlap=1
+        )
+        descriptor = etree.parse(dzi_path).getroot()
+        self.assertEqual(descriptor.get('TileSize'), '256')
+        size = descriptor.find(f'{{{DZI_XMLNS}}}Size')
+        self.assertEqual((size.get('Width'), size.get('Height')),
+                         ('1000', '600'))
+
+        tiles_dir = os.path.join(self.output_dir, 'page_files')
+        levels = level_count(1000, 600)
+        self.assertEqual(levels, 11)
+        self.assertEqual(len(os.listdir(tiles_dir)), levels)
+        # Full resolution: 4 x 3 tiles.
+        self.assertEqual(len(os.listdir(os.path.join(tiles_dir, '10'))), 12)
+        self.assertEqual(os.listdir(os.path.join(tiles_dir, '0')), ['0_0.jpg'])
+
+        # Edge tiles include the overlap only on their inner side.
+        tile = cv2.imread(os.path.join(tiles_dir, '10', '3_2.jpg'),
+                          cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(tile.shape, (600 - 511, 1000 - 767))
+        tile = cv2.imread(os.path.join(tiles_dir, '10', '1_1.jpg'),
+                          cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(tile.shape, (258, 258))
+        # Level 9 is half the resolution.
+        tile = cv2.imread(os.path.join(tiles_dir, '9', '1_1.jpg'),
+                          cv2.IMREAD_GRAYSCALE)
+        self.assertEqual(tile.shape, (300 - 255, 500 - 255))
+
+    def test_build_pyramid_webp(self):
+        """Test that WebP tiles can be generated."""
+        build_pyramid(self.image, self.output_dir, 'page', tile_format='webp')
+        self.assertTrue(os.path.exists(
+            os.path.join(self.output_dir, 'page_files', '0', '0_0.webp')
+        ))
+
+    def test_build_pyramid_unsupported_format(self):
+        """Test that an unknown tile format is rejected."""
+        with self.assertRaises(ValueError):
+            build_pyramid(self.image, self.output_dir, 'page',
+                          tile_format='gif')
+
+    def test_write_viewer(self):
+        """Test that the viewer embeds the pyramid description."""
+        dzi_path = build_pyramid(self.image, self.output_dir, 'page')
+        viewer_path = write_viewer(
+            dzi_path, os.path.join(self.output_dir, 'page.html'), 'Page'
+        )
+        with open(viewer_path) as f:
+            html = f.read()
+        start = html.index('var pyramid = ') + len('var pyramid = ')
+        pyramid = json.loads(html[start:html.index(';', start)])
+        self.assertEqual(pyramid['tiles'], 'page_files')
+        self.assertEqual((pyramid['width'], pyramid['height']), (1000, 600))
+        self.assertIn('<title>Page</title>', html)
+
+    def test_build_pyramid_thread_budget(self):
+        """Test that tiles are encoded on no more threads than the caller's budget."""
+        threads = set()
+        imencode = cv2.imencode
+
+        def record_thread(*args):
+            threads.add(threading.get_ident())
+            return imencode(*args)
+
+        with patch('src.pyramid.cv2.imencode', side_effect=record_thread):
+            build_pyramid(self.image, self.output_dir, 'page', tile_size=64)
+        self.assertEqual(len(threads), 1)
+
+    def test_create_html_with_deep_zoom(self):
+        """Test that the scan button links to the deep zoom viewer."""
+        alto_path = os.path.join(self.output_dir, 'page.xml')
+        with open(alto_path, 'w') as f:
+            f.write('<alto xmlns="http://www.loc.gov/standards/alto/ns-v3#"/>')
+        scan_path = os.path.join(self.output_dir, 'scan.png')
+        cv2.imwrite(scan_path, self.image)
+        html_path = os.path.join(self.output_dir, 'page.html')
+
+        self.assertTrue(create_html_from_alto(
+            alto_path, html_path, os.path.join(self.output_dir, 'images'),
+            scan_path, deep_zoom={'tile_size': 512}
+        ))
+        tree = etree.parse(html_path, etree.HTMLParser())
+        button = tree.find('.//a')
+        self.assertEqual(button.get('href'), 'page_scan.html')
+        self.assertTrue(os.path.exists(
+            os.path.join(self.output_dir, 'page_scan.dzi')
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
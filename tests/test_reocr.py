@@ -0,0 +1,90 @@
+import os
+import shutil
+import unittest
+from unittest.mock import patch
+import numpy as np
+import pytesseract
+from lxml import etree
+from PIL import Image
+from src.reocr import Attempt, refine_weak_blocks, weak_blocks
+
+ALTO_PATH = os.path.join(os.path.dirname(__file__), 'alto.xml')
+XMLNS = 'http://www.loc.gov/standards/alto/ns-v4#'
+NS = {'alto': XMLNS}
+
+# What Tesseract returns for a cropped block: one confident line.
+CROP_ALTO = f"""<alto xmlns="{XMLNS}"><Layout><Page WIDTH="200" HEIGHT="60">
+<PrintSpace><TextBlock ID="block_0" HPOS="0" VPOS="0" WIDTH="200" HEIGHT="60">
+<TextLine ID="line_0" HPOS="20" VPOS="10" WIDTH="160" HEIGHT="40">
+<String ID="string_0" CONTENT="Better" HPOS="20" VPOS="10" WIDTH="100" HEIGHT="40" WC="0.95"/>
+<SP WIDTH="10" VPOS="10" HPOS="120"/>
+<String ID="string_1" CONTENT="text" HPOS="130" VPOS="10" WIDTH="50" HEIGHT="40" WC="0.91"/>
+</TextLine></TextBlock></PrintSpace></Page></Layout></alto>""".encode()
+
+
+class TestReOcr(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = 'test_output'
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.image_path = os.path.join(self.output_dir, 'page.png')
+        Image.fromarray(np.full((1000, 800), 255, dtype=np.uint8)).save(self.image_path)
+
+        # BLOCK1 is weak, BLOCK2 is confident.
+        tree = etree.parse(ALTO_PATH)
+        for block_id, confidence in (('BLOCK1', '0.30'), ('BLOCK2', '0.90')):
+            block = tree.find(f'.//alto:TextBlock[@ID="{block_id}"]', NS)
+            for string in block.iter(f'{{{XMLNS}}}String'):
+                string.set('WC', confidence)
+        self.alto_path = os.path.join(self.output_dir, 'page.xml')
+        tree.write(self.alto_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def test_weak_blocks(self):
+        """Test that only blocks below the confidence threshold are weak."""
+        root = etree.parse(self.alto_path).getroot()
+        self.assertEqual([block.get('ID') for block in weak_blocks(root, 0.6)], ['BLOCK1'])
+
+    @patch('pytesseract.image_to_alto_xml', return_value=CROP_ALTO)
+    def test_refine_weak_blocks(self, mock_image_to_alto_xml):
+        """Test that a better re-OCR of a weak block is spliced into the page."""
+        attempts = (Attempt(psm=6, scale=2.0, binarize='otsu'),)
+        replaced = refine_weak_blocks(self.image_path, self.alto_path, 0.6, attempts, margin=8)
+
+        self.assertEqual(replaced, 1)
+        mock_image_to_alto_xml.assert_called_once()
+        crop = mock_image_to_alto_xml.call_args[0][0]
+        # BLOCK1 is 700x100 at (50, 50); with the margin, upscaled twice.
+        self.assertEqual(crop.size, ((700 + 16) * 2, (100 + 16) * 2))
+
+        root = etree.parse(self.alto_path).getroot()
+        block = root.find('.//alto:TextBlock[@ID="BLOCK1"]', NS)
+        strings = block.findall('.//alto:String', NS)
+        self.assertEqual([s.get('CONTENT') for s in strings], ['Better', 'text'])
+        # Crop coordinates are mapped back: 20 / 2 + (50 - 8).
+        self.assertEqual(strings[0].get('HPOS'), '52')
+        self.assertEqual(strings[0].get('WIDTH'), '50')
+        self.assertTrue(strings[0].get('ID').startswith('BLOCK1_R1'))
+        # The confident block is untouched.
+        block2 = root.find('.//alto:TextBlock[@ID="BLOCK2"]', NS)
+        self.assertEqual(block2.find('.//alto:String', NS).get('CONTENT'), 'This')
+
+    @patch('pytesseract.image_to_alto_xml', return_value=CROP_ALTO.replace(b'0.9', b'0.1'))
+    def test_worse_result_is_discarded(self, mock_image_to_alto_xml):
+        """Test that a less confident re-OCR leaves the page unchanged."""
+        with open(self.alto_path, 'rb') as f:
+            original = f.read()
+        self.assertEqual(refine_weak_blocks(self.image_path, self.alto_path, 0.6), 0)
+        with open(self.alto_path, 'rb') as f:
+            self.assertEqual(f.read(), original)
+
+    @patch('pytesseract.image_to_alto_xml', side_effect=pytesseract.TesseractError(1, 'boom'))
+    def test_failed_attempts_are_skipped(self, mock_image_to_alto_xml):
+        """Test that a failing re-OCR does not fail the page."""
+        self.assertEqual(refine_weak_blocks(self.image_path, self.alto_path, 0.6), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
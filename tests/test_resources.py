@@ -0,0 +1,188 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import cv2
+import numpy as np
+from PIL import Image
+from main import main
+from src.utils.resources import (
+    CpuAllocator, CpuUtilization, ResourcePolicy, apply_thread_budget, page_megapixels,
+    thread_budget
+)
+
+
+class RecordingPool:
+    """A worker pool that records the CPUs of the tasks running at once."""
+
+    instances = []
+
+    def __init__(self, config_path, workers, policy=None, pages=None):
+        self.executor = ThreadPoolExecutor(workers)
+        self.lock = threading.Lock()
+        self.running = []
+        self.peak_threads = 0
+        self.overlapping = False
+        self.submitted = 0
+        RecordingPool.instances.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True)
+        return False
+
+    def submit(self, run_task, handler, file_path, output_dir, *args, cpus=None):
+        # The first tasks outlast the tail of the queue.
+        seconds = 0.3 if self.submitted < 2 else 0.02
+        self.submitted += 1
+
+        def task():
+            with self.lock:
+                running = set().union(*self.running)
+                self.overlapping = self.overlapping or bool(running & set(cpus))
+                self.running.append(set(cpus))
+                self.peak_threads = max(self.peak_threads, sum(map(len, self.running)))
+            time.sleep(seconds)
+            with self.lock:
+                self.running.remove(set(cpus))
+            return {"result": True, "error": None, "cpu_seconds": 0.0, "metrics": {}}
+
+        return self.executor.submit(task)
+
+
+class TestResourcePolicy(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = ResourcePolicy(cpus=range(8), large_page_megapixels=8.0)
+
+    def test_deep_queue_runs_single_threaded_workers(self):
+        """Test that a deep queue gets one single-threaded worker per CPU."""
+        plan = self.policy.plan(queue_depth=100, megapixels=20.0)
+        self.assertEqual(plan.workers, 8)
+        self.assertEqual(plan.threads, 1)
+
+    def test_shallow_queue_of_large_pages_uses_threads(self):
+        """Test that few large pages share the CPUs between their threads."""
+        plan = self.policy.plan(queue_depth=2, megapixels=20.0)
+        self.assertEqual(plan.workers, 2)
+        self.assertEqual(plan.threads, 4)
+
+    def test_small_pages_run_single_threaded(self):
+        """Test that small pages never get more than one thread."""
+        plan = self.policy.plan(queue_depth=1, megapixels=2.0)
+        self.assertEqual(plan.threads, 1)
+
+    def test_max_workers(self):
+        """Test that the worker count is capped."""
+        policy = ResourcePolicy(cpus=range(8), max_workers=2)
+        self.assertEqual(policy.plan(queue_depth=100), (2, 4))
+
+    def test_cpu_sets_do_not_overlap(self):
+        """Test that worker slots get disjoint CPU sets."""
+        sets = [self.policy.cpu_set(slot, 2) for slot in range(4)]
+        self.assertEqual(set().union(*sets), set(range(8)))
+        self.assertTrue(all(len(cpus) == 2 for cpus in sets))
+
+
+    def test_cpu_allocator(self):
+        """Test that tasks get disjoint CPUs, capped to those still free."""
+        allocator = CpuAllocator(range(4))
+        first = allocator.acquire(3)
+        second = allocator.acquire(3)
+        self.assertEqual((first, second), ([0, 1, 2], [3]))
+        self.assertEqual(allocator.free(), 0)
+        threading.Timer(0.05, allocator.release, [second]).start()
+        self.assertEqual(allocator.acquire(1), [3])
+        allocator.release(first)
+        self.assertEqual(allocator.free(), 3)
+
+    @patch('src.workers.create_worker_pool', RecordingPool)
+    @patch('src.utils.resources.available_cpus', return_value=list(range(8)))
+    def test_batch_threads_in_flight(self, mock_available_cpus):
+        """Test that the files running at once never use more threads than there are CPUs."""
+        work_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, work_dir)
+        input_dir = os.path.join(work_dir, 'input')
+        os.makedirs(input_dir)
+        for n in range(12):
+            open(os.path.join(input_dir, f'page_{n:02}.tif'), 'w').close()
+        config_path = os.path.join(work_dir, 'config.ini')
+        with open(config_path, 'w') as f:
+            f.write('[Resources]\nWorkers = 4\n')
+
+        RecordingPool.instances = []
+        main(input_dir, os.path.join(work_dir, 'output'), config_path)
+        pool, = RecordingPool.instances
+        self.assertEqual(pool.submitted, 12)
+        self.assertLessEqual(pool.peak_threads, 8)
+        self.assertFalse(pool.overlapping)
+
+
+class TestThreadBudget(unittest.TestCase):
+
+    def setUp(self):
+        self.environ = os.environ.get('OMP_THREAD_LIMIT')
+        self.cv2_threads = cv2.getNumThreads()
+
+    def tearDown(self):
+        if self.environ is None:
+            os.environ.pop('OMP_THREAD_LIMIT', None)
+        else:
+            os.environ['OMP_THREAD_LIMIT'] = self.environ
+        cv2.setNumThreads(self.cv2_threads)
+
+    def test_apply_thread_budget(self):
+        """Test that Tesseract and OpenCV are limited to the budget."""
+        apply_thread_budget(1)
+        self.assertEqual(os.environ['OMP_THREAD_LIMIT'], '1')
+        self.assertEqual(cv2.getNumThreads(), 1)
+        self.assertEqual(thread_budget(), 1)
+
+    def test_page_megapixels(self):
+        """Test that the page size is read without decoding the image."""
+        path = 'test_resources_page.png'
+        Image.fromarray(np.zeros((1000, 2000), dtype=np.uint8)).save(path)
+        try:
+            self.assertAlmostEqual(page_megapixels(path), 2.0)
+        finally:
+            os.remove(path)
+        self.assertIsNone(page_megapixels('missing.png'))
+
+    def test_cpu_utilization(self):
+        """Test that busy work and CPU time added from workers are counted."""
+        utilization = CpuUtilization(cpu_count=1)
+        deadline = time.perf_counter() + 0.2
+        while time.perf_counter() < deadline:
+            pass
+        share, cpu_seconds, wall_seconds = utilization.report()
+        self.assertGreater(cpu_seconds, 0.1)
+        self.assertGreater(share, 0.5)
+        utilization.add(wall_seconds)
+        self.assertGreater(utilization.report()[0], share)
+
+    def test_reaped_workers_are_not_counted_twice(self):
+        """Test that worker CPU time added with add() is not counted again once the worker is reaped."""
+        utilization = CpuUtilization(cpu_count=1)
+        worker = multiprocessing.Process(target=busy_loop, args=(0.4,))
+        worker.start()
+        worker.join()
+        utilization.add(0.4)
+        _, cpu_seconds, _ = utilization.report()
+        self.assertLess(cpu_seconds, 0.6)
+
+
+def busy_loop(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,237 @@
+import http.client
+import json
+import os
+import shutil
+import signal
+import tempfile
+import threading
+import time
+import unittest
+from unittest.mock import patch
+import cv2
+import numpy as np
+from main import process_service_batch
+from src.service import OcrService, ServiceBusy, create_server
+
+
+def service_settings(**overrides):
+    settings = {
+        "workers": 0,
+        "max_batch": 8,
+        "batch_wait": 0.01,
+        "max_queue": 16,
+        "keep_outputs": False,
+        "request_timeout": 30,
+        "max_upload_bytes": 10 * 1024 * 1024,
+    }
+    settings.update(overrides)
+    return settings
+
+
+def record_worker(requests, output_dir, config):
+    """Records which worker process handled a batch."""
+    with open(os.path.join(output_dir, 'worker.pid'), 'w') as f:
+        f.write(str(os.getpid()))
+    return [True] * len(requests)
+
+
+class TestService(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.work_dir, 'output')
+        self.config_path = os.path.join(self.work_dir, 'config.ini')
+        with open(self.config_path, 'w') as f:
+            f.write('[OCR]\nBackend = stub\n')
+        page = np.full((400, 300, 3), 255, dtype=np.uint8)
+        page[100:120, 40:260] = 0
+        self.png = cv2.imencode('.png', page)[1].tobytes()
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def _start(self, handler, settings):
+        service = OcrService(self.output_dir, self.config_path, handler, settings)
+        server = create_server(service, '127.0.0.1', 0)
+        service.start()
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            service.stop()
+
+        self.addCleanup(stop)
+        return service, server.server_address[1]
+
+    def _request(self, port, method, path, body=None, content_type='image/png'):
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        headers = {'Content-Type': content_type} if body is not None else {}
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        data = json.loads(response.read())
+        connection.close()
+        return response.status, data, response
+
+    @patch('src.normalize_rag.generate_rag_json', return_value=True)
+    def test_ocr_image_and_pdf_page(self, mock_generate_rag_json):
+        """Test that an image and a PDF page are OCR'd and their outputs returned."""
+        _, port = self._start(process_service_batch, service_settings())
+
+        status, body, _ = self._request(port, 'POST', '/ocr', self.png)
+        self.assertEqual(status, 200)
+        self.assertTrue(body['succeeded'])
+        self.assertIn('<alto', body['alto'])
+        self.assertIn('page.png', body['html'])
+        self.assertGreaterEqual(body['latency']['total'], body['latency']['queued'])
+
+        with open('tests/dummy.pdf', 'rb') as f:
+            pdf = f.read()
+        status, body, _ = self._request(port, 'POST', '/ocr?page=1', pdf, 'application/pdf')
+        self.assertEqual(status, 200)
+        self.assertIn('<alto', body['alto'])
+
+        # Outputs are removed once returned.
+        self.assertEqual(os.listdir(os.path.join(self.output_dir, 'service')), [])
+        status, body, _ = self._request(port, 'GET', '/status')
+        self.assertEqual(status, 200)
+        self.assertEqual(body['pending'], 0)
+        self.assertGreaterEqual(body['timings']['service.latency']['count'], 2)
+
+    @patch('src.normalize_rag.generate_rag_json', return_value=True)
+    def test_worker_pool(self, mock_generate_rag_json):
+        """Test that concurrent requests are OCR'd by the worker pool."""
+        service, port = self._start(process_service_batch, service_settings(workers=1))
+        results = []
+
+        def post():
+            results.append(self._request(port, 'POST', '/ocr', self.png)[0])
+
+        clients = [threading.Thread(target=post) for _ in range(3)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        self.assertEqual(results, [200, 200, 200])
+        status, body, _ = self._request(port, 'GET', '/health')
+        self.assertEqual((status, body), (200, {'healthy': True}))
+        self.assertGreaterEqual(service.status()['counters']['service.completed'], 3)
+
+    def test_worker_killed_while_idle(self):
+        """Test that a batch submitted after an idle worker died runs on a new pool."""
+        service, port = self._start(record_worker, service_settings(workers=1))
+        first = service.submit(self.png, '.png')
+        self.assertTrue(first.done.wait(20))
+        with open(os.path.join(self.output_dir, 'worker.pid')) as f:
+            os.kill(int(f.read()), signal.SIGKILL)
+        time.sleep(0.3)
+
+        second = service.submit(self.png, '.png')
+        self.assertTrue(second.done.wait(20))
+        self.assertTrue(second.succeeded)
+        status, body, _ = self._request(port, 'GET', '/health')
+        self.assertEqual((status, body), (200, {'healthy': True}))
+        self.assertEqual(service.status()['pending'], 0)
+
+    def test_dispatcher_survives_errors(self):
+        """Test that a batch that cannot be dispatched fails without stopping the dispatcher."""
+        service, _ = self._start(record_worker, service_settings(workers=1))
+        plan = service._policy.plan
+        with patch.object(service._policy, 'plan', side_effect=[RuntimeError('no plan'), plan(1)]):
+            first = service.submit(self.png, '.png')
+            self.assertTrue(first.done.wait(20))
+            second = service.submit(self.png, '.png')
+            self.assertTrue(second.done.wait(20))
+        self.assertFalse(first.succeeded)
+        self.assertEqual(first.error, 'no plan')
+        self.assertTrue(second.succeeded)
+        self.assertEqual(service.status()['pending'], 0)
+
+    def test_invalid_requests(self):
+        """Test that unsupported uploads and pages are rejected before queueing."""
+        _, port = self._start(process_service_batch, service_settings(max_upload_bytes=100))
+
+        status, _, _ = self._request(port, 'POST', '/ocr', b'text', 'text/plain')
+        self.assertEqual(status, 415)
+        status, _, _ = self._request(port, 'POST', '/ocr?page=0', b'%PDF', 'application/pdf')
+        self.assertEqual(status, 400)
+        status, _, _ = self._request(port, 'POST', '/ocr', self.png)
+        self.assertEqual(status, 413)
+        status, _, _ = self._request(port, 'GET', '/missing')
+        self.assertEqual(status, 404)
+
+    def test_invalid_content_length(self):
+        """Test that a missing or malformed Content-Length is rejected without reading the body."""
+        _, port = self._start(process_service_batch, service_settings())
+
+        def post(content_length):
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+            connection.putrequest('POST', '/ocr')
+            connection.putheader('Content-Type', 'image/png')
+            if content_length is not None:
+                connection.putheader('Content-Length', content_length)
+            connection.endheaders()
+            status = connection.getresponse().status
+            connection.close()
+            return status
+
+        self.assertEqual(post(None), 411)
+        self.assertEqual(post('abc'), 400)
+        self.assertEqual(post('-5'), 400)
+        self.assertEqual(post('1_000'), 400)
+        self.assertEqual(post(str(100 * 1024 * 1024)), 413)
+
+    def test_failed_page(self):
+        """Test that a page that cannot be processed is reported as failed."""
+        _, port = self._start(process_service_batch, service_settings())
+
+        status, body, _ = self._request(port, 'POST', '/ocr', b'not an image')
+        self.assertEqual(status, 422)
+        self.assertFalse(body['succeeded'])
+        self.assertIn('error', body)
+
+    def test_admission_control(self):
+        """Test that requests beyond MaxQueue are turned away with 503."""
+        release = threading.Event()
+
+        def blocking_handler(requests, output_dir, config):
+            release.wait(10)
+            return [True] * len(requests)
+
+        service, port = self._start(blocking_handler, service_settings(max_queue=1))
+        first = service.submit(self.png, '.png')
+        with self.assertRaises(ServiceBusy):
+            service.submit(self.png, '.png')
+        status, _, response = self._request(port, 'POST', '/ocr', self.png)
+        self.assertEqual(status, 503)
+        self.assertEqual(response.getheader('Retry-After'), '1')
+
+        release.set()
+        self.assertTrue(first.done.wait(10))
+        self.assertEqual(service.status()['pending'], 0)
+
+    def test_micro_batching(self):
+        """Test that requests queued while the worker is busy form one batch."""
+        release = threading.Event()
+        batches = []
+
+        def handler(requests, output_dir, config):
+            batches.append(len(requests))
+            release.wait(10)
+            return [True] * len(requests)
+
+        service, _ = self._start(handler, service_settings(max_batch=4))
+        requests = [service.submit(self.png, '.png')]
+        deadline = time.time() + 10
+        while not batches and time.time() < deadline:
+            time.sleep(0.01)
+        requests += [service.submit(self.png, '.png') for _ in range(5)]
+        release.set()
+        for request in requests:
+            self.assertTrue(request.done.wait(10))
+        self.assertEqual(batches, [1, 4, 1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from src.utils.shared_pages import SlabPool
+from src.workers import create_worker_pool, run_task, worker_page_pool
+
+
+def invert_page(buffer, config):
+    """Inverts a page in place in a worker and returns its checksum."""
+    with worker_page_pool().page(buffer) as page:
+        np.invert(page, out=page)
+        return int(page.sum())
+
+
+def page_slab(buffer, config):
+    """Releases a page in a worker and returns its slab and the slabs in use."""
+    pages = worker_page_pool()
+    pages.release(buffer)
+    return buffer.name, pages.in_use()
+
+
+class TestSharedPages(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir = tempfile.mkdtemp()
+        self.config_path = os.path.join(self.work_dir, 'config.ini')
+        with open(self.config_path, 'w') as f:
+            f.write('[OCR]\nBackend = stub\n')
+        self.page = np.random.default_rng(0).integers(0, 256, (600, 400), dtype=np.uint8)
+
+    def tearDown(self):
+        shutil.rmtree(self.work_dir)
+
+    def test_put_and_release(self):
+        """Test that a page round-trips through a slab and its slab is recycled."""
+        with SlabPool(self.page.nbytes, 2) as pool:
+            buffer = pool.put(self.page)
+            self.assertEqual(buffer.shape, (600, 400))
+            np.testing.assert_array_equal(pool.view(buffer), self.page)
+            self.assertEqual(pool.in_use(), 1)
+
+            pool.retain(buffer)
+            pool.release(buffer)
+            self.assertEqual(pool.in_use(), 1)
+            pool.release(buffer)
+            self.assertEqual(pool.in_use(), 0)
+            with self.assertRaises(ValueError):
+                pool.release(buffer)
+
+    def test_bounded_memory(self):
+        """Test that allocation waits for a free slab and rejects oversized pages."""
+        with SlabPool(self.page.nbytes, 2) as pool:
+            first = pool.put(self.page)
+            pool.put(self.page)
+            with self.assertRaises(TimeoutError):
+                pool.put(self.page, timeout=0.05)
+            pool.release(first)
+            self.assertEqual(pool.put(self.page, timeout=0.05).name, first.name)
+            with self.assertRaises(ValueError):
+                pool.allocate((601, 400), np.uint8)
+
+    def test_zero_copy_between_processes(self):
+        """Test that a worker reads and writes a page through its descriptor."""
+        with SlabPool(self.page.nbytes, 2) as pool:
+            executor = create_worker_pool(self.config_path, 1, pages=pool)
+            try:
+                buffer = pool.put(self.page)
+                pool.retain(buffer)
+                outcome = executor.submit(run_task, invert_page, buffer).result()
+                self.assertIsNone(outcome['error'])
+                self.assertEqual(outcome['result'], int((255 - self.page).sum()))
+                # The worker wrote into the slab the parent still holds.
+                np.testing.assert_array_equal(pool.view(buffer), 255 - self.page)
+                self.assertEqual(pool.in_use(), 1)
+                pool.release(buffer)
+
+                buffer = pool.put(self.page)
+                outcome = executor.submit(run_task, page_slab, buffer).result()
+                self.assertEqual(outcome['result'], (buffer.name, 0))
+                self.assertEqual(pool.in_use(), 0)
+            finally:
+                executor.shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
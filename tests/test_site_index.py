@@ -0,0 +1,133 @@
+import os
+import shutil
+import unittest
+from lxml import etree
+from src.site_index import SiteIndex, issue_date_from_name, issue_key, slugify
+
+
+class TestSiteIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.output_dir = 'test_output'
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.site_index = SiteIndex(self.output_dir, page_size=2)
+        self.index_dir = os.path.join(self.output_dir, 'index')
+
+    def tearDown(self):
+        shutil.rmtree(self.output_dir)
+
+    def _links(self, path):
+        tree = etree.parse(path, etree.HTMLParser())
+        return [(a.text, a.get('href')) for a in tree.findall('.//a')]
+
+    def _add_issue(self, date):
+        document = f'chronicle_{date}'
+        return self.site_index.add_document(
+            'The Daily Chronicle', date, document,
+            [('page_001', f'{document}/html/page_001.html'),
+             ('page_002', f'{document}/html/page_002.html')]
+        )
+
+    def test_add_first_document(self):
+        """Test that the first document creates every listing level."""
+        written = self._add_issue('1901-01-01')
+        title_dir = os.path.join(self.index_dir, 'the-daily-chronicle')
+        document_dir = os.path.join(
+            title_dir, '1901-01-01', 'chronicle-1901-01-01'
+        )
+        self.assertEqual(sorted(written), sorted([
+            os.path.join(self.index_dir, 'index.html'),
+            os.path.join(title_dir, 'index.html'),
+            os.path.join(title_dir, '1901-01-01', 'index.html'),
+            os.path.join(document_dir, 'index.html'),
+        ]))
+        self.assertEqual(
+            self._links(os.path.join(self.index_dir, 'index.html')),
+            [('The Daily Chronicle', 'the-daily-chronicle/index.html')]
+        )
+        links = self._links(os.path.join(document_dir, 'index.html'))
+        self.assertEqual(links[0][0], 'page_001')
+        self.assertTrue(os.path.normpath(
+            os.path.join(document_dir, links[0][1])
+        ).endswith(os.path.join(
+            'test_output', 'chronicle_1901-01-01', 'html', 'page_001.html'
+        )))
+
+    def test_new_issue_touches_only_affected_pages(self):
+        """Test that appending issues only rewrites the last listing pages."""
+        self._add_issue('1901-01-01')
+        self._add_issue('1901-01-02')
+        title_dir = os.path.join(self.index_dir, 'the-daily-chronicle')
+
+        # The third issue starts a second listing page, so the first page
+        # is rewritten to gain a "Next" link.
+        written = self._add_issue('1901-01-03')
+        self.assertIn(os.path.join(title_dir, 'index.html'), written)
+        self.assertIn(os.path.join(title_dir, 'index-2.html'), written)
+        self.assertIn(('Next', 'index-2.html'),
+                      self._links(os.path.join(title_dir, 'index.html')))
+
+        # The fourth issue only touches the last page of the listing.
+        written = self._add_issue('1901-01-04')
+        self.assertNotIn(os.path.join(title_dir, 'index.html'), written)
+        self.assertIn(os.path.join(title_dir, 'index-2.html'), written)
+        self.assertNotIn(os.path.join(self.index_dir, 'index.html'), written)
+        self.assertEqual(len(written), 3)
+        self.assertEqual(
+            self._links(os.path.join(title_dir, 'index-2.html')),
+            [('1901-01-03', '1901-01-03/index.html'),
+             ('1901-01-04', '1901-01-04/index.html'),
+             ('Previous', 'index.html')]
+        )
+
+    def test_reprocessed_document_replaces_pages(self):
+        """Test that a reprocessed document replaces its page listing."""
+        self.site_index.add_document(
+            None, None, 'scan', [(f'page_{i}', f'scan/{i}.html')
+                                 for i in range(5)]
+        )
+        written = self.site_index.add_document(
+            None, None, 'scan', [('page_0', 'scan/0.html')]
+        )
+        document_dir = os.path.join(
+            self.index_dir, 'untitled', 'undated', 'scan'
+        )
+        self.assertEqual(written, [os.path.join(document_dir, 'index.html')])
+        self.assertEqual(os.listdir(document_dir), ['index.html'])
+
+    def test_issue_date_from_name(self):
+        """Test that issue dates are recognised in file names."""
+        self.assertEqual(issue_date_from_name('chronicle_19010102_p1.pdf'),
+                         '1901-01-02')
+        self.assertEqual(issue_date_from_name('1901-01-02.png'), '1901-01-02')
+        self.assertIsNone(issue_date_from_name('scan.png'))
+        self.assertEqual(slugify('The Daily Chronicle!'),
+                         'the-daily-chronicle')
+
+
+    def test_issue_date_stays_in_title_directory(self):
+        """Test that a configured publication date cannot add or leave directories."""
+        self.assertEqual(issue_key('1901/01/02'), '1901-01-02')
+        self.assertEqual(issue_key(None), 'undated')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(issue_key('../../etc'), 'etc')
+        with self.assertLogs(level='WARNING'):
+            self.assertEqual(issue_key('..'), 'undated')
+
+        title_dir = os.path.join(self.index_dir, 'the-daily-chronicle')
+        for date in ('1901/01/02', '../../escaped'):
+            written = self.site_index.add_document(
+                'The Daily Chronicle', date, 'chronicle',
+                [('page_001', 'chronicle/html/page_001.html')]
+            )
+            for path in written:
+                self.assertTrue(os.path.abspath(path).startswith(os.path.abspath(self.index_dir)))
+        self.assertEqual(sorted(os.listdir(title_dir)), ['1901-01-02', 'escaped', 'index.html'])
+        self.assertEqual(
+            self._links(os.path.join(title_dir, 'index.html')),
+            [('1901-01-02', '1901-01-02/index.html'), ('escaped', 'escaped/index.html')]
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,209 @@
+import json
+import os
+import shutil
+import signal
+import threading
+import time
+import unittest
+from src.watch import (
+    watch_directory, _StabilityTracker, LEDGER_FILE, STATUS_FILE
+)
+
+
+def record_worker(file_path, output_dir, config):
+    """Records which worker process handled a file."""
+    with open(os.path.join(output_dir, 'handled.tsv'), 'a') as f:
+        f.write(f"{os.path.basename(file_path)}\t{os.getpid()}\n")
+    return True
+
+
+def die_once(file_path, output_dir, config):
+    """Kills the worker process the first time it is called."""
+    marker = os.path.join(output_dir, 'died')
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os.kill(os.getpid(), signal.SIGKILL)
+    return record_worker(file_path, output_dir, config)
+
+
+class TestWatch(unittest.TestCase):
+
+    def setUp(self):
+        self.input_dir = 'test_input'
+        self.output_dir = 'test_output'
+        self.config_path = 'test_config.ini'
+        os.makedirs(self.input_dir, exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(self.config_path, 'w') as f:
+            f.write('[OCR]\n')
+            f.write('PSM = 3\n')
+        self.processed = []
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+        shutil.rmtree(self.output_dir)
+        os.remove(self.config_path)
+
+    def _handler(self, file_path, output_dir, config):
+        self.processed.append(os.path.basename(file_path))
+        return config.get('OCR', 'PSM') == '3'
+
+    def _watch_until(self, use_inotify, condition, timeout=10):
+        stop_event = threading.Event()
+        settings = {
+            "workers": 0,
+            "poll_interval": 0.05,
+            "settle_seconds": 0.1,
+            "use_inotify": use_inotify,
+        }
+        thread = threading.Thread(
+            target=watch_directory,
+            args=(self.input_dir, self.output_dir, self.config_path,
+                  self._handler, lambda name: name.endswith('.png'),
+                  settings, stop_event),
+        )
+        thread.start()
+        try:
+            deadline = time.time() + timeout
+            while not condition() and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop_event.set()
+            thread.join()
+
+    def test_existing_and_new_files_are_processed_once(self):
+        """Test that files present at start-up and new files are processed."""
+        with open(os.path.join(self.input_dir, 'old.png'), 'wb') as f:
+            f.write(b'old')
+        with open(os.path.join(self.input_dir, 'notes.txt'), 'wb') as f:
+            f.write(b'ignored')
+
+        def write_new_file():
+            time.sleep(0.3)
+            with open(os.path.join(self.input_dir, 'new.png'), 'wb') as f:
+                f.write(b'new')
+
+        writer = threading.Thread(target=write_new_file)
+        writer.start()
+        self._watch_until(False, lambda: len(self.processed) >= 2)
+        writer.join()
+
+        self.assertEqual(sorted(self.processed), ['new.png', 'old.png'])
+        with open(os.path.join(self.output_dir, 'logs', STATUS_FILE)) as f:
+            status = json.load(f)
+        self.assertEqual(status['source'], 'polling')
+        self.assertTrue(status['healthy'])
+
+        # A restarted service skips files recorded in the ledger.
+        self.processed.clear()
+        self._watch_until(False, lambda: False, timeout=0.5)
+        self.assertEqual(self.processed, [])
+        with open(os.path.join(self.output_dir, 'logs', LEDGER_FILE)) as f:
+            self.assertEqual(len(f.readlines()), 2)
+
+    def _handled(self):
+        path = os.path.join(self.output_dir, 'handled.tsv')
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return dict(line.rstrip('\n').split('\t') for line in f)
+
+    def test_worker_killed_while_idle(self):
+        """Test that the service restarts the pool when an idle worker dies and retries the file."""
+        with open(os.path.join(self.input_dir, 'first.png'), 'wb') as f:
+            f.write(b'first')
+        stop_event = threading.Event()
+        settings = {
+            "workers": 1,
+            "poll_interval": 0.05,
+            "settle_seconds": 0.1,
+            "use_inotify": False,
+        }
+        errors = []
+
+        def run():
+            try:
+                watch_directory(self.input_dir, self.output_dir, self.config_path,
+                                record_worker, lambda name: name.endswith('.png'),
+                                settings, stop_event)
+            except Exception as e:  # pylint: disable=broad-except
+                errors.append(e)
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        try:
+            deadline = time.time() + 20
+            while 'first.png' not in self._handled() and time.time() < deadline:
+                time.sleep(0.05)
+            os.kill(int(self._handled()['first.png']), signal.SIGKILL)
+            time.sleep(0.3)
+            with open(os.path.join(self.input_dir, 'second.png'), 'wb') as f:
+                f.write(b'second')
+            while 'second.png' not in self._handled() and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop_event.set()
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertIn('second.png', self._handled())
+
+    def test_worker_killed_while_busy(self):
+        """Test that a file whose worker died while processing it is retried."""
+        with open(os.path.join(self.input_dir, 'scan.png'), 'wb') as f:
+            f.write(b'scan')
+        stop_event = threading.Event()
+        settings = {
+            "workers": 1,
+            "poll_interval": 0.05,
+            "settle_seconds": 0.1,
+            "use_inotify": False,
+        }
+        thread = threading.Thread(target=watch_directory, args=(
+            self.input_dir, self.output_dir, self.config_path, die_once,
+            lambda name: name.endswith('.png'), settings, stop_event))
+        ledger_path = os.path.join(self.output_dir, 'logs', LEDGER_FILE)
+        thread.start()
+        try:
+            deadline = time.time() + 20
+            while not os.path.exists(ledger_path) and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop_event.set()
+            thread.join()
+        self.assertTrue(os.path.exists(os.path.join(self.output_dir, 'died')))
+        self.assertIn('scan.png', self._handled())
+        with open(ledger_path) as f:
+            self.assertEqual([line.split('\t')[0] for line in f], ['scan.png'])
+
+    def test_inotify_source(self):
+        """Test that files written while watching are picked up."""
+        def write_new_file():
+            time.sleep(0.3)
+            with open(os.path.join(self.input_dir, 'scan.png'), 'wb') as f:
+                f.write(b'scan')
+
+        writer = threading.Thread(target=write_new_file)
+        writer.start()
+        self._watch_until(True, lambda: len(self.processed) >= 1)
+        writer.join()
+        self.assertEqual(self.processed, ['scan.png'])
+
+    def test_stability_tracker_waits_for_writes_to_finish(self):
+        """Test that a file is only ready once it stopped changing."""
+        path = os.path.join(self.input_dir, 'growing.png')
+        with open(path, 'wb') as f:
+            f.write(b'a')
+        tracker = _StabilityTracker(settle_seconds=1.0)
+        tracker.add(path)
+        self.assertEqual(tracker.ready(0.0), [])
+        with open(path, 'ab') as f:
+            f.write(b'b')
+        self.assertEqual(tracker.ready(0.9), [])
+        self.assertEqual(tracker.ready(1.5), [])
+        ready = tracker.ready(2.0)
+        self.assertEqual([p for p, _ in ready], [path])
+        self.assertEqual(len(tracker), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()